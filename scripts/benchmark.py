@@ -0,0 +1,326 @@
+"""
+Benchmarks for the ckcmd wrapper and batch conversions, run against the stand-in fakeckcmd.py.
+
+Run with `python -m skymaya.benchmark`. Actor scaling is measured with the Maya-free ckcmd and pipeline modules, so it
+runs anywhere. Timing convertDataDirectory itself imports skymaya.main, so that part only runs under mayapy and is
+skipped elsewhere.
+"""
+
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import functools
+import tempfile
+import subprocess
+import multiprocessing
+
+from skymaya import ckcmd
+from skymaya import pipeline
+
+# The stand-in ck-cmd script
+FAKE_CKCMD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakeckcmd.py')
+
+
+def make_data_directory(root, actors=10, animations=20, dlc=None):
+    """
+    Creates a synthetic Skyrim data directory for benchmarking.
+
+    Args:
+        root(str): The data directory to create.
+        actors(int): The number of actors to create.
+        animations(int): The number of animation hkx files per actor.
+        dlc(int): An optional dlc number to create the actors in.
+
+    Returns:
+        str: The data directory.
+    """
+    actors_dir = os.path.join(root, 'meshes', 'actors')
+    if dlc:
+        actors_dir = os.path.join(actors_dir, 'dlc0%s' % dlc)
+    animation_data = os.path.join(root, 'meshes', 'animationdata')
+
+    def write(path, size=1024):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+    for index in range(actors):
+        actor = 'actor%04d' % index
+        actor_dir = os.path.join(actors_dir, actor)
+        write(os.path.join(actor_dir, 'character assets', 'skeleton.hkx'))
+        write(os.path.join(actor_dir, 'character assets', 'skeleton.nif'))
+        write(os.path.join(actor_dir, 'behaviors', '%sbehavior.hkx' % actor))
+        for animation in range(animations):
+            write(os.path.join(actor_dir, 'animations', 'animation%03d.hkx' % animation), size=16 * 1024)
+        write(os.path.join(animation_data, '%s.txt' % actor), size=256)
+    return root
+
+
+def time_function(function, *args, **kwargs):
+    """ Returns the number of seconds a function call takes. """
+    start = time.time()
+    function(*args, **kwargs)
+    return time.time() - start
+
+
+def bench_wrapper_overhead(directory, runs=20):
+    """
+    Compares converting a single animation through ckcmd.exportanimation against starting ck-cmd directly.
+
+    Args:
+        directory(str): A scratch directory.
+        runs(int): The number of conversions to time.
+
+    Returns:
+        dict: Seconds per call for the raw process and the wrapper, and the wrapper overhead.
+    """
+    root = make_data_directory(os.path.join(directory, 'overhead'), actors=1, animations=1)
+    actor_dir = os.path.join(root, 'meshes', 'actors', 'actor0000')
+    skeleton = os.path.join(actor_dir, 'character assets', 'skeleton.hkx')
+    animation = os.path.join(actor_dir, 'animations', 'animation000.hkx')
+    output = os.path.join(actor_dir, 'tags')
+    os.makedirs(output)
+
+    command = ckcmd.executable() + ['exportanimation', skeleton, animation, output]
+    with open(os.devnull, 'w') as devnull:
+        raw = time_function(lambda: [subprocess.call(command, stdout=devnull) for _ in range(runs)]) / runs
+    wrapped = time_function(lambda: [ckcmd.exportanimation(skeleton, animation, output) for _ in range(runs)]) / runs
+    return {'raw': raw, 'wrapped': wrapped, 'overhead': wrapped - raw}
+
+
+def bench_batch_throughput(directory, animations=200, shards=(1, 2, 4, 8)):
+    """
+    Measures how many animations per second exportanimation converts from one directory at each shard count.
+
+    Args:
+        directory(str): A scratch directory.
+        animations(int): The number of animations to convert.
+        shards(list): The shard counts to time.
+
+    Returns:
+        dict: Animations per second keyed by shard count.
+    """
+    root = make_data_directory(os.path.join(directory, 'throughput'), actors=1, animations=animations)
+    actor_dir = os.path.join(root, 'meshes', 'actors', 'actor0000')
+    skeleton = os.path.join(actor_dir, 'character assets', 'skeleton.hkx')
+    results = {}
+    for count in shards:
+        output = os.path.join(actor_dir, 'tags%s' % count)
+        os.makedirs(output)
+        seconds = time_function(ckcmd.exportanimation, skeleton, os.path.join(actor_dir, 'animations'), output,
+                                shards=count)
+        results[count] = animations / seconds
+    return results
+
+
+def get_actor_paths(root, actor):
+    """
+    Gets the files of a synthetic actor created by make_data_directory().
+
+    Returns:
+        dict: The actor's skeleton, nif, animations, behaviors, cache, rig and tags paths.
+    """
+    actor_dir = os.path.join(root, 'meshes', 'actors', actor)
+    paths = {
+        'skeleton': os.path.join(actor_dir, 'character assets', 'skeleton.hkx'),
+        'nif': os.path.join(actor_dir, 'character assets', 'skeleton.nif'),
+        'animations': os.path.join(actor_dir, 'animations'),
+        'behaviors': os.path.join(actor_dir, 'behaviors'),
+        'cache': os.path.join(root, 'meshes', 'animationdata', '%s.txt' % actor),
+        'rig': os.path.join(actor_dir, 'character assets'),
+        'tags': os.path.join(actor_dir, 'tags'),
+    }
+    if not os.path.exists(paths['tags']):
+        os.makedirs(paths['tags'])
+    return paths
+
+
+def export_rig(paths):
+    """ Converts a synthetic actor's rig the way main.convertActor() does. """
+    ckcmd.exportrig(paths['skeleton'], paths['nif'], paths['rig'], animation_hkx=paths['animations'],
+                    cache_txt=paths['cache'], behavior_directory=paths['behaviors'])
+
+
+def export_animations(paths, shards=1):
+    """ Converts a synthetic actor's animations the way main.convertActor() does. """
+    ckcmd.exportanimation(paths['skeleton'], paths['animations'], paths['tags'], shards=shards)
+
+
+def bench_actor_scaling(directory, actors=(10, 100, 1000), workers=(1, 4), animations=20, shards=1):
+    """
+    Measures how converting a data directory's actors on ckcmd.run_parallel scales with the number of actors and
+    workers, converting each actor's rig and then its animations as convertDataDirectory does.
+
+    Args:
+        directory(str): A scratch directory.
+        actors(list): The actor counts to time.
+        workers(list): The worker counts to time.
+        animations(int): The number of animations per actor.
+        shards(int): The number of ck-cmd processes to split each actor's animations across.
+
+    Returns:
+        dict: Actors per second keyed by (actor count, worker count).
+    """
+    def convert_actor(paths):
+        export_rig(paths)
+        export_animations(paths, shards=shards)
+
+    results = {}
+    for count in actors:
+        root = make_data_directory(os.path.join(directory, 'data%s' % count), actors=count, animations=animations)
+        functions = [functools.partial(convert_actor, get_actor_paths(root, 'actor%04d' % index))
+                     for index in range(count)]
+        for worker_count in workers:
+            seconds = time_function(ckcmd.run_parallel, functions, workers=worker_count)
+            results[(count, worker_count)] = count / seconds
+    return results
+
+
+def bench_pipeline(directory, actors=(10, 100, 1000), workers=(1, 4), animations=20):
+    """
+    Measures how a pipeline.Pipeline of every actor's rig and animation conversions scales with the number of actors
+    and workers. Each actor's animations depend on its rig, actors are independent of each other.
+
+    Args:
+        directory(str): A scratch directory.
+        actors(list): The actor counts to time.
+        workers(list): The worker counts to time.
+        animations(int): The number of animations per actor.
+
+    Returns:
+        dict: Actors per second keyed by (actor count, worker count).
+    """
+    results = {}
+    for count in actors:
+        root = make_data_directory(os.path.join(directory, 'pipeline%s' % count), actors=count,
+                                   animations=animations)
+        for worker_count in workers:
+            graph = pipeline.Pipeline('Benchmark %s actors' % count)
+            for index in range(count):
+                actor = 'actor%04d' % index
+                paths = get_actor_paths(root, actor)
+                graph.add('%s rig' % actor, functools.partial(export_rig, paths))
+                graph.add('%s animations' % actor, functools.partial(export_animations, paths),
+                          dependencies=['%s rig' % actor])
+            seconds = time_function(graph.run, workers=worker_count, force=True)
+            results[(count, worker_count)] = count / seconds
+    return results
+
+
+def bench_convert_data_directory(directory, actors=(10, 100, 1000), workers=(1, 4), animations=20):
+    """
+    Measures how convertDataDirectory scales with the number of actors and workers.
+
+    Args:
+        directory(str): A scratch directory.
+        actors(list): The actor counts to time.
+        workers(list): The worker counts to time.
+        animations(int): The number of animations per actor.
+
+    Returns:
+        dict: Actors per second keyed by (actor count, worker count), or None outside of mayapy.
+    """
+    try:
+        from skymaya import main
+    except ImportError:
+        return None
+
+    results = {}
+    for count in actors:
+        root = make_data_directory(os.path.join(directory, 'maya%s' % count), actors=count, animations=animations)
+        for worker_count in workers:
+            seconds = time_function(main.convertDataDirectory, root, workers=worker_count)
+            results[(count, worker_count)] = count / seconds
+    return results
+
+
+def run(actors=(10, 100, 1000), workers=None, animations=20, latency=0.0, runs=20, directory=None):
+    """
+    Runs every benchmark against the fake ck-cmd and prints the results.
+    The cache and ledger are disabled while benchmarking, as they are by default. The wrapper overhead is also measured
+    with the ledger recording to the scratch directory, to show what recording metrics costs.
+
+    Args:
+        actors(list): The actor counts for the convertDataDirectory benchmark.
+        workers(list): The worker counts for the convertDataDirectory benchmark, defaults to 1 and the cpu count.
+        animations(int): The number of animations per actor.
+        latency(float): Seconds the fake ck-cmd spends per converted file.
+        runs(int): The number of calls to time for the wrapper overhead benchmark.
+        directory(str): A scratch directory to keep, defaults to a temporary directory that is removed.
+
+    Returns:
+        dict: The results of each benchmark.
+    """
+    workers = workers or sorted(set([1, multiprocessing.cpu_count()]))
+    scratch = directory or tempfile.mkdtemp(prefix='skymaya_benchmark_')
+    settings = ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER, os.environ.get('FAKE_CKCMD_LATENCY')
+    ckcmd.set_executable(FAKE_CKCMD)
+    ckcmd.CACHE = None
+    ckcmd.LEDGER = None
+    ckcmd.SERVER = None
+    os.environ['FAKE_CKCMD_LATENCY'] = str(latency)
+
+    # Keep ck-cmd output out of the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        ckcmd.LEDGER = os.path.join(scratch, 'ledger.jsonl')
+        ledger_overhead = bench_wrapper_overhead(os.path.join(scratch, 'ledger'), runs=runs)
+        ckcmd.LEDGER = None
+        results = {
+            'overhead': bench_wrapper_overhead(scratch, runs=runs),
+            'ledger_overhead': ledger_overhead,
+            'throughput': bench_batch_throughput(scratch, animations=max(animations, 100)),
+            'scaling': bench_actor_scaling(scratch, actors=actors, workers=workers, animations=animations),
+            'pipeline': bench_pipeline(scratch, actors=actors, workers=workers, animations=animations),
+            'maya': bench_convert_data_directory(scratch, actors=actors, workers=workers, animations=animations),
+        }
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER, latency_setting = settings
+        if latency_setting is None:
+            del os.environ['FAKE_CKCMD_LATENCY']
+        else:
+            os.environ['FAKE_CKCMD_LATENCY'] = latency_setting
+        if directory is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    for name, title in [('overhead', 'Wrapper overhead'), ('ledger_overhead', 'Wrapper overhead with the ledger')]:
+        overhead = results[name]
+        print '%s: %.1f ms per call (%.1f ms raw, %.1f ms wrapped)' % (
+            title, overhead['overhead'] * 1000, overhead['raw'] * 1000, overhead['wrapped'] * 1000)
+    print 'Batch throughput:'
+    for count, rate in sorted(results['throughput'].items()):
+        print '    %2s shards: %8.1f animations/s' % (count, rate)
+    for name, title in [('scaling', 'Actor scaling'), ('pipeline', 'Pipeline scaling'),
+                        ('maya', 'convertDataDirectory scaling')]:
+        print '%s:' % title
+        if results[name] is None:
+            print '    skipped, requires mayapy'
+            continue
+        for (count, worker_count), rate in sorted(results[name].items()):
+            print '    %5s actors, %2s workers: %8.1f actors/s' % (count, worker_count, rate)
+    return results
+
+
+def main(argv=None):
+    """ Runs the benchmarks from the command line. """
+    parser = argparse.ArgumentParser(description='Benchmarks the ckcmd wrapper against a fake ck-cmd.')
+    parser.add_argument('--actors', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--workers', type=int, nargs='+', default=None)
+    parser.add_argument('--animations', type=int, default=20, help='Animations per actor.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake ck-cmd seconds per converted file.')
+    parser.add_argument('--runs', type=int, default=20, help='Calls timed for the wrapper overhead.')
+    parser.add_argument('--directory', default=None, help='A scratch directory to keep.')
+    args = parser.parse_args(argv)
+    run(actors=args.actors, workers=args.workers, animations=args.animations, latency=args.latency,
+        runs=args.runs, directory=args.directory)
+
+
+if __name__ == '__main__':
+    main()
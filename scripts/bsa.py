@@ -0,0 +1,473 @@
+"""
+A reader and packer for Skyrim BSA archives.
+
+Archives are memory mapped and indexed from their headers, so individual files can be read without unpacking the
+whole archive. Skyrim (version 104) archives use zlib compression, Skyrim Special Edition (version 105) archives use
+lz4, which requires the optional lz4 package.
+"""
+
+
+import os
+import sys
+import mmap
+import json
+import zlib
+import struct
+import hashlib
+import multiprocessing
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+SKYRIM = 104
+SKYRIM_SE = 105
+
+# Archive flags
+INCLUDE_DIRECTORY_NAMES = 0x1
+INCLUDE_FILE_NAMES = 0x2
+COMPRESSED = 0x4
+EMBED_FILE_NAMES = 0x100
+
+# File flags, describing the content of an archive
+FILE_FLAGS = {'meshes': 0x1, 'textures': 0x2, 'interface': 0x4, 'sound': 0x8, 'music': 0x8}
+MISC = 0x100
+
+# File size flags
+COMPRESSION_TOGGLE = 0x40000000
+SIZE_MASK = 0x3FFFFFFF
+
+HEADER = struct.Struct('<4sIIIIIIII')
+FOLDER_RECORD = {SKYRIM: struct.Struct('<QII'), SKYRIM_SE: struct.Struct('<QIIQ')}
+FILE_RECORD = struct.Struct('<QII')
+
+# The official archives in the order the game loads them, later archives override files in earlier ones
+LOAD_ORDER = ['skyrim - misc', 'skyrim - shaders', 'skyrim - textures', 'skyrim - interface', 'skyrim - animations',
+              'skyrim - meshes', 'skyrim - sounds', 'skyrim - voices', 'skyrim - voicesextra', 'update', 'dawnguard',
+              'hearthfires', 'dragonborn']
+
+
+def normalize(path):
+    """ Converts a path relative to a data directory to the lower case, backslash separated form archives use. """
+    return path.replace('/', '\\').strip('\\').lower()
+
+
+def hash_name(name, extension=''):
+    """
+    Hashes a folder path or file name the way archives sort and look up their records.
+
+    Args:
+        name(str): A normalized folder path, or a file name without its extension.
+        extension(str): A file extension including the dot.
+
+    Returns:
+        int: A 64 bit hash.
+    """
+    chars = [ord(c) for c in name]
+    if len(chars) == 0:
+        return 0
+    result = chars[-1] | (chars[-2] << 8 if len(chars) >= 3 else 0) | len(chars) << 16 | chars[0] << 24
+    if len(chars) >= 4:
+        value = 0
+        for c in chars[1:-2]:
+            value = (value * 0x1003F + c) & 0xFFFFFFFF
+        result += value << 32
+    if extension:
+        result |= {'.kf': 0x80, '.nif': 0x8000, '.dds': 0x8080, '.wav': 0x80000000}.get(extension, 0)
+        value = 0
+        for c in extension:
+            value = (value * 0x1003F + ord(c)) & 0xFFFFFFFF
+        result += value << 32
+    return result & 0xFFFFFFFFFFFFFFFF
+
+
+def hash_file(name):
+    """ Hashes a file name including its extension. """
+    stem, extension = os.path.splitext(name)
+    return hash_name(stem, extension)
+
+
+def load_order(filename):
+    """
+    Gets a key that sorts archive file names in the order the game loads them.
+    The vanilla archives load in the order of Skyrim.ini's sResourceArchiveList, followed by the update and dlc
+    archives. Any other archive, such as a plugin's, loads after them in alphabetical order.
+
+    Args:
+        filename(str): An archive file name.
+
+    Returns:
+        tuple: A sort key.
+    """
+    name = os.path.splitext(os.path.basename(filename))[0].lower()
+    base = name.rstrip('0123456789')  # Special Edition splits large archives, such as Skyrim - Meshes0.bsa
+    if base in LOAD_ORDER:
+        return LOAD_ORDER.index(base), name
+    return len(LOAD_ORDER), name
+
+
+def find_archives(root):
+    """
+    Lists the BSA archives in a data directory in load order, see load_order().
+
+    Args:
+        root(str): A data directory.
+
+    Returns:
+        list: A list of archive paths, archives loaded later override earlier ones.
+    """
+    if not os.path.isdir(root):
+        return []
+    return [os.path.join(root, filename) for filename in sorted(os.listdir(root), key=load_order)
+            if filename.lower().endswith('.bsa')]
+
+
+class Entry(object):
+    """ The location of a file within an archive. """
+
+    __slots__ = ['path', 'offset', 'size', 'compressed']
+
+    def __init__(self, path, offset, size, compressed):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self.compressed = compressed
+
+
+class Archive(object):
+    """ A memory mapped BSA archive. """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._read_index()
+        except BsaException:
+            self.close()
+            raise
+        except (ValueError, struct.error, EnvironmentError) as e:
+            self.close()
+            raise BsaException('Failed to read archive "%s": %s' % (path, e))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, path):
+        return normalize(path) in self.entries
+
+    def close(self):
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_index(self):
+        """ Builds the file index from the folder records, file records and file name block. """
+        data = self._map
+        magic, self.version, offset, self.flags, folder_count, file_count, folder_names_length, file_names_length, \
+            self.file_flags = HEADER.unpack_from(data, 0)
+        if magic != b'BSA\x00':
+            raise BsaException('"%s" is not a BSA archive.' % self.path)
+        if self.version not in FOLDER_RECORD:
+            raise BsaException('Unsupported BSA version %s in "%s".' % (self.version, self.path))
+        if not self.flags & INCLUDE_DIRECTORY_NAMES or not self.flags & INCLUDE_FILE_NAMES:
+            raise BsaException('Archive "%s" does not include file names.' % self.path)
+
+        # Folder records give the number of files in each folder
+        folder_record = FOLDER_RECORD[self.version]
+        counts = [folder_record.unpack_from(data, offset + index * folder_record.size)[1]
+                  for index in range(folder_count)]
+
+        # Each folder's name is followed by its file records
+        position = offset + folder_count * folder_record.size
+        records = []
+        for count in counts:
+            length = struct.unpack_from('<B', data, position)[0]
+            folder = data[position + 1:position + length].decode('cp1252')
+            position += 1 + length
+            for index in range(count):
+                name_hash, size, file_offset = FILE_RECORD.unpack_from(data, position)
+                records.append((folder, size, file_offset))
+                position += FILE_RECORD.size
+
+        # File names follow every file record in the same order, each null terminated
+        for folder, size, file_offset in records:
+            end = data.find(b'\x00', position)
+            name = data[position:end].decode('cp1252')
+            position = end + 1
+            path = normalize('%s\\%s' % (folder, name))
+            compressed = bool(self.flags & COMPRESSED) != bool(size & COMPRESSION_TOGGLE)
+            self.entries[path] = Entry(path, file_offset, size & SIZE_MASK, compressed)
+
+    def files(self, prefix=''):
+        """
+        Lists the files in the archive.
+
+        Args:
+            prefix(str): An optional folder or path prefix to filter by.
+
+        Returns:
+            list: A sorted list of normalized file paths.
+        """
+        prefix = normalize(prefix)
+        return sorted(path for path in self.entries if path.startswith(prefix))
+
+    def read_raw(self, path):
+        """
+        Reads a single file's data as stored, without decompressing it.
+
+        Args:
+            path(str): A path relative to the data directory.
+
+        Returns:
+            tuple: The stored bytes, and whether they are compressed.
+        """
+        entry = self.entries.get(normalize(path))
+        if entry is None:
+            raise BsaException('"%s" is not in archive "%s".' % (path, self.path))
+        position, size = entry.offset, entry.size
+        if self.flags & EMBED_FILE_NAMES:
+            length = struct.unpack_from('<B', self._map, position)[0]
+            position += 1 + length
+            size -= 1 + length
+        return self._map[position:position + size], entry.compressed
+
+    def read(self, path):
+        """
+        Reads and decompresses a single file.
+
+        Args:
+            path(str): A path relative to the data directory.
+
+        Returns:
+            bytes: The file contents.
+        """
+        data, compressed = self.read_raw(path)
+        if not compressed:
+            return data
+
+        original_size = struct.unpack_from('<I', data, 0)[0]
+        if self.version == SKYRIM_SE:
+            if lz4 is None:
+                raise BsaException('Reading "%s" requires the lz4 package.' % self.path)
+            data = lz4.frame.decompress(data[4:])
+        else:
+            data = zlib.decompress(data[4:])
+        if len(data) != original_size:
+            raise BsaException('"%s" in archive "%s" is corrupt.' % (path, self.path))
+        return data
+
+    def extract(self, path, directory):
+        """
+        Writes a single file to a data directory, replacing an existing file rather than writing over it.
+
+        Args:
+            path(str): A path relative to the data directory.
+            directory(str): The data directory to write the file to.
+
+        Returns:
+            str: The written file path.
+        """
+        output = os.path.join(directory, *normalize(path).split('\\'))
+        if not os.path.exists(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+        if os.path.lexists(output):
+            os.remove(output)  # Never write through a hard link shared with other workspaces
+        with open(output, 'wb') as f:
+            f.write(self.read(path))
+        return output
+
+
+def extract_files(archives, match, directory):
+    """
+    Extracts every file matching a filter from a list of archives. Files found in more than one archive are extracted
+    from the last, matching the game where later archives override earlier ones.
+
+    Args:
+        archives(list): A list of Archives in load order, see find_archives().
+        match(function): A function taking a normalized file path and returning whether to extract it.
+        directory(str): The data directory to write files to.
+
+    Returns:
+        list: The written file paths.
+    """
+    extracted = set()
+    outputs = []
+    for archive in reversed(archives):
+        for path in archive.files():
+            if path not in extracted and match(path):
+                outputs.append(archive.extract(path, directory))
+                extracted.add(path)
+    return outputs
+
+
+def _compress(args):
+    """ Reads a file and returns its sha1 and the data to store for it, run in a worker process. """
+    path, version, compress = args
+    with open(path, 'rb') as f:
+        data = f.read()
+    sha = hashlib.sha1(data).hexdigest()
+    if compress:
+        if version == SKYRIM_SE:
+            data = struct.pack('<I', len(data)) + lz4.frame.compress(data)
+        else:
+            data = struct.pack('<I', len(data)) + zlib.compress(data)
+    return sha, data
+
+
+def _pool(processes):
+    """ Creates a process pool. Maya's own executable cannot run workers, so mayapy is used instead. """
+    executable = os.path.basename(sys.executable).lower()
+    if executable.startswith('maya') and not executable.startswith('mayapy'):
+        multiprocessing.set_executable(
+            os.path.join(os.path.dirname(sys.executable), 'mayapy.exe' if os.name == 'nt' else 'mayapy'))
+    return multiprocessing.Pool(processes)
+
+
+def pack(files, path, version=SKYRIM, compress=True, processes=None):
+    """
+    Writes files to a BSA archive.
+    Files are compressed across a process pool. A manifest of each file's size, mtime and sha1 is kept next to the
+    archive, and files that are unchanged since the archive was last packed reuse their compressed data.
+
+    Args:
+        files(dict): A dictionary of file paths keyed by their path relative to the data directory.
+        path(str): The archive path to write.
+        version(int): Either SKYRIM or SKYRIM_SE.
+        compress(bool): Whether to compress files.
+        processes(int): The number of compression processes, defaults to the cpu count.
+
+    Returns:
+        int: The number of files whose compressed data was reused.
+    """
+    if version not in FOLDER_RECORD:
+        raise BsaException('Unsupported BSA version %s.' % version)
+    if compress and version == SKYRIM_SE and lz4 is None:
+        raise BsaException('Packing Special Edition archives requires the lz4 package.')
+
+    # Sort folders and their files by hash, the order the game expects
+    folders = {}
+    for name, filepath in files.items():
+        folder, filename = normalize(name).rsplit('\\', 1)
+        folders.setdefault(folder, []).append((hash_file(filename), filename, filepath))
+    folders = sorted((hash_name(folder), folder, sorted(entries)) for folder, entries in folders.items())
+    ordered = [('%s\\%s' % (folder, filename), filepath)
+               for folder_hash, folder, entries in folders for file_hash, filename, filepath in entries]
+
+    # Find files that have not changed since the previous archive
+    manifest_path = path + '.json'
+    previous = {}
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['version'] == version and manifest['compressed'] == compress and os.path.exists(path):
+            previous = manifest['files']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    fingerprints = {}
+    for name, filepath in ordered:
+        stat = os.stat(filepath)
+        fingerprints[name] = [stat.st_size, stat.st_mtime]
+    old = None
+    if previous:
+        try:
+            old = Archive(path)
+        except BsaException:
+            previous = {}  # Repack a corrupt previous archive from scratch
+    reused = set(name for name, filepath in ordered
+                 if previous.get(name, [None, None])[:2] == fingerprints[name] and name in old.entries)
+
+    def results():
+        jobs = [(filepath, version, compress) for name, filepath in ordered if name not in reused]
+        pool = _pool(processes) if len(jobs) > 1 and processes != 1 else None
+        try:
+            if pool is not None:
+                compressed = pool.imap(_compress, jobs, chunksize=4)
+            else:
+                compressed = (_compress(job) for job in jobs)
+            for name, filepath in ordered:
+                if name in reused:
+                    yield previous[name][2], old.read_raw(name)[0]
+                else:
+                    yield next(compressed)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    # Data follows the header, folder records, file record blocks and file names
+    folder_record = FOLDER_RECORD[version]
+    folder_names_length = sum(len(folder) + 1 for folder_hash, folder, entries in folders)
+    file_names_length = sum(len(filename) + 1 for folder_hash, folder, entries in folders
+                            for file_hash, filename, filepath in entries)
+    records_offset = HEADER.size + len(folders) * folder_record.size
+    names_offset = records_offset + sum(2 + len(folder) + len(entries) * FILE_RECORD.size
+                                        for folder_hash, folder, entries in folders)
+    data_offset = names_offset + file_names_length
+
+    # Write each file's data first, then fill in the records now that every offset and size is known
+    shas = {}
+    records = []
+    staging = path + '.tmp'
+    try:
+        with open(staging, 'wb') as f:
+            f.seek(data_offset)
+            for (name, filepath), (sha, data) in zip(ordered, results()):
+                records.append((f.tell(), len(data)))
+                shas[name] = sha
+                f.write(data)
+
+            f.seek(0)
+            file_flags = 0
+            for folder_hash, folder, entries in folders:
+                file_flags |= FILE_FLAGS.get(folder.split('\\')[0], MISC)
+            flags = INCLUDE_DIRECTORY_NAMES | INCLUDE_FILE_NAMES | (COMPRESSED if compress else 0)
+            f.write(HEADER.pack(b'BSA\x00', version, HEADER.size, flags, len(folders), len(ordered),
+                                folder_names_length, file_names_length, file_flags))
+
+            position = records_offset
+            for folder_hash, folder, entries in folders:
+                offset = position + file_names_length
+                if version == SKYRIM_SE:
+                    f.write(folder_record.pack(folder_hash, len(entries), 0, offset))
+                else:
+                    f.write(folder_record.pack(folder_hash, len(entries), offset))
+                position += 2 + len(folder) + len(entries) * FILE_RECORD.size
+
+            index = 0
+            for folder_hash, folder, entries in folders:
+                f.write(struct.pack('<B', len(folder) + 1) + folder.encode('cp1252') + b'\x00')
+                for file_hash, filename, filepath in entries:
+                    offset, size = records[index]
+                    f.write(FILE_RECORD.pack(file_hash, size, offset))
+                    index += 1
+            for folder_hash, folder, entries in folders:
+                for file_hash, filename, filepath in entries:
+                    f.write(filename.encode('cp1252') + b'\x00')
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    finally:
+        if old is not None:
+            old.close()
+
+    # Replace the previous archive and its manifest
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(staging, path)
+    with open(manifest_path, 'w') as f:
+        json.dump({'version': version, 'compressed': compress,
+                   'files': dict((name, fingerprints[name] + [shas[name]]) for name in shas)}, f)
+    return len(reused)
+
+
+class BsaException(BaseException):
+    """ Raised for archives that cannot be read. """
@@ -2,34 +2,678 @@
 
 
 import os
+import re
+import sys
+import time
+import socket
+import json
+import signal
+import shutil
+import hashlib
+import datetime
 import tempfile
+import functools
+import threading
 import subprocess
+import multiprocessing
+from multiprocessing.connection import Client, AuthenticationError
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-# Local location of ckcmd.exe
-CKCMD = os.path.join(os.path.dirname(__file__), 'bin', 'ck-cmd.exe')
+try:
+    from maya import utils as maya_utils
+except ImportError:
+    maya_utils = None
 
 
-def run_command(command, directory='/'):
+# Local location of ckcmd.exe, overridden by the SKYMAYA_CKCMD environment variable or set_executable()
+CKCMD = os.environ.get('SKYMAYA_CKCMD') or os.path.join(os.path.dirname(__file__), 'bin', 'ck-cmd.exe')
+
+# An optional cache of ck-cmd outputs, see enable_cache()
+CACHE = None
+
+# Directory containing a log file for every failed ck-cmd invocation, keeping the newest MAX_LOGS
+LOG_DIRECTORY = os.path.join(tempfile.gettempdir(), 'ckcmd_logs')
+MAX_LOGS = 100
+
+# The number of conversions started with submit() that may run at once, see set_max_workers()
+MAX_WORKERS = 2
+EXECUTOR = None
+
+# An optional append-only JSONL ledger recording every conversion, see enable_ledger()
+LEDGER = None
+LEDGER_LOCK = threading.Lock()
+
+# The size in bytes at which the ledger is rotated, keeping a single previous ledger. Older history is dropped.
+LEDGER_MAX_SIZE = 16 * 1024 ** 2
+
+# The source directory of each staging directory, so the ledger records real paths, see source_path()
+STAGED = {}
+STAGED_LOCK = threading.Lock()
+
+# Messages from background threads waiting to be printed on Maya's main thread, see display()
+DISPLAY_BUFFER = []
+DISPLAY_LOCK = threading.Lock()
+
+# Locks serializing conversions that rewrite the same cache file, see cache_file_lock()
+CACHE_FILE_LOCKS = {}
+CACHE_FILE_LOCKS_LOCK = threading.Lock()
+
+# The index of the input each verb converts, used to report the slowest files
+SUBJECT_INPUTS = {'exportanimation': 1, 'importanimation': 1}
+
+# Address of an optional job server shared by several Maya sessions, see enable_server() and skymaya.jobserver
+SERVER = None
+SERVER_ADDRESS = ('localhost', 17370)
+
+# A secret shared by the job server and its clients, generated once per user, see server_authkey()
+SERVER_AUTHKEY_PATH = os.path.join(os.path.expanduser('~'), '.skymaya', 'jobserver.key')
+
+# The ck-cmd verbs a job server will run
+SERVER_VERBS = ('exportanimation', 'importanimation', 'exportrig', 'importrig', 'importskin')
+
+# Matches asset file names reported in ck-cmd output
+PROGRESS_PATTERN = re.compile(r'([^\s"\'\\/]+\.(?:hkx|fbx|nif))', re.IGNORECASE)
+
+
+def set_executable(path):
+    """
+    Sets the ck-cmd executable used for every conversion.
+
+    Args:
+        path(str): An executable path, a python script such as fakeckcmd.py, or None to use the bundled ck-cmd.exe.
+    """
+    global CKCMD
+    CKCMD = path or os.path.join(os.path.dirname(__file__), 'bin', 'ck-cmd.exe')
+
+
+def executable():
+    """
+    Gets the arguments that start ck-cmd. Python scripts are run with the current interpreter.
+
+    Returns:
+        list: A list of command arguments.
+    """
+    if CKCMD.endswith('.py'):
+        return [sys.executable, CKCMD]
+    return [CKCMD]
+
+
+def run_command(command, directory='/', callback=None, timeout=None, cancel=None):
     """
     Runs a given command in a separate process. Prints the output and raises any exceptions.
+    Output is streamed line by line into a log file in LOG_DIRECTORY as it arrives, which is kept only if the command
+    fails. The process is killed along with any processes it started as soon as an exception is reported on stderr,
+    it times out or it is cancelled.
     
     Args:
-        command(str): A command string to run. 
+        command(list): A list of command arguments to run. 
         directory(str): A directory to run the command in. 
+        callback(function): An optional function called on the calling thread with each line of output.
+        timeout(float): An optional number of seconds to wait before killing the process.
+        cancel(Cancellation): An optional cancellation shared by a batch of commands.
+    """
+    if any(argument is None for argument in command):
+        raise CkCmdException('Missing ck-cmd argument in %s' % command)
+    command = [('%s' % argument).replace('\\', '/') for argument in command]
+    directory = ('%s' % directory).replace('\\', '/')
+    display(subprocess.list2cmdline(command))
+    if cancel is not None:
+        cancel.check()
+    if SERVER is not None and run_remote(command, directory, callback=callback, timeout=timeout, cancel=cancel):
+        return
+    if not os.path.exists(LOG_DIRECTORY):
+        os.makedirs(LOG_DIRECTORY)
+    prune_logs(MAX_LOGS - 1)
+    handle, log_path = tempfile.mkstemp(prefix=time.strftime('%Y%m%d_%H%M%S_'), suffix='.log', dir=LOG_DIRECTORY)
+    deadline = time.time() + timeout if timeout is not None else None
+
+    with os.fdopen(handle, 'w') as log:
+        log.write('%s\n' % subprocess.list2cmdline(command))
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=directory,
+                                   universal_newlines=True, **_process_group_options())
+
+        # Read both streams on background threads so neither pipe can fill up and block the process
+        lines = queue.Queue()
+
+        def read(stream, is_error):
+            for line in iter(stream.readline, ''):
+                lines.put((is_error, line))
+            stream.close()
+            lines.put((is_error, None))
+
+        for stream, is_error in [(process.stdout, False), (process.stderr, True)]:
+            thread = threading.Thread(target=read, args=(stream, is_error))
+            thread.daemon = True
+            thread.start()
+
+        errors = []
+        failure = None
+        open_streams = 2
+        while open_streams > 0:
+            if failure is None:
+                if deadline is not None and time.time() >= deadline:
+                    failure = CkCmdTimeoutException('Timed out after %s seconds.' % timeout)
+                elif cancel is not None and cancel.cancelled():
+                    failure = cancel.exception()
+                if failure is not None:
+                    kill_process(process)
+
+            try:
+                is_error, line = lines.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if line is None:
+                open_streams -= 1
+                continue
+            log.write(line)
+            log.flush()
+            line = line.rstrip('\r\n')
+            if is_error:
+                errors.append(line)
+                if 'Exception' in line and failure is None:
+                    failure = CkCmdException('')
+                    kill_process(process)
+            else:
+                display(line)
+            if callback is not None:
+                callback(line)
+        process.wait()
+
+    if failure is None and process.returncode != 0:
+        failure = CkCmdException('')
+    if failure is None:
+        os.remove(log_path)
+        return
+    failure.args = ('%s\n%s\nSee %s' % (failure, '\n'.join(errors), log_path),)
+    failure.returncode = process.returncode
+    raise failure
+
+
+def prune_logs(count=None):
+    """
+    Removes all but the newest log files in LOG_DIRECTORY.
+
+    Args:
+        count(int): The number of logs to keep, defaults to MAX_LOGS.
+    """
+    count = MAX_LOGS if count is None else count
+    try:
+        logs = sorted(os.path.join(LOG_DIRECTORY, filename) for filename in os.listdir(LOG_DIRECTORY)
+                      if filename.endswith('.log'))
+        for path in logs[:max(0, len(logs) - count)]:
+            os.remove(path)
+    except OSError:
+        pass  # Removed by another session
+
+
+def display(message):
+    """
+    Prints a message. In Maya messages from background threads are printed on the main thread, since the script
+    editor is not thread safe. They are buffered and printed in batches, so large conversions queue a single
+    deferred print at a time rather than one per line.
+    """
+    if maya_utils is not None and not isinstance(threading.current_thread(), threading._MainThread):
+        with DISPLAY_LOCK:
+            DISPLAY_BUFFER.append(message)
+            if len(DISPLAY_BUFFER) > 1:
+                return  # A flush is already queued
+        maya_utils.executeDeferred(flush_display)
+    else:
+        flush_display()
+        _print(message)
+
+
+def flush_display():
+    """ Prints the messages buffered by display() from background threads. """
+    with DISPLAY_LOCK:
+        messages = list(DISPLAY_BUFFER)
+        del DISPLAY_BUFFER[:]
+    if len(messages) > 0:
+        _print('\n'.join(messages))
+
+
+def _print(message):
+    print message
+
+
+def run_remote(command, directory, callback=None, timeout=None, cancel=None):
+    """
+    Runs a command on the job server, streaming its output back as it arrives.
+    Identical commands requested by other sessions at the same time share a single ck-cmd process.
+
+    Args:
+        command(list): A list of command arguments to run.
+        directory(str): A directory to run the command in.
+        callback(function): An optional function called on the calling thread with each line of output.
+        timeout(float): An optional number of seconds to wait before the server kills the process.
+        cancel(Cancellation): An optional cancellation shared by a batch of commands.
+
+    Returns:
+        bool: False if the server could not be reached or does not run the command, True once the command succeeded.
+    """
+    # The server only runs its own ck-cmd, so send the verb and its arguments without the executable
+    prefix = [argument.replace('\\', '/') for argument in executable()]
+    if command[:len(prefix)] != prefix or len(command) == len(prefix) or command[len(prefix)] not in SERVER_VERBS:
+        return False
+    try:
+        # Client retries refused connections for several seconds, so check a socket server is listening first
+        if isinstance(SERVER, tuple):
+            socket.create_connection(SERVER, timeout=1).close()
+        connection = Client(SERVER, authkey=server_authkey())
+    except (IOError, OSError, EOFError):
+        display('Could not reach the ck-cmd job server at %s, running locally.' % (SERVER,))
+        return False
+    except AuthenticationError:
+        display('The ck-cmd job server at %s uses a different key, running locally. Set SKYMAYA_SERVER_AUTHKEY to '
+                'the same secret in every session sharing the server.' % (SERVER,))
+        return False
+
+    try:
+        connection.send({'verb': command[len(prefix)], 'arguments': command[len(prefix) + 1:],
+                         'directory': directory, 'timeout': timeout})
+        while True:
+            if cancel is not None and cancel.cancelled():
+                connection.send('cancel')
+                raise cancel.exception()
+            if not connection.poll(0.1):
+                continue
+            message = connection.recv()
+            if message[0] == 'line':
+                display(message[1])
+                if callback is not None:
+                    callback(message[1])
+            elif message[0] == 'failed':
+                exceptions = dict((cls.__name__, cls) for cls in [
+                    CkCmdException, CkCmdTimeoutException, CkCmdCancelledException])
+                exception = exceptions.get(message[1], CkCmdException)(message[2])
+                exception.returncode = message[3]
+                raise exception
+            else:
+                return True
+    except (IOError, EOFError):
+        raise CkCmdException('Lost connection to the ck-cmd job server at %s.' % (SERVER,))
+    finally:
+        connection.close()
+
+
+def enable_server(address=None):
+    """
+    Sends every ck-cmd process to a job server, see skymaya.jobserver.
+    Commands run locally whenever the server cannot be reached or uses a different key, see server_authkey().
+
+    Args:
+        address(tuple): A (host, port) address or named pipe path, defaults to SERVER_ADDRESS.
+    """
+    global SERVER
+    SERVER = address or SERVER_ADDRESS
+
+
+def server_authkey():
+    """
+    Gets the secret the job server and its clients authenticate with.
+    The SKYMAYA_SERVER_AUTHKEY environment variable is used if set, otherwise a random key is generated into
+    SERVER_AUTHKEY_PATH the first time it is needed, readable only by the current user. Since generated keys differ
+    per user, animators sharing a server must all set SKYMAYA_SERVER_AUTHKEY to the same secret, both for the server
+    and for their Maya sessions.
+
+    Returns:
+        bytes: The authentication key.
+    """
+    key = os.environ.get('SKYMAYA_SERVER_AUTHKEY')
+    if key:
+        return key.encode('utf-8')
+    if not os.path.exists(os.path.dirname(SERVER_AUTHKEY_PATH)):
+        os.makedirs(os.path.dirname(SERVER_AUTHKEY_PATH))
+    try:
+        handle = os.open(SERVER_AUTHKEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except OSError:
+        pass  # Already generated
+    else:
+        with os.fdopen(handle, 'w') as f:
+            f.write(hashlib.sha256(os.urandom(32)).hexdigest())
+    with open(SERVER_AUTHKEY_PATH) as f:
+        return f.read().strip().encode('utf-8')
+
+
+def disable_server():
+    """ Runs ck-cmd processes locally again. """
+    global SERVER
+    SERVER = None
+
+
+def _process_group_options():
+    """ Gets Popen options that start a process in its own process group so it can be killed as a whole. """
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {'preexec_fn': os.setsid}
+
+
+def kill_process(process):
+    """ Kills a process started by run_command along with every process it started. """
+    try:
+        if os.name == 'nt':
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(['taskkill', '/F', '/T', '/PID', str(process.pid)], stdout=devnull, stderr=devnull)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def parse_progress(line):
+    """
+    Finds the asset file a line of ck-cmd output refers to.
+
+    Args:
+        line(str): A line of ck-cmd output.
+
+    Returns:
+        str: The hkx, fbx or nif file name if found, otherwise None.
     """
-    command = command.replace('\\', '/')
-    directory = directory.replace('\\', '/')
-    print command
-    with open(os.path.join(tempfile.gettempdir(), 'test.log'), 'w') as f:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=directory)
-        out, err = process.communicate()
-        print out
-        if process.returncode != 0 or 'Exception' in err:
-            raise CkCmdException('\n%s' % err)
+    match = PROGRESS_PATTERN.search(line)
+    return match.group(1) if match else None
 
 
-def exportanimation(skeleton_hkx, animation_hkx, output_directory):
+def run_cached(command, directory, verb, inputs, callback=None, timeout=None, cancel=None, outputs=()):
+    """
+    Runs a given command, restoring its outputs from the cache instead when caching is enabled.
+    Existing output files are detached first, so ck-cmd never writes through a hard link, see detach().
+    
+    Args:
+        command(list): A list of command arguments to run. 
+        directory(str): The output directory to run the command in. 
+        verb(str): The ck-cmd verb being run.
+        inputs(list): A list of input file and directory paths the command reads from.
+        callback(function): An optional function called with each line of output.
+        timeout(float): An optional number of seconds to wait before killing the process.
+        cancel(Cancellation): An optional cancellation shared by a batch of commands.
+        outputs(list): The file paths the command is expected to write, only these are cached and recorded.
+    """
+    for path in outputs:
+        detach(path)
+    cache = CACHE
+    ledger = LEDGER
+    before = stat_files(outputs)
+    start = time.time()
+    status, returncode = 'ok', 0
+
+    # Time each file from the line ck-cmd reports starting it until the next file starts
+    progress = []
+
+    def track(line):
+        filename = parse_progress(line)
+        if filename is not None and (len(progress) == 0 or progress[-1][0] != filename):
+            progress.append((filename, time.time()))
+        if callback is not None:
+            callback(line)
+
+    try:
+        key = cache.key(verb, inputs) if cache is not None else None
+        if key is not None and cache.restore(key, directory):
+            status = 'cached'
+            return
+        run_command(command, directory=directory, callback=track if ledger is not None else callback,
+                    timeout=timeout, cancel=cancel)
+
+        # Only cache complete conversions, an entry missing outputs would skip the conversion for good
+        written = changed_files(outputs, before)
+        if key is not None and len(written) > 0 and len(written) == len(outputs):
+            cache.store(key, directory, written)
+    except CkCmdException as e:
+        status, returncode = 'failed', getattr(e, 'returncode', None)
+        raise
+    finally:
+        if ledger is not None:
+            try:
+                end = time.time()
+                files = [(filename, (progress[index + 1][1] if index + 1 < len(progress) else end) - started)
+                         for index, (filename, started) in enumerate(progress)]
+                record(ledger, verb, command, inputs, outputs, before, end - start, status, returncode, files=files)
+            except Exception:
+                pass  # Metrics must never hide the conversion's own result or exception
+
+
+def _measure(path):
+    """ Gets the total size in bytes and number of files of a file or directory. """
+    if not path or not os.path.exists(path):
+        return 0, 0
+    if os.path.isdir(path):
+        files = snapshot(path)
+        return sum(size for size, mtime in files.values()), len(files)
+    return os.path.getsize(path), 1
+
+
+def stat_files(paths):
+    """
+    Records the size and modification time of each existing file.
+
+    Args:
+        paths(list): A list of file paths.
+
+    Returns:
+        dict: A dictionary of (size, mtime) tuples keyed by file path.
+    """
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files[path] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def changed_files(paths, before):
+    """
+    Finds the files that were added or changed since they were recorded with stat_files().
+
+    Args:
+        paths(list): A list of file paths.
+        before(dict): The files recorded before they were written.
+
+    Returns:
+        list: The added or changed file paths.
+    """
+    after = stat_files(paths)
+    return [path for path in paths if path in after and before.get(path) != after[path]]
+
+
+def record(ledger, verb, command, inputs, outputs, before, wall_time, status, returncode, files=()):
+    """
+    Appends a conversion to the metrics ledger, rotating the ledger once it exceeds LEDGER_MAX_SIZE.
+    Staged inputs are recorded by their source path, see source_path().
+
+    Args:
+        ledger(str): A JSONL ledger path.
+        verb(str): The ck-cmd verb.
+        command(list): The command arguments.
+        inputs(list): A list of input file and directory paths.
+        outputs(list): The file paths the conversion is expected to write.
+        before(dict): The outputs recorded with stat_files() before the conversion.
+        wall_time(float): The number of seconds the conversion took.
+        status(str): Either ok, cached or failed.
+        returncode(int): The ck-cmd exit code if known.
+        files(list): A list of (file name, seconds) tuples for each file ck-cmd reported converting.
+    """
+    outputs = [_measure(path) for path in changed_files(outputs, before)]
+    measures = [_measure(path) for path in inputs]
+    subject = inputs[SUBJECT_INPUTS.get(verb, 0)]
+    sources = [source_path(path) for path in inputs]
+    entry = {
+        'time': time.time() - wall_time,
+        'verb': verb,
+        'arguments': command[command.index(verb) + 1:] if verb in command else command,
+        'wall_time': wall_time,
+        'status': status,
+        'exit_code': returncode,
+        'actor': next((actor_from_path(path) for path in sources if actor_from_path(path)), None),
+        'subject': source_path(subject),
+        'subject_files': _measure(subject)[1],
+        'files': [[filename, seconds] for filename, seconds in files],
+        'input_bytes': sum(size for size, count in measures),
+        'input_files': sum(count for size, count in measures),
+        'output_bytes': sum(size for size, count in outputs),
+        'output_files': len(outputs),
+    }
+    try:
+        with LEDGER_LOCK:
+            if os.path.exists(ledger) and os.path.getsize(ledger) > LEDGER_MAX_SIZE:
+                if os.path.exists(ledger + '.1'):
+                    os.remove(ledger + '.1')
+                os.rename(ledger, ledger + '.1')
+            with open(ledger, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+    except (IOError, OSError):
+        pass
+
+
+def actor_from_path(path):
+    """
+    Finds the actor a data directory path belongs to.
+
+    Args:
+        path(str): A file or directory path.
+
+    Returns:
+        str: The actor name if found, otherwise None.
+    """
+    parts = [part.lower() for part in re.split(r'[\\/]', path or '') if part]
+    if 'actors' not in parts:
+        return None
+    parts = parts[parts.index('actors') + 1:]
+    if parts and parts[0].startswith('dlc'):
+        parts = parts[1:]
+    return parts[0] if parts else None
+
+
+def read_ledger(ledger=None):
+    """
+    Reads every entry of a metrics ledger, including the previous ledger kept when it was last rotated.
+
+    Args:
+        ledger(str): A JSONL ledger path, defaults to LEDGER.
+
+    Returns:
+        list: A list of entry dictionaries, oldest first.
+    """
+    ledger = ledger or LEDGER
+    if not ledger:
+        return []
+    entries = []
+    for path in [ledger + '.1', ledger]:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+def report(ledger=None, slowest=10):
+    """
+    Summarizes a metrics ledger by verb, actor and day and lists the slowest files.
+
+    Args:
+        ledger(str): A JSONL ledger path, defaults to LEDGER.
+        slowest(int): The number of slowest files to list.
+
+    Returns:
+        str: A printable report.
+    """
+    entries = read_ledger(ledger)
+    lines = ['%s conversions in %s' % (len(entries), ledger or LEDGER)]
+
+    groupings = [
+        ('verb', lambda entry: entry['verb']),
+        ('actor', lambda entry: entry.get('actor') or '-'),
+        ('day', lambda entry: datetime.datetime.fromtimestamp(entry['time']).strftime('%Y-%m-%d')),
+    ]
+    for name, grouping in groupings:
+        groups = {}
+        for entry in entries:
+            groups.setdefault(grouping(entry), []).append(entry)
+        lines.append('')
+        lines.append('%-24s %8s %8s %10s %10s %12s %12s' % (
+            name, 'runs', 'failed', 'cached', 'seconds', 'in MB', 'out MB'))
+        for key, group in sorted(groups.items(), key=lambda item: -sum(e['wall_time'] for e in item[1])):
+            lines.append('%-24s %8s %8s %10s %10.1f %12.1f %12.1f' % (
+                key, len(group),
+                len([e for e in group if e['status'] == 'failed']),
+                len([e for e in group if e['status'] == 'cached']),
+                sum(e['wall_time'] for e in group),
+                sum(e['input_bytes'] for e in group) / 1024.0 ** 2,
+                sum(e['output_bytes'] for e in group) / 1024.0 ** 2,
+            ))
+
+    # Rank files by the time ck-cmd spent on each, or by their conversion's average time per file if not reported
+    files = []
+    for entry in entries:
+        if entry['status'] == 'cached':
+            continue
+        if entry.get('files'):
+            files.extend((seconds, entry['verb'], os.path.join(entry['subject'], filename)
+                          if os.path.basename(entry['subject']) != filename else entry['subject'])
+                         for filename, seconds in entry['files'])
+        else:
+            files.append((entry['wall_time'] / max(1, entry.get('subject_files', 1)), entry['verb'],
+                          entry['subject']))
+    lines.append('')
+    lines.append('Slowest files (seconds)')
+    for seconds, verb, path in sorted(files, reverse=True)[:slowest]:
+        lines.append('%10.2f  %-16s %s' % (seconds, verb, path))
+    return '\n'.join(lines)
+
+
+def enable_cache(directory=None, max_size=4 * 1024 ** 3):
+    """
+    Enables caching of ck-cmd outputs for every conversion.
+    
+    Args:
+        directory(str): A cache directory, defaults to a directory in the temp directory.
+        max_size(int): The maximum size of the cache in bytes.
+
+    Returns:
+        Cache: The enabled cache.
+    """
+    global CACHE
+    CACHE = Cache(directory, max_size=max_size)
+    return CACHE
+
+
+def disable_cache():
+    """ Disables caching of ck-cmd outputs. """
+    global CACHE
+    CACHE = None
+
+
+def enable_ledger(path=None):
+    """
+    Records metrics for every conversion in a ledger, see report().
+    Recording walks each conversion's inputs and outputs, so it is off by default. Entries are only ever appended,
+    but once the ledger exceeds LEDGER_MAX_SIZE it is rotated and only the previous ledger is kept.
+
+    Args:
+        path(str): A JSONL ledger path, defaults to a file in the temp directory.
+    """
+    global LEDGER
+    LEDGER = path or os.path.join(tempfile.gettempdir(), 'ckcmd_ledger.jsonl')
+
+
+def disable_ledger():
+    """ Stops recording conversion metrics. """
+    global LEDGER
+    LEDGER = None
+
+
+def exportanimation(skeleton_hkx, animation_hkx, output_directory, shards=1, callback=None, timeout=None,
+                    cancel=None):
     """
     Converts a Skyrim animation from hkx to fbx.
     
@@ -37,16 +681,27 @@ def exportanimation(skeleton_hkx, animation_hkx, output_directory):
         skeleton_hkx(str): A skeleton.hkx path. 
         animation_hkx(str): Either an animation hkx file or directory containing animation hkx files.
         output_directory(str): The output directory. 
+        shards(int): The number of ck-cmd processes to split an animation directory across.
+        callback(function): An optional function called with each line of output, unused for sharded conversions.
+        timeout(float): An optional number of seconds to wait before killing each ck-cmd process.
+        cancel(Cancellation): An optional cancellation shared by a batch of conversions.
 
     Returns:
         str: The executed command string.
     """
-    command = '%s exportanimation "%s" "%s" "%s"' % (CKCMD, skeleton_hkx, animation_hkx, output_directory)
-    run_command(command, directory=output_directory)
-    return command
+    if shards > 1 and os.path.isdir(animation_hkx):
+        return run_sharded(lambda directory, output: exportanimation(
+            skeleton_hkx, directory, output, timeout=timeout, cancel=cancel
+        ), animation_hkx, '.hkx', output_directory, shards)
+    command = executable() + ['exportanimation', skeleton_hkx, animation_hkx, output_directory]
+    run_cached(command, output_directory, 'exportanimation', [skeleton_hkx, animation_hkx],
+               callback=callback, timeout=timeout, cancel=cancel,
+               outputs=_outputs(animation_hkx, '.hkx', output_directory, '.fbx'))
+    return subprocess.list2cmdline(command)
 
 
-def importanimation(skeleton_hkx, animation_fbx, output_directory, cache_txt='', behavior_directory=''):
+def importanimation(skeleton_hkx, animation_fbx, output_directory, cache_txt='', behavior_directory='', shards=1,
+                    callback=None, timeout=None, cancel=None):
     """
     Converts an animation from fbx to hkx.
     
@@ -56,20 +711,63 @@ def importanimation(skeleton_hkx, animation_fbx, output_directory, cache_txt='',
         output_directory(str): The output directory. 
         cache_txt(str): An optional cache file to contain root motion data. 
         behavior_directory(str): An optional behavior directory. 
+        shards(int): The number of ck-cmd processes to split an animation directory across. Animations are never
+            split when a cache file is given, since every process would rewrite the same cache file. For the same
+            reason conversions sharing a cache file run one at a time.
+        callback(function): An optional function called with each line of output, unused for sharded conversions.
+        timeout(float): An optional number of seconds to wait before killing each ck-cmd process.
+        cancel(Cancellation): An optional cancellation shared by a batch of conversions.
 
     Returns:
         str: The executed command string.
     """
-    command = '%s importanimation "%s" "%s" --c="%s" --b="%s" --e="%s"' % (
-        CKCMD, skeleton_hkx, animation_fbx,
-        cache_txt, behavior_directory, output_directory
-    )
-    run_command(command, directory=output_directory)
-    return command
+    if shards > 1 and os.path.isdir(animation_fbx) and not cache_txt:
+        return run_sharded(lambda directory, output: importanimation(
+            skeleton_hkx, directory, output, cache_txt=cache_txt, behavior_directory=behavior_directory,
+            timeout=timeout, cancel=cancel
+        ), animation_fbx, '.fbx', output_directory, shards)
+    command = executable() + ['importanimation', skeleton_hkx, animation_fbx]
+    command.append('--c=%s' % cache_txt)
+    command.append('--b=%s' % behavior_directory)
+    command.append('--e=%s' % output_directory)
+    outputs = _outputs(animation_fbx, '.fbx', output_directory, '.hkx')
+    lock = None
+    if cache_txt:
+        # ck-cmd rewrites the whole cache file, so conversions sharing one would drop each other's root motion
+        outputs.append(os.path.join(output_directory, os.path.basename(cache_txt)))
+        lock = cache_file_lock(cache_txt)
+        while not lock.acquire(False):
+            if cancel is not None:
+                cancel.check()
+            time.sleep(0.05)
+    try:
+        run_cached(command, output_directory, 'importanimation',
+                   [skeleton_hkx, animation_fbx, cache_txt, behavior_directory],
+                   callback=callback, timeout=timeout, cancel=cancel, outputs=outputs)
+    finally:
+        if lock is not None:
+            lock.release()
+    return subprocess.list2cmdline(command)
+
+
+def cache_file_lock(cache_txt):
+    """
+    Gets the lock held while importing animations with a cache file, see importanimation().
+
+    Args:
+        cache_txt(str): A cache file path.
+
+    Returns:
+        Lock: The same lock for every path to the cache file.
+    """
+    key = os.path.normcase(os.path.abspath(cache_txt))
+    with CACHE_FILE_LOCKS_LOCK:
+        return CACHE_FILE_LOCKS.setdefault(key, threading.Lock())
 
 
 def exportrig(skeleton_hkx, skeleton_nif, output_directory,
-              animation_hkx='', mesh_nif='', cache_txt='', behavior_directory=''):
+              animation_hkx='', mesh_nif='', cache_txt='', behavior_directory='', callback=None, timeout=None,
+              cancel=None):
     """
     Converts a Skyrim rig from hkx to fbx.
     
@@ -81,45 +779,56 @@ def exportrig(skeleton_hkx, skeleton_nif, output_directory,
         mesh_nif(str): An optional nif mesh to load or a directory containing mesh nif files. 
         cache_txt(str): An optional cache file to containing root motion data. 
         behavior_directory(str): An optional behavior directory. 
+        callback(function): An optional function called with each line of output.
+        timeout(float): An optional number of seconds to wait before killing ck-cmd.
+        cancel(Cancellation): An optional cancellation shared by a batch of conversions.
 
     Returns:
         str: The executed command string.
     """
-    commands = [CKCMD, "exportrig"]
-    commands.append('"%s"' % skeleton_hkx)
-    commands.append('"%s"' % skeleton_nif)
-    commands.append('--e="%s"' % output_directory)
-    commands.append('--a="%s"' % animation_hkx)
-    commands.append('--n="%s"' % mesh_nif)
-    commands.append('--b="%s"' % behavior_directory)
-    commands.append('--c="%s"' % cache_txt)
-    command = ' '.join(commands)
-    run_command(command, directory=output_directory)
-    return command
+    commands = executable() + ["exportrig"]
+    commands.append(skeleton_hkx)
+    commands.append(skeleton_nif)
+    commands.append('--e=%s' % output_directory)
+    commands.append('--a=%s' % animation_hkx)
+    commands.append('--n=%s' % mesh_nif)
+    commands.append('--b=%s' % behavior_directory)
+    commands.append('--c=%s' % cache_txt)
+    run_cached(commands, output_directory, 'exportrig',
+               [skeleton_hkx, skeleton_nif, animation_hkx, mesh_nif, cache_txt, behavior_directory],
+               callback=callback, timeout=timeout, cancel=cancel,
+               outputs=[os.path.join(output_directory, 'skeleton.fbx')])
+    return subprocess.list2cmdline(commands)
 
 
-def importrig(skeleton_fbx, output_directory):
+def importrig(skeleton_fbx, output_directory, callback=None, timeout=None, cancel=None):
     """
     Converts a rig from fbx to hkx.
     
     Args:
         skeleton_fbx(str): A skeleton fbx file. 
         output_directory(str): The output directory. 
+        callback(function): An optional function called with each line of output.
+        timeout(float): An optional number of seconds to wait before killing ck-cmd.
+        cancel(Cancellation): An optional cancellation shared by a batch of conversions.
 
     Returns:
 
         str: The executed command string.
     """
-    commands = [CKCMD, "importrig"]
-    commands.append('"%s"' % skeleton_fbx)
-    commands.append('-a "%s"' % '')
-    commands.append('-e "%s"' % output_directory)
-    command = ' '.join(commands)
-    run_command(command, directory=output_directory)
-    return command
+    commands = executable() + ["importrig"]
+    commands.append(skeleton_fbx)
+    commands.extend(['-a', ''])
+    commands.extend(['-e', output_directory])
+    run_cached(commands, output_directory, 'importrig', [skeleton_fbx],
+               callback=callback, timeout=timeout, cancel=cancel,
+               outputs=_outputs(skeleton_fbx, '.fbx', output_directory, '.hkx') +
+               _outputs(skeleton_fbx, '.fbx', output_directory, '_le.hkx') +
+               _outputs(skeleton_fbx, '.fbx', output_directory, '.nif'))
+    return subprocess.list2cmdline(commands)
 
 
-def importskin(skin_fbx, output_directory):
+def importskin(skin_fbx, output_directory, callback=None, timeout=None, cancel=None):
     """
     Converts a skinned mesh fbx to nif.
     
@@ -127,15 +836,735 @@ def importskin(skin_fbx, output_directory):
         skin_fbx(str): A skin fbx file. 
         output_directory: 
         output_directory(str): The output directory. 
+        callback(function): An optional function called with each line of output.
+        timeout(float): An optional number of seconds to wait before killing ck-cmd.
+        cancel(Cancellation): An optional cancellation shared by a batch of conversions.
 
     Returns:
         str: The executed command string.
     """
-    command = '%s importskin "%s" "%s"' % (CKCMD, skin_fbx, output_directory)
-    run_command(command, directory=output_directory)
-    return command
+    command = executable() + ['importskin', skin_fbx, output_directory]
+    run_cached(command, output_directory, 'importskin', [skin_fbx], callback=callback, timeout=timeout, cancel=cancel,
+               outputs=_outputs(skin_fbx, '.fbx', output_directory, '.nif'))
+    return subprocess.list2cmdline(command)
+
+
+def run_parallel(functions, workers=None, callback=None):
+    """
+    Runs the given functions on a bounded pool of worker threads.
+    The callback is invoked on the calling thread as each function finishes so progress can be safely reported.
+    Exceptions are collected instead of raised so a single failure does not abort the remaining functions.
+    A KeyboardInterrupt or SystemExit stops the remaining functions from starting and is raised on the calling thread.
+
+    Args:
+        functions(list): A list of functions that take no arguments.
+        workers(int): The maximum number of functions to run at once, defaults to the cpu count.
+        callback(function): An optional function called with the index, result and exception of each function.
+
+    Returns:
+        list: A list of (result, exception) tuples in the order of the given functions.
+    """
+    workers = max(1, min(workers or multiprocessing.cpu_count(), len(functions)))
+    pending = queue.Queue()
+    finished = queue.Queue()
+    for index, function in enumerate(functions):
+        pending.put((index, function))
+
+    def work():
+        while True:
+            try:
+                index, function = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                finished.put((index, function(), None))
+            except (KeyboardInterrupt, SystemExit) as exception:
+                finished.put((index, None, exception))
+                return
+            except BaseException as exception:
+                # The repo's own exceptions derive from BaseException, so they are failures of this function only
+                finished.put((index, None, exception))
+
+    def clear():
+        while True:
+            try:
+                pending.get_nowait()
+            except queue.Empty:
+                return
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    results = [None] * len(functions)
+    try:
+        for _ in range(len(functions)):
+            # Wait with a timeout, on Python 2 a blocking get cannot be interrupted
+            while True:
+                try:
+                    index, result, exception = finished.get(True, 0.1)
+                    break
+                except queue.Empty:
+                    continue
+            if isinstance(exception, (KeyboardInterrupt, SystemExit)):
+                raise exception
+            results[index] = (result, exception)
+            if callback is not None:
+                callback(index, result, exception)
+    except (KeyboardInterrupt, SystemExit):
+        # Functions already running are left to finish, the rest are never started
+        clear()
+        raise
+    return results
+
+
+def submit(function, *args, **kwargs):
+    """
+    Runs a ck-cmd function in the background, for example submit(importrig, skeleton_fbx, output_directory).
+    At most MAX_WORKERS submitted functions run at once, the rest wait in submission order.
+    A Cancellation passed as the cancel keyword argument is used to kill the process if the future is cancelled.
+
+    Args:
+        function(function): A function to run.
+        *args: Positional arguments for the function.
+        **kwargs: Keyword arguments for the function.
+
+    Returns:
+        Future: A handle to the running function.
+    """
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = Executor(MAX_WORKERS)
+    future = EXECUTOR.submit(function, *args, **kwargs)
+    future.cancellation = kwargs.get('cancel')
+    return future
+
+
+def set_max_workers(count):
+    """ Sets the number of conversions started with submit() that may run at once. """
+    global MAX_WORKERS
+    MAX_WORKERS = count
+    if EXECUTOR is not None:
+        EXECUTOR.max_workers = count
+        EXECUTOR.schedule()
+
+
+def _dispatch(function, *args):
+    """ Calls a function on Maya's main thread when running in Maya, otherwise calls it immediately. """
+    if maya_utils is not None:
+        maya_utils.executeDeferred(function, *args)
+    else:
+        function(*args)
+
+
+def detach(path):
+    """
+    Replaces a hard linked file with a private copy, so writing to it in place cannot change its other links.
+    Call this on every file before writing over it, files extracted from a sync.Store are shared between workspaces.
+
+    Returns:
+        bool: True if the file was hard linked.
+    """
+    if not path or not os.path.isfile(path) or os.stat(path).st_nlink < 2:
+        return False
+    staging = path + '.detach'
+    shutil.copy2(path, staging)
+    os.remove(path)
+    os.rename(staging, path)
+    return True
+
+
+def _outputs(path, extension, output_directory, output_extension):
+    """ Predicts the files ck-cmd writes for each input file of a file or directory path, see run_cached(). """
+    if not path or not os.path.exists(path):
+        return []
+    if os.path.isfile(path):
+        inputs = [path]
+    else:
+        inputs = [os.path.join(root, filename) for root, dirs, filenames in os.walk(path)
+                  for filename in filenames if filename.lower().endswith(extension)]
+    return [os.path.join(output_directory, os.path.splitext(os.path.basename(filename))[0] + output_extension)
+            for filename in inputs]
+
+
+def _link(src, dst):
+    """ Hard links the source file to the destination, falling back to a copy across file systems. """
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        shutil.copy2(src, dst)
+
+
+def stage_shards(directory, extension, shards, staging_directory):
+    """
+    Splits the files of a directory into shard directories of roughly equal total size.
+    Files are linked rather than copied where possible and keep their path relative to the source directory.
+
+    Args:
+        directory(str): A directory containing files to split.
+        extension(str): The file extension of files to include.
+        shards(int): The maximum number of shards to create.
+        staging_directory(str): A directory to create shard directories in.
+
+    Returns:
+        list: A list of shard directories, empty shards are omitted.
+    """
+    files = []
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.lower().endswith(extension):
+                path = os.path.join(root, filename)
+                files.append((os.path.getsize(path), os.path.relpath(path, directory)))
+
+    # Assign the largest files first, each to the currently smallest shard
+    sizes = [0] * max(1, min(shards, len(files)))
+    shard_files = [[] for _ in sizes]
+    for size, filename in sorted(files, reverse=True):
+        index = sizes.index(min(sizes))
+        sizes[index] += size
+        shard_files[index].append(filename)
+
+    shard_directories = []
+    for index, filenames in enumerate(shard_files):
+        if len(filenames) == 0:
+            continue
+        shard_directory = os.path.join(staging_directory, 'shard%s' % index)
+        stage_files(directory, filenames, shard_directory)
+        shard_directories.append(shard_directory)
+    return shard_directories
+
+
+def get_staging_directory(directory, verb):
+    """
+    Creates a private directory to stage files of a directory into before converting them with a ck-cmd verb.
+    Every call gets its own directory, so concurrent conversions of the same directory never remove each other's
+    files. The staging directory keeps the source directory's name, so conversions of the same staged files share a
+    cache key, see Cache.key(). Remove it with remove_staging_directory() once converted.
+
+    Args:
+        directory(str): The source directory.
+        verb(str): The ck-cmd verb the staged files are converted with.
+
+    Returns:
+        str: The staging directory path, which does not exist until files are staged into it.
+    """
+    parent = tempfile.mkdtemp(prefix='ckcmd_%s_' % verb)
+    return os.path.join(parent, os.path.basename(os.path.abspath(directory)))
+
+
+def remove_staging_directory(staging_directory):
+    """ Removes a directory created by get_staging_directory() along with its staged files. """
+    forget_staged(os.path.dirname(staging_directory))
+    shutil.rmtree(os.path.dirname(staging_directory), ignore_errors=True)
+
+
+def source_path(path):
+    """
+    Gets the source directory files were staged from, see stage_files().
+
+    Args:
+        path(str): A file or directory path.
+
+    Returns:
+        str: The source directory for a staging directory, otherwise the given path.
+    """
+    with STAGED_LOCK:
+        return STAGED.get(os.path.normpath(path), path) if path else path
+
+
+def forget_staged(directory):
+    """ Forgets the source of every staging directory within a directory that is about to be removed. """
+    directory = os.path.normpath(directory)
+    with STAGED_LOCK:
+        for path in list(STAGED):
+            if path == directory or path.startswith(directory + os.sep):
+                del STAGED[path]
+
+
+def stage_files(directory, filenames, staging_directory):
+    """
+    Links files of a directory into a staging directory, keeping their path relative to the source directory.
+    The source directory is remembered until the staging directory is removed, see source_path().
+
+    Args:
+        directory(str): The source directory.
+        filenames(list): A list of file paths relative to the source directory.
+        staging_directory(str): The directory to link files into.
+
+    Returns:
+        str: The staging directory.
+    """
+    source = source_path(directory)
+    with STAGED_LOCK:
+        STAGED[os.path.normpath(staging_directory)] = source
+    for filename in filenames:
+        path = os.path.join(staging_directory, filename)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        _link(os.path.join(directory, filename), path)
+    return staging_directory
+
+
+def stale_files(directory, extension, output_directory, output_extension, dependencies=()):
+    """
+    Finds the files of a directory whose converted output is missing or older than the file or its dependencies.
+    Outputs are expected directly in the output directory, named after the input file.
+
+    Args:
+        directory(str): A directory of input files.
+        extension(str): The file extension of input files.
+        output_directory(str): The directory containing converted outputs.
+        output_extension(str): The file extension of converted outputs.
+        dependencies(list): Other file or directory paths every conversion reads, such as a skeleton.
+
+    Returns:
+        tuple: A list of stale file paths relative to the directory, and the total number of input files.
+    """
+    newest = 0
+    for dependency in dependencies:
+        if dependency and os.path.isdir(dependency):
+            newest = max([newest] + [stat[1] for stat in snapshot(dependency).values()])
+        elif dependency and os.path.exists(dependency):
+            newest = max(newest, os.path.getmtime(dependency))
+
+    stale = []
+    count = 0
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            if not filename.lower().endswith(extension):
+                continue
+            count += 1
+            path = os.path.join(root, filename)
+            output = os.path.join(output_directory, os.path.splitext(filename)[0] + output_extension)
+            if not os.path.exists(output) or os.path.getmtime(output) < max(newest, os.path.getmtime(path)):
+                stale.append(os.path.relpath(path, directory))
+    return sorted(stale), count
+
+
+def merge_directory(src, dst):
+    """ Moves every file in the source directory into the destination directory, replacing existing files. """
+    for root, dirs, filenames in os.walk(src):
+        output = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.exists(output):
+            os.makedirs(output)
+        for filename in filenames:
+            path = os.path.join(output, filename)
+            if os.path.exists(path):
+                os.remove(path)
+            shutil.move(os.path.join(root, filename), path)
+
+
+def run_sharded(function, directory, extension, output_directory, shards):
+    """
+    Runs a ck-cmd function on shards of a directory at once and merges the outputs into the output directory.
+    Each shard writes to its own staging output directory. Outputs written by more than one shard, such as a shared
+    cache file, are replaced by the last shard to finish.
+
+    Args:
+        function(function): A function taking a shard directory and a shard output directory.
+        directory(str): A directory of input files.
+        extension(str): The file extension of input files.
+        output_directory(str): The output directory.
+        shards(int): The number of shards to split the directory into.
+
+    Returns:
+        str: The executed command strings separated by new lines.
+    """
+    staging_directory = tempfile.mkdtemp(prefix='ckcmd_')
+    try:
+        functions = []
+        for shard_directory in stage_shards(directory, extension, shards, staging_directory):
+            shard_output = '%s_output' % shard_directory
+            os.makedirs(shard_output)
+            functions.append(functools.partial(function, shard_directory, shard_output))
+
+        # Merge each successful shard, then raise the first failure
+        commands = []
+        exceptions = []
+        for index, (command, exception) in enumerate(run_parallel(functions, workers=len(functions))):
+            if exception is not None:
+                exceptions.append(exception)
+                continue
+            merge_directory(functions[index].args[1], output_directory)
+            commands.append(command)
+        if len(exceptions) > 0:
+            raise exceptions[0]
+        return '\n'.join(commands)
+    finally:
+        forget_staged(staging_directory)
+        shutil.rmtree(staging_directory, ignore_errors=True)
+
+
+class Future(object):
+    """ A handle to a function running in the background. """
+
+    def __init__(self, executor=None):
+        self.cancellation = None
+        self._executor = executor
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def done(self):
+        """ Returns True if the function has finished. """
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancels the function. Pending functions are never started and running functions are stopped through the
+        future's cancellation if it has one.
+
+        Returns:
+            bool: False if the function had already finished, otherwise True.
+        """
+        if self.done():
+            return False
+        if self.cancellation is not None:
+            self.cancellation.cancel()
+        if self._executor is not None and self._executor.remove(self):
+            self.set_result(exception=CkCmdCancelledException('Cancelled before starting.'))
+        return True
+
+    def result(self, timeout=None):
+        """
+        Waits for the function to finish and returns its result, raising its exception if it failed.
+
+        Args:
+            timeout(float): An optional number of seconds to wait.
+
+        Returns:
+            The function result.
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the function to finish and returns its exception.
+
+        Args:
+            timeout(float): An optional number of seconds to wait.
+
+        Returns:
+            BaseException: The raised exception or None if the function succeeded.
+        """
+        if not self._event.wait(timeout):
+            raise CkCmdException('Timed out waiting for a background conversion.')
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """
+        Adds a function to call with this future once it has finished.
+        In Maya callbacks are deferred to the main thread so they can safely update the scene and interface.
+
+        Args:
+            callback(function): A function taking a future.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        _dispatch(callback, self)
+
+    def set_result(self, result=None, exception=None):
+        """ Finishes the future and dispatches its callbacks. """
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            _dispatch(callback, self)
+
+
+class Executor(object):
+    """ Runs functions on background threads, limiting how many run at once. """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._pending = []
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a function to run in the background.
+
+        Returns:
+            Future: A handle to the function.
+        """
+        future = Future(self)
+        with self._lock:
+            self._pending.append((future, function, args, kwargs))
+        self.schedule()
+        return future
+
+    def remove(self, future):
+        """
+        Removes a pending future so its function never starts.
+
+        Returns:
+            bool: True if the future was pending, otherwise False.
+        """
+        with self._lock:
+            for index, item in enumerate(self._pending):
+                if item[0] is future:
+                    del self._pending[index]
+                    return True
+        return False
+
+    def schedule(self):
+        """ Starts pending functions until the worker limit is reached. """
+        with self._lock:
+            while self._pending and self._running < max(1, self.max_workers):
+                self._running += 1
+                thread = threading.Thread(target=self._run, args=self._pending.pop(0))
+                thread.daemon = True
+                thread.start()
+
+    def _run(self, future, function, args, kwargs):
+        try:
+            result, exception = function(*args, **kwargs), None
+        except BaseException as e:
+            result, exception = None, e
+        with self._lock:
+            self._running -= 1
+        future.set_result(result, exception)
+        self.schedule()
+
+
+def snapshot(directory):
+    """
+    Records the size and modification time of every file in a directory.
+    Files removed while the directory is walked are left out.
+
+    Args:
+        directory(str): A directory path.
+
+    Returns:
+        dict: A dictionary of (size, mtime) tuples keyed by relative file path.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, directory)] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+class Cache(object):
+    """ A size bounded cache of ck-cmd outputs keyed on a command verb and the contents of its inputs. """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory=None, max_size=4 * 1024 ** 3):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'ckcmd_cache')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def digest(self, path):
+        """
+        Hashes the name and contents of a file or every file in a directory.
+        File digests are remembered by size and modification time so unchanged files are only read once.
+
+        Args:
+            path(str): A file or directory path.
+
+        Returns:
+            str: A hex digest.
+        """
+        sha = hashlib.sha1(os.path.basename(os.path.normpath(path)).lower().encode('utf-8'))
+        if os.path.isdir(path):
+            for relpath, stat in sorted(snapshot(path).items()):
+                sha.update(relpath.lower().encode('utf-8'))
+                sha.update(self.digest(os.path.join(path, relpath)).encode('utf-8'))
+            return sha.hexdigest()
+
+        stat = os.stat(path)
+        memo = (path, stat.st_size, stat.st_mtime)
+        if memo not in self._digests:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(block)
+            self._digests[memo] = sha.hexdigest()
+        return self._digests[memo]
+
+    def key(self, verb, inputs):
+        """
+        Gets a cache key for a ck-cmd conversion.
+
+        Args:
+            verb(str): The ck-cmd verb.
+            inputs(list): A list of input file and directory paths, empty paths are ignored.
+
+        Returns:
+            str: A cache key.
+        """
+        sha = hashlib.sha1(verb.encode('utf-8'))
+        for path in executable()[-1:] + list(inputs):
+            sha.update(self.digest(path).encode('utf-8') if path and os.path.exists(path) else b'-')
+        return sha.hexdigest()
+
+    def restore(self, key, directory):
+        """
+        Copies cached outputs into the given directory.
+
+        Args:
+            key(str): A cache key.
+            directory(str): An output directory.
+
+        Returns:
+            bool: True if the outputs were cached, False otherwise.
+        """
+        entry = os.path.join(self.directory, key)
+        manifest = os.path.join(entry, self.MANIFEST)
+        if not os.path.exists(manifest):
+            with self._lock:
+                self.misses += 1
+            return False
+
+        with open(manifest, 'r') as f:
+            files = json.load(f)['files']
+        if len(files) == 0 or not all(os.path.exists(os.path.join(entry, 'files', relpath)) for relpath in files):
+            # Remove an incomplete entry so the conversion is stored again once it has run
+            shutil.rmtree(entry, ignore_errors=True)
+            with self._lock:
+                self.misses += 1
+            return False
+        for relpath in files:
+            path = os.path.join(directory, relpath)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            if os.path.lexists(path):
+                os.remove(path)  # Replace rather than write through a hard link
+            shutil.copyfile(os.path.join(entry, 'files', relpath), path)
+
+        # Touch the manifest to mark the entry as recently used
+        os.utime(manifest, None)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, directory, outputs):
+        """
+        Stores the files a conversion wrote to the given directory.
+        Only the conversion's own outputs are stored, other files in the directory may be written by other
+        conversions running at the same time.
+
+        Args:
+            key(str): A cache key.
+            directory(str): An output directory.
+            outputs(list): The file paths the conversion wrote, inside the output directory.
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.exists(entry):
+            return
+
+        staging = tempfile.mkdtemp(prefix='%s_' % key, dir=self.directory)
+        files = [os.path.relpath(path, directory) for path in outputs]
+        size = 0
+        for relpath in files:
+            path = os.path.join(staging, 'files', relpath)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            shutil.copyfile(os.path.join(directory, relpath), path)
+            size += os.path.getsize(path)
+        with open(os.path.join(staging, self.MANIFEST), 'w') as f:
+            json.dump({'files': files, 'size': size}, f)
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another conversion stored the same outputs first
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits within its maximum size. """
+        with self._lock:
+            entries = []
+            for key in os.listdir(self.directory):
+                manifest = os.path.join(self.directory, key, self.MANIFEST)
+                if not os.path.exists(manifest):
+                    continue
+                with open(manifest, 'r') as f:
+                    size = json.load(f)['size']
+                entries.append((os.path.getmtime(manifest), size, key))
+
+            total = sum(size for mtime, size, key in entries)
+            for mtime, size, key in sorted(entries):
+                if total <= self.max_size:
+                    break
+                shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        """ Removes every cached entry and resets the hit and miss counters. """
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            self.hits = 0
+            self.misses = 0
+
+
+class Cancellation(object):
+    """
+    Cancels running ck-cmd processes on request or once a batch timeout has passed.
+    A cancellation with a parent is also cancelled along with it, so one conversion of a batch can be cancelled on its
+    own while cancelling the batch still stops every conversion.
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self.timeout = timeout
+        self.deadline = time.time() + timeout if timeout is not None else None
+        self.parent = parent
+        self._event = threading.Event()
+
+    def cancel(self):
+        """ Cancels every process using this cancellation. """
+        self._event.set()
+
+    def cancelled(self):
+        """ Returns True if cancelled or timed out. """
+        return (self._event.is_set() or (self.deadline is not None and time.time() >= self.deadline) or
+                (self.parent is not None and self.parent.cancelled()))
+
+    def exception(self):
+        """ Gets an exception describing why processes were cancelled. """
+        if self._event.is_set():
+            return CkCmdCancelledException('Cancelled.')
+        if self.parent is not None and self.parent.cancelled():
+            return self.parent.exception()
+        return CkCmdTimeoutException('Batch timed out after %s seconds.' % self.timeout)
+
+    def check(self):
+        """ Raises an exception if cancelled or timed out. """
+        if self.cancelled():
+            raise self.exception()
 
 
 class CkCmdException(BaseException):
     """ Raised for ckcmd.exe exceptions. """
 
+
+class CkCmdTimeoutException(CkCmdException):
+    """ Raised when a ck-cmd process or batch times out. """
+
+
+class CkCmdCancelledException(CkCmdException):
+    """ Raised when a ck-cmd process is cancelled. """
+
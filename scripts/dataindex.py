@@ -0,0 +1,219 @@
+"""
+An in-memory index of data directory listings, used to resolve Skyrim's data structure without re-walking it.
+
+Each directory is listed once and its listing is reused until the directory's mtime changes, so a lookup costs one
+stat per directory on the path instead of a listing. Listings use scandir when available.
+
+Listings under a data root can be saved to a manifest in the root and loaded by the next session, so a cold start
+only re-lists the directories that changed since. Manifests are replaced atomically, so an interrupted save never
+leaves a partial manifest behind.
+"""
+
+
+import os
+import sys
+import json
+import stat
+import tempfile
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+def _native(name):
+    """ Converts a name read from json back to the native string type, which is bytes on Python 2. """
+    return name if isinstance(name, str) else name.encode(sys.getfilesystemencoding() or 'utf-8')
+
+
+class DataIndex(object):
+    """ A cache of directory listings validated by each directory's mtime. """
+
+    MANIFEST = 'skymaya_manifest.json'
+    VERSION = 1
+
+    def __init__(self):
+        self._listings = {}
+        self._roots = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """ Forgets every listing, for file systems whose mtimes are too coarse to notice a change. """
+        self._listings = {}
+
+    def load(self, root):
+        """
+        Loads the listings saved in a data root's manifest, once per root.
+        Loaded listings are still validated by mtime before they are used.
+
+        Args:
+            root(str): A data root directory.
+        """
+        with self._lock:
+            if root in self._roots:
+                return
+            self._roots[root] = False
+        try:
+            with open(os.path.join(root, self.MANIFEST)) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if manifest.get('version') != self.VERSION:
+            return
+        for relpath, (mtime, names, dirs) in manifest['listings'].items():
+            relpath, names, dirs = _native(relpath), [_native(n) for n in names], [_native(n) for n in dirs]
+            directory = os.path.join(root, *relpath.split('/')) if relpath else root
+            self._listings.setdefault(directory, (mtime, names, dict((os.path.normcase(n), n) for n in dirs)))
+
+    def roots(self):
+        """ Returns the loaded data roots. """
+        with self._lock:
+            return list(self._roots)
+
+    def save(self, root=None):
+        """
+        Writes the listings under loaded data roots to their manifests, if any have changed since loading.
+
+        Args:
+            root(str): A data root to save, defaults to every loaded root.
+        """
+        with self._lock:
+            roots = list(self._roots.items())
+        for directory, dirty in roots:
+            if not dirty or (root is not None and directory != root):
+                continue
+            listings = {}
+            for path, (mtime, names, dirs) in list(self._listings.items()):
+                if self._under(path, directory):
+                    relpath = os.path.relpath(path, directory).replace(os.sep, '/')
+                    listings['' if relpath == '.' else relpath] = [mtime, names, sorted(dirs.values())]
+
+            # Write a temporary file and rename it over the manifest, so readers never see a partial manifest
+            manifest = os.path.join(directory, self.MANIFEST)
+            try:
+                handle, staging = tempfile.mkstemp(prefix=self.MANIFEST, suffix='.tmp', dir=directory)
+            except (IOError, OSError):
+                continue  # A read-only data directory
+            try:
+                with os.fdopen(handle, 'w') as f:
+                    json.dump({'version': self.VERSION, 'listings': listings}, f)
+                if os.name == 'nt' and os.path.exists(manifest):
+                    os.remove(manifest)  # Windows cannot rename over an existing file
+                os.rename(staging, manifest)
+            except (IOError, OSError):
+                if os.path.exists(staging):
+                    os.remove(staging)
+                continue
+            with self._lock:
+                self._roots[directory] = False
+
+    @staticmethod
+    def _under(path, root):
+        root = root.rstrip('\\/')
+        return path == root or path.startswith(root + os.sep)
+
+    def _list(self, directory):
+        """
+        Lists a directory, reusing the previous listing if the directory has not changed.
+
+        Returns:
+            tuple: A list of entry names in listing order and a dictionary of sub directory names keyed by their
+                normalized case, or None if the path is not a directory.
+        """
+        try:
+            st = os.stat(directory)
+        except (OSError, TypeError):
+            self._listings.pop(directory, None)
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+
+        listing = self._listings.get(directory)
+        if listing is not None and listing[0] == st.st_mtime:
+            return listing[1:]
+
+        if scandir is not None:
+            entries = [(entry.name, entry.is_dir()) for entry in scandir(directory)]
+        else:
+            entries = [(name, os.path.isdir(os.path.join(directory, name))) for name in os.listdir(directory)]
+        names = [name for name, is_dir in entries]
+        dirs = dict((os.path.normcase(name), name) for name, is_dir in entries if is_dir)
+        self._listings[directory] = (st.st_mtime, names, dirs)
+
+        # Only changed contents need saving, saving a manifest changes its root's mtime but not its names
+        if listing is None or listing[1] != names or listing[2] != dirs:
+            with self._lock:
+                for root in self._roots:
+                    if self._under(directory, root):
+                        self._roots[root] = True
+        return names, dirs
+
+    def listdir(self, directory):
+        """ Returns the entry names of a directory, or an empty list if it does not exist. """
+        listing = self._list(directory)
+        return list(listing[0]) if listing is not None else []
+
+    def find_directory(self, root, subdirectories):
+        """
+        Finds a path matching a directory pattern, see main.getSubDirectory().
+
+        Args:
+            root(str): The root directory to search.
+            subdirectories(list): A list of sub-directory names, None for any entry or a list of options.
+
+        Returns:
+            str: The matching path, or None if not found.
+        """
+        if len(subdirectories) == 0:
+            return root
+        listing = self._list(root)
+        if listing is None:
+            return None
+        names, dirs = listing
+
+        name = subdirectories[0]
+        if name is None:
+            # Directories are listed before files, matching os.walk
+            children = [n for n in names if os.path.normcase(n) in dirs] + \
+                       [n for n in names if os.path.normcase(n) not in dirs]
+            if len(children) == 0:
+                return None
+            return self.find_directory(os.path.join(root, children[0]), subdirectories[1:])
+
+        for option in name if isinstance(name, (list, tuple)) else [name]:
+            if os.path.normcase(option) not in dirs:
+                continue
+            path = self.find_directory(os.path.join(root, option), subdirectories[1:])
+            if path:
+                return path
+        return None
+
+    def find_file(self, root, keyword):
+        """
+        Finds the first file containing a keyword in a directory or its sub directories, in os.walk order.
+
+        Args:
+            root(str): A root path to search.
+            keyword(str): A keyword to search for, None will return any file.
+
+        Returns:
+            str: A file path or None.
+        """
+        listing = self._list(root)
+        if listing is None:
+            return None
+        names, dirs = listing
+        for name in names:
+            if os.path.normcase(name) not in dirs and (keyword is None or keyword in name):
+                return os.path.join(root, name)
+        for name in names:
+            if os.path.normcase(name) in dirs:
+                path = self.find_file(os.path.join(root, name), keyword)
+                if path is not None:
+                    return path
+        return None
@@ -0,0 +1,123 @@
+"""
+A stand-in for ck-cmd.exe that emulates each verb's file outputs.
+
+This lets the ckcmd wrapper and batch functions run and be timed on machines without ck-cmd, for example with
+`ckcmd.set_executable(fakeckcmd.__file__)`. Outputs contain a hash of their input so conversions are deterministic.
+
+Environment variables:
+    FAKE_CKCMD_STARTUP: Seconds to sleep before converting anything, defaults to 0.
+    FAKE_CKCMD_LATENCY: Seconds to sleep per converted file, defaults to 0.
+    FAKE_CKCMD_FAIL: Files containing this keyword raise an exception on stderr.
+"""
+
+
+import os
+import sys
+import time
+import hashlib
+
+
+def get_option(args, names, default=''):
+    """ Pops an option given either as --name=value or as -name value. """
+    for index, arg in enumerate(args):
+        for name in names:
+            if arg.startswith('%s=' % name):
+                del args[index]
+                return arg.split('=', 1)[1].strip('"')
+            if arg == name and index + 1 < len(args):
+                value = args[index + 1]
+                del args[index:index + 2]
+                return value
+    return default
+
+
+def list_files(path, extension):
+    """ Lists files with the given extension in a file or directory path. """
+    if not path:
+        return []
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extension):
+                files.append(os.path.join(root, filename))
+    return files
+
+
+def convert(src, dst):
+    """ Writes an output file derived from the source file, emulating the configured latency and failures. """
+    sys.stdout.write('Converting %s\n' % os.path.basename(src))
+    sys.stdout.flush()
+    time.sleep(float(os.environ.get('FAKE_CKCMD_LATENCY', 0)))
+    keyword = os.environ.get('FAKE_CKCMD_FAIL')
+    if keyword and keyword in src:
+        sys.stderr.write('Exception: failed to convert %s\n' % src)
+        sys.exit(1)
+
+    sha = hashlib.sha1()
+    if os.path.isfile(src):
+        with open(src, 'rb') as f:
+            sha.update(f.read())
+    if not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    with open(dst, 'w') as f:
+        f.write('fakeckcmd %s %s\n' % (os.path.basename(src), sha.hexdigest()))
+
+
+def rename(path, extension):
+    """ Replaces the extension of a file name. """
+    return os.path.splitext(os.path.basename(path))[0] + extension
+
+
+def main(argv):
+    if len(argv) == 0:
+        sys.stderr.write('Exception: no verb given\n')
+        return 1
+    time.sleep(float(os.environ.get('FAKE_CKCMD_STARTUP', 0)))
+    verb, args = argv[0], list(argv[1:])
+
+    if verb == 'exportanimation':
+        skeleton, animation, output = args[:3]
+        for path in list_files(animation, '.hkx'):
+            convert(path, os.path.join(output, rename(path, '.fbx')))
+
+    elif verb == 'importanimation':
+        cache = get_option(args, ['--c'])
+        get_option(args, ['--b'])
+        output = get_option(args, ['--e'])
+        skeleton, animation = args[:2]
+        for path in list_files(animation, '.fbx'):
+            convert(path, os.path.join(output, rename(path, '.hkx')))
+        if cache:
+            convert(cache, os.path.join(output, os.path.basename(cache)))
+
+    elif verb == 'exportrig':
+        output = get_option(args, ['--e'])
+        get_option(args, ['--a'])
+        get_option(args, ['--n'])
+        get_option(args, ['--b'])
+        get_option(args, ['--c'])
+        skeleton, nif = args[:2]
+        convert(skeleton, os.path.join(output, 'skeleton.fbx'))
+
+    elif verb == 'importrig':
+        get_option(args, ['-a', '--a'])
+        output = get_option(args, ['-e', '--e'])
+        skeleton = args[0]
+        convert(skeleton, os.path.join(output, rename(skeleton, '.hkx')))
+        convert(skeleton, os.path.join(output, rename(skeleton, '_le.hkx')))
+        convert(skeleton, os.path.join(output, rename(skeleton, '.nif')))
+
+    elif verb == 'importskin':
+        skin, output = args[:2]
+        convert(skin, os.path.join(output, rename(skin, '.nif')))
+
+    else:
+        sys.stderr.write('Exception: unknown verb "%s"\n' % verb)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
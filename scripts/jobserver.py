@@ -0,0 +1,200 @@
+"""
+A local ck-cmd job server shared by multiple Maya sessions.
+
+The server limits how many ck-cmd processes run on a machine at once and shares a single process between every
+client requesting the same conversion. Start it with `python -m skymaya.jobserver` and enable it in each session
+with `ckcmd.enable_server()`.
+
+Clients authenticate with a per-user secret, see ckcmd.server_authkey(), and can only request one of the ck-cmd verbs
+in ckcmd.SERVER_VERBS. The server builds each command from its own ck-cmd executable. To share a server between
+several users, start it and every Maya session with the same SKYMAYA_SERVER_AUTHKEY environment variable, clients
+with a different key run ck-cmd locally instead.
+"""
+
+
+import os
+import argparse
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, AuthenticationError
+
+from skymaya import ckcmd
+
+
+class Job(object):
+    """ A ck-cmd process shared by every client that requested the same command. """
+
+    def __init__(self, command, directory, timeout=None):
+        self.command = command
+        self.directory = directory
+        self.timeout = timeout
+        self.cancel = ckcmd.Cancellation()
+        self.finished = threading.Event()
+        self._lines = []
+        self._result = None
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, connection):
+        """
+        Streams the job's output so far to a client and adds it to the clients receiving further output.
+
+        Args:
+            connection(Connection): A client connection.
+
+        Returns:
+            bool: False if the job was cancelled before finishing and cannot take on new clients, otherwise True.
+        """
+        with self._lock:
+            if self._result is None and self.cancel.cancelled():
+                return False
+            try:
+                for message in self._lines:
+                    connection.send(message)
+                if self._result is not None:
+                    connection.send(self._result)
+                    return True
+            except (IOError, EOFError):
+                return True
+            self._clients.append(connection)
+            return True
+
+    def unsubscribe(self, connection):
+        """ Stops streaming to a client, cancelling the job once no clients remain. """
+        with self._lock:
+            if connection in self._clients:
+                self._clients.remove(connection)
+            if len(self._clients) == 0 and self._result is None:
+                self.cancel.cancel()
+
+    def broadcast(self, message):
+        """ Sends a message to every subscribed client. """
+        with self._lock:
+            if message[0] == 'line':
+                self._lines.append(message)
+            else:
+                self._result = message
+            for connection in list(self._clients):
+                try:
+                    connection.send(message)
+                except (IOError, EOFError):
+                    self._clients.remove(connection)
+        if message[0] != 'line':
+            self.finished.set()
+
+
+class JobServer(object):
+    """ Runs ck-cmd for clients connecting to a local address. """
+
+    def __init__(self, address=None, authkey=None, max_workers=None):
+        self.address = address or ckcmd.SERVER_ADDRESS
+        self.authkey = authkey or ckcmd.server_authkey()
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self._semaphore = threading.Semaphore(self.max_workers)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        """ Accepts clients until the process is stopped. """
+        listener = Listener(self.address, backlog=64, authkey=self.authkey)
+        print 'Serving ck-cmd on %s with %s workers' % (self.address, self.max_workers)
+        try:
+            while True:
+                try:
+                    connection = listener.accept()
+                except (IOError, EOFError, AuthenticationError):
+                    continue
+                thread = threading.Thread(target=self.handle, args=(connection,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            listener.close()
+
+    def handle(self, connection):
+        """ Runs or joins the job a client requests and streams its output back until it finishes. """
+        job = None
+        try:
+            try:
+                command, directory, timeout = self.parse(connection.recv())
+            except JobServerException as e:
+                connection.send(('failed', 'CkCmdException', str(e), None))
+                return
+            # Only identical requests share a job, and a cancelled job is replaced rather than joined
+            key = (tuple(command), directory, timeout)
+            while True:
+                with self._lock:
+                    job = self._jobs.get(key)
+                    if job is None or job.cancel.cancelled():
+                        job = self._jobs[key] = Job(command, directory, timeout)
+                        thread = threading.Thread(target=self.run, args=(key, job))
+                        thread.daemon = True
+                        thread.start()
+                if job.subscribe(connection):
+                    break
+
+            # Wait for the job to finish unless the client cancels or disconnects first
+            while not job.finished.is_set():
+                if connection.poll(0.1) and connection.recv() == 'cancel':
+                    job.unsubscribe(connection)
+                    break
+        except (IOError, EOFError):
+            if job is not None:
+                job.unsubscribe(connection)
+        finally:
+            connection.close()
+
+    def parse(self, request):
+        """
+        Builds the ck-cmd command a client requests, rejecting anything but a known verb with string arguments.
+
+        Args:
+            request(dict): A request with a verb, a list of arguments, a directory and an optional timeout.
+
+        Returns:
+            tuple: The command, the directory to run it in and the timeout.
+        """
+        if not isinstance(request, dict) or request.get('verb') not in ckcmd.SERVER_VERBS:
+            raise JobServerException('Unsupported ck-cmd request.')
+        arguments, directory, timeout = request.get('arguments'), request.get('directory'), request.get('timeout')
+        if not isinstance(arguments, list) or not all(isinstance(argument, basestring) for argument in arguments):
+            raise JobServerException('ck-cmd arguments must be a list of strings.')
+        if not isinstance(directory, basestring) or not os.path.isdir(directory):
+            raise JobServerException('ck-cmd must run in an existing directory.')
+        if timeout is not None and not isinstance(timeout, (int, long, float)):
+            raise JobServerException('ck-cmd timeouts must be a number of seconds.')
+        return ckcmd.executable() + [request['verb']] + arguments, directory, timeout
+
+    def run(self, key, job):
+        """ Runs a job once a worker is available and broadcasts its result. """
+        with self._semaphore:
+            try:
+                ckcmd.run_command(job.command, job.directory, callback=lambda line: job.broadcast(('line', line)),
+                                  timeout=job.timeout, cancel=job.cancel)
+                result = ('done', None, None, 0)
+            except BaseException as e:
+                result = ('failed', type(e).__name__, str(e), getattr(e, 'returncode', None))
+        with self._lock:
+            if self._jobs.get(key) is job:
+                del self._jobs[key]
+        job.broadcast(result)
+
+
+def main(argv=None):
+    """ Runs a job server from the command line. """
+    parser = argparse.ArgumentParser(description='Runs a local ck-cmd job server.')
+    parser.add_argument('--host', default=ckcmd.SERVER_ADDRESS[0])
+    parser.add_argument('--port', type=int, default=ckcmd.SERVER_ADDRESS[1])
+    parser.add_argument('--workers', type=int, default=None, help='Maximum ck-cmd processes, defaults to cpu count.')
+    args = parser.parse_args(argv)
+
+    # The server runs ck-cmd itself, so it must never forward to another server
+    ckcmd.disable_server()
+    JobServer((args.host, args.port), max_workers=args.workers).serve_forever()
+
+
+class JobServerException(BaseException):
+    """ Raised when a client requests something the job server does not run. """
+
+
+if __name__ == '__main__':
+    main()
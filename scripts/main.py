@@ -4,12 +4,20 @@ Main functions for using ckcmd in Maya.
 
 
 import os
+import atexit
 import shutil
+import functools
 
 import pymel.core as pmc
 
 from pywind_old import maya as om2
+from skymaya import bsa
 from skymaya import ckcmd
+from skymaya import dataindex
+from skymaya import pipeline
+from skymaya import skin
+from skymaya import sync
+from skymaya import watcher
 
 ROOT_NAME = 'NPC_s_Root_s__ob_Root_cb_'
 BOUNDING_BOX_NAME = 'BoundingBox'
@@ -17,6 +25,13 @@ MATCH_ATTR_NAME = 'retargetMatch'
 RETARGET_ATTR_NAME = 'retargetAnimMatch'
 RIG_NAMESPACE = 'RIG'
 SCENE_DIRECTORY = None
+DATA_ROOTS = []
+DATA_ROOTS_OPTION = 'skymayaDataRoots'
+SCENE_CONTEXT = None
+SCENE_CALLBACKS = []
+INDEX = dataindex.DataIndex()
+WATCHER = None
+INITIALIZED = False
 
 
 def getSceneDirectory():
@@ -38,6 +53,153 @@ def getSceneDirectory():
         return SCENE_DIRECTORY
 
 
+class SceneContext(object):
+    """
+    Caches paths resolved for a scene directory, such as its data root, actor and dlc.
+    Paths that could not be found are resolved again on the next call.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.values = {}
+
+    def resolve(self, function, *args, **kwargs):
+        """ Calls a path function once, returning the cached result for the same arguments afterwards. """
+        key = (function.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self.values:
+            value = function(*args, **kwargs)
+            if value is None:
+                return None
+            self.values[key] = value
+        return self.values[key]
+
+
+def getSceneContext():
+    """ Gets the path context for the current scene directory, cleared whenever a scene is opened or saved. """
+    global SCENE_CONTEXT
+    if len(SCENE_CALLBACKS) == 0:
+        for message in [om2.MSceneMessage.kAfterOpen, om2.MSceneMessage.kAfterNew, om2.MSceneMessage.kAfterSave]:
+            SCENE_CALLBACKS.append(om2.MSceneMessage.addCallback(message, lambda *args: clearSceneContext()))
+
+    directory = getSceneDirectory()
+    if SCENE_CONTEXT is None or SCENE_CONTEXT.directory != directory:
+        SCENE_CONTEXT = SceneContext(directory)
+    return SCENE_CONTEXT
+
+
+def clearSceneContext():
+    """ Clears the paths cached for the current scene, for example after adding files to its data directory. """
+    global SCENE_CONTEXT
+    SCENE_CONTEXT = None
+
+
+def setDataRoots(roots):
+    """
+    Stacks data directories so they are searched as one, for example a mod workspace over a vanilla unpack.
+    Lookups within any of the roots return the path from the first root containing it, and files written through
+    getWritePath() and getWriteDirectory() are always written to the first root.
+
+    The roots are saved in an optionVar and restored by the next session.
+
+    Args:
+        roots(list): An ordered list of data root directories, the first overrides the rest. Empty to disable.
+    """
+    global DATA_ROOTS
+    DATA_ROOTS = [os.path.abspath(root).rstrip('\\/') for root in roots]
+    pmc.optionVar[DATA_ROOTS_OPTION] = os.pathsep.join(DATA_ROOTS)
+    clearSceneContext()
+
+
+def loadDataRoots():
+    """ Restores the data roots stacked by a previous session, see setDataRoots(). """
+    global DATA_ROOTS
+    roots = pmc.optionVar.get(DATA_ROOTS_OPTION, '')
+    DATA_ROOTS = [root for root in roots.split(os.pathsep) if root]
+    clearSceneContext()
+
+
+def getDataRoot(path):
+    """
+    Finds the stacked data root containing the given path.
+
+    Args:
+        path(str): A file or directory path.
+
+    Returns:
+        tuple: The data root and the path relative to it, or (None, None) if no stacked root contains the path.
+    """
+    if path is None:
+        return None, None
+    path = os.path.abspath(path)
+    for root in DATA_ROOTS:
+        if os.path.normcase(path) == os.path.normcase(root):
+            return root, ''
+        if os.path.normcase(path).startswith(os.path.normcase(root) + os.sep):
+            return root, path[len(root) + 1:]
+    return None, None
+
+
+def getLayerPaths(path):
+    """ Returns the given path in every stacked data root in order of precedence, or just the path if unstacked. """
+    root, relpath = getDataRoot(path)
+    if root is None:
+        return [path]
+    return [os.path.join(layer, relpath) if relpath else layer for layer in DATA_ROOTS]
+
+
+def getWritePath(path):
+    """
+    Returns the path a file should be written to, in the first stacked data root if the path is stacked.
+    A hard linked file, such as one extracted from a store, is replaced with a private copy so writing to it in place
+    cannot change its other links.
+    """
+    root, relpath = getDataRoot(path)
+    if root is not None:
+        path = os.path.join(DATA_ROOTS[0], relpath) if relpath else DATA_ROOTS[0]
+    ckcmd.detach(path)
+    return path
+
+
+def getWriteDirectory(path):
+    """
+    Returns the directory files should be written to, creating it in the first stacked data root if needed.
+    Files written to the directory must still go through getWritePath(), or ckcmd.detach() for ck-cmd outputs.
+    """
+    path = getWritePath(path)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def saveIndex(root=None):
+    """
+    Saves the data index manifests of loaded data roots, see DataIndex.save().
+    Stacked data roots below the first are never written to, since they may be read-only.
+
+    Args:
+        root(str): A data root to save, defaults to every loaded root.
+    """
+    for directory in INDEX.roots():
+        if root is not None and directory != root:
+            continue
+        layer, relpath = getDataRoot(directory)
+        if layer is None or layer == DATA_ROOTS[0]:
+            INDEX.save(directory)
+
+
+def initialize():
+    """
+    Starts a session, restoring the stacked data roots and saving the data index when Maya exits.
+    Importing this module has no side effects, so the shelf buttons call this first and so should batch tools that
+    need the saved data roots.
+    """
+    global INITIALIZED
+    if INITIALIZED:
+        return
+    loadDataRoots()
+    atexit.register(saveIndex)
+    INITIALIZED = True
+
+
 def getParentDirectory(path):
     """ Returns the parent directory of the given directory. """
     return os.path.abspath(os.path.join(path, os.pardir))
@@ -154,6 +316,11 @@ def getDataDirectory(path):
         A root directory path.
     """
 
+    # Paths within stacked data roots belong to their root
+    root, relpath = getDataRoot(path)
+    if root is not None:
+        return root
+
     # Attempt to find a root based on consistant folder names.
     if path.endswith('meshes') or path.endswith('textures'):
         return getParentDirectory(path)
@@ -163,9 +330,9 @@ def getDataDirectory(path):
             return getParentDirectory(parentDir)
 
     # Check if the path itself is a root directory
-    children = os.listdir(path)
+    children = INDEX.listdir(path)
     if 'meshes' in children or 'textures' in children:
-        if 'actors' in os.listdir(os.path.join(path, 'meshes')):
+        if 'actors' in INDEX.listdir(os.path.join(path, 'meshes')):
             return path
 
     # If the path has no parent, raise an exception
@@ -181,7 +348,10 @@ def getDataDirectory(path):
 
 def getSceneDataDirectory():
     """ Gets the skyrim data root directory for the current scene. """
-    return getDataDirectory(getSceneDirectory())
+    context = getSceneContext()
+    root = context.resolve(getDataDirectory, context.directory)
+    INDEX.load(root)
+    return root
 
 
 def getActor(path):
@@ -207,7 +377,8 @@ def getActor(path):
 
 def getSceneActor():
     """ Gets a actor name for the current scene. """
-    return getActor(getSceneDirectory())
+    context = getSceneContext()
+    return context.resolve(getActor, context.directory)
 
 
 def getDlc(path):
@@ -230,7 +401,8 @@ def getDlc(path):
 
 def getSceneDlc():
     """ Gets a dlc number for the current scene. """
-    return getDlc(getSceneDirectory())
+    context = getSceneContext()
+    return context.resolve(getDlc, context.directory)
 
 
 def getSubDirectory(root, subdirectories):
@@ -246,34 +418,12 @@ def getSubDirectory(root, subdirectories):
     Returns:
         str: The directory path if found or None.
     """
-    if len(subdirectories) == 0:
-        return root
-
-    try:
-        next_dir = subdirectories[0]
-        if next_dir is None:
-            for root, dirs, files in os.walk(root):
-                next_dir = dirs + files
-                next_dir = next_dir[0]
-                return getSubDirectory(os.path.join(root, next_dir), subdirectories[1:])
-            raise DirectoryException
-        elif isinstance(next_dir, (list, tuple)):
-            for dir in next_dir:
-                subdirectory = os.path.join(root, dir)
-                if not os.path.isdir(subdirectory):
-                    continue
-                subdirectory = getSubDirectory(subdirectory, subdirectories[1:])
-                if subdirectory:
-                    return subdirectory
-            raise DirectoryException
-        else:
-            subdirectory = os.path.join(root, next_dir)
-            if not os.path.isdir(subdirectory):
-                raise DirectoryException
-            return getSubDirectory(subdirectory, subdirectories[1:])
-    except DirectoryException:
-        paths = [root] + [str(directory) for directory in subdirectories]
-        raise DirectoryException('Could not find sub directory "%s"' % os.path.join(*paths))
+    for layer in getLayerPaths(root):
+        path = INDEX.find_directory(layer, subdirectories)
+        if path is not None:
+            return path
+    paths = [root] + [str(directory) for directory in subdirectories]
+    raise DirectoryException('Could not find sub directory "%s"' % os.path.join(*paths))
 
 
 def getSubFile(root, keyword):
@@ -289,12 +439,10 @@ def getSubFile(root, keyword):
     """
     if root is None:
         return None
-    for root, dirs, files in os.walk(root):
-        if keyword is None:
-            return os.path.join(root, files[0])
-        for file in files:
-            if keyword in file:
-                return os.path.join(root, file)
+    for layer in getLayerPaths(root):
+        path = INDEX.find_file(layer, keyword)
+        if path is not None:
+            return path
     return None
 
 
@@ -317,7 +465,8 @@ def getTextureDirectory(root, actor=None, dlc=None):
 
 
 def getSceneTextureDirectory():
-    return getTextureDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getTextureDirectory, root, actor, dlc)
 
 
 def getAnimationDirectory(root=None, actor=None, dlc=None):
@@ -339,7 +488,8 @@ def getAnimationDirectory(root=None, actor=None, dlc=None):
 
 
 def getSceneAnimationDirectory():
-    return getAnimationDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getAnimationDirectory, root, actor, dlc)
 
 
 def getCharacterAssetDirectory(root, actor=None, dlc=None):
@@ -361,7 +511,8 @@ def getCharacterAssetDirectory(root, actor=None, dlc=None):
 
 
 def getSceneCharacterAssetDirectory():
-    return getCharacterAssetDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getCharacterAssetDirectory, root, actor, dlc)
 
 
 def getBehaviorDirectory(root, actor=None, dlc=None):
@@ -383,7 +534,8 @@ def getBehaviorDirectory(root, actor=None, dlc=None):
 
 
 def getSceneBehaviorDirectory():
-    return getBehaviorDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getBehaviorDirectory, root, actor, dlc)
 
 
 def getAnimationDataDirectory(root):
@@ -441,7 +593,7 @@ def getBoundAnimFile(root, name):
 
 
 def getSceneCacheFile():
-    return getCacheFile(getSceneDataDirectory(), getSceneActor())
+    return getSceneContext().resolve(getCacheFile, getSceneDataDirectory(), getSceneActor())
 
 
 def getTagDirectory(root, actor=None, dlc=None):
@@ -463,7 +615,8 @@ def getTagDirectory(root, actor=None, dlc=None):
 
 
 def getSceneTagDirectory():
-    return getTagDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getTagDirectory, root, actor, dlc)
 
 
 def getActorDirectory(root, actor=None, dlc=None):
@@ -485,7 +638,8 @@ def getActorDirectory(root, actor=None, dlc=None):
 
 
 def getSceneActorDirectory():
-    return getActorDirectory(getSceneDataDirectory(), getSceneActor(), getSceneDlc())
+    root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    return getSceneContext().resolve(getActorDirectory, root, actor, dlc)
 
 
 def getActorsDirectory(root, dlc=None):
@@ -516,7 +670,10 @@ def listActors(root, dlc=None):
     Returns:
         list: A list of actor names.
     """
-    return os.listdir(getActorsDirectory(root, dlc=dlc))
+    actors = []
+    for directory in getLayerPaths(getActorsDirectory(root, dlc=dlc)):
+        actors.extend(actor for actor in INDEX.listdir(directory) if actor not in actors)
+    return actors
 
 
 def getSkeletonHkx(root, actor=None, dlc=None, legacy=False):
@@ -537,7 +694,7 @@ def getSkeletonHkx(root, actor=None, dlc=None, legacy=False):
 
 def getSceneSkeletonHkx(legacy=False):
     root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
-    return getSkeletonHkx(root, actor, dlc, legacy=legacy)
+    return getSceneContext().resolve(getSkeletonHkx, root, actor, dlc, legacy=legacy)
 
 
 def getSkeletonNif(root, actor=None, dlc=None):
@@ -557,31 +714,79 @@ def getSkeletonNif(root, actor=None, dlc=None):
 
 def getSceneSkeletonNif():
     root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
-    return getSkeletonNif(root, actor, dlc)
+    return getSceneContext().resolve(getSkeletonNif, root, actor, dlc)
 
 
 class ProgressContext(object):
-    """ A progress bar context manager. """
+    """ A progress bar context manager. In batch mode, such as mayapy, progress is ignored. """
     def __init__(self, count=1, title='Progress Bar'):
         self.count = count
         self.title = title
-        self.bar = pmc.mel.eval('$tmp = $gMainProgressBar');
+        self.bar = None if pmc.about(batch=True) else pmc.mel.eval('$tmp = $gMainProgressBar');
 
     def __enter__(self):
-        pmc.progressBar(self.bar, edit=True, beginProgress=True, isInterruptable=False, maxValue=self.count)
+        if self.bar is not None:
+            pmc.progressBar(self.bar, edit=True, beginProgress=True, isInterruptable=False, maxValue=self.count)
         return self
 
     def setStatus(self, status):
-        pmc.progressBar(self.bar, edit=True, status=status)
+        if self.bar is not None:
+            pmc.progressBar(self.bar, edit=True, status=status)
 
     def step(self):
-        pmc.progressBar(self.bar, edit=True, step=1)
+        if self.bar is not None:
+            pmc.progressBar(self.bar, edit=True, step=1)
+
+    def track(self, line):
+        """ Updates the status with the file a line of ck-cmd output refers to. """
+        filename = ckcmd.parse_progress(line)
+        if filename is not None:
+            self.setStatus('%s: %s' % (self.title, filename))
 
     def __exit__(self, *args, **kwargs):
-        pmc.progressBar(self.bar, edit=True, endProgress=True)
+        if self.bar is not None:
+            pmc.progressBar(self.bar, edit=True, endProgress=True)
+
 
+def convert(function, args, kwargs=None, title='Converting', wait=True):
+    """
+    Runs a ck-cmd conversion, either blocking with a progress bar or in the background.
+    Background conversions report their result in the script editor once finished and can be stopped with
+    Future.cancel().
+    
+    Args:
+        function(function): A ckcmd conversion function.
+        args(list): Positional arguments for the function.
+        kwargs(dict): Keyword arguments for the function.
+        title(str): A description of the conversion.
+        wait(bool): Whether to block until the conversion finishes.
+
+    Returns:
+        Future: A handle to the background conversion, or None if waiting.
+    """
+    kwargs = dict(kwargs or {})
+    if kwargs.get('cancel') is None:
+        kwargs['cancel'] = ckcmd.Cancellation()
+    if wait:
+        with ProgressContext(title=title) as progress:
+            kwargs['callback'] = progress.track
+            function(*args, **kwargs)
+        return None
+
+    def onConverted(future):
+        exception = future.exception()
+        if exception is not None:
+            pmc.warning('%s failed: %s' % (title, exception))
+        else:
+            pmc.displayInfo('%s finished.' % title)
+
+    future = ckcmd.submit(function, *args, **kwargs)
+    future.add_done_callback(onConverted)
+    return future
 
-def extractActor(path=None, actor=None, destination=None):
+
+def extractActor(path=None, actor=None, destination=None, overlay=False, mode=sync.COPY, checksum=False,
+                 workers=None, store=None):
     """
     Extracts an actors files to a separate directory.
     
@@ -589,6 +794,18 @@ def extractActor(path=None, actor=None, destination=None):
         path(str): A source data directory or actor directory. 
         actor(str): An actor name. 
         destination(str): An output data directory. 
+        overlay(bool): Whether to stack the destination over the source data directory instead of copying files.
+            Only files that get written are then created in the destination, see setDataRoots().
+        mode(str): How files are copied, either sync.COPY, sync.HARDLINK or sync.REFLINK. Hard linked files share
+            their data with the source, so editing one in place edits both.
+        checksum(bool): Whether to compare the contents of files whose size matches but modification time does not.
+        workers(int): The number of files to copy at once, defaults to the cpu count.
+        store(str): An optional store directory shared between workspaces. Files are added to the store and hard
+            linked into the destination, so identical files are only kept once, see sync.Store. Files are copied
+            instead where hard links are unsupported, such as Python 2 on Windows.
+
+    Extracting to an existing destination only copies files that are missing or have changed.
+    If the actor is not unpacked in the source data directory its files are extracted from the source's archives.
 
     Returns:
         str: The destination directory.
@@ -598,90 +815,275 @@ def extractActor(path=None, actor=None, destination=None):
     actor = actor or getActor(path) or getDirectoryDialog('Actor Directory')
     dstRoot = destination or getDirectoryDialog('Destination Directory')
     dlc = getDlc(path)
-    srcActorDir = getActorDirectory(srcRoot, actor, dlc)
+
+    # Read archived actors straight from the source archives
+    try:
+        srcActorDir = getActorDirectory(srcRoot, actor, dlc)
+    except DirectoryException:
+        if len(bsa.find_archives(srcRoot)) == 0:
+            raise
+        extractArchivedActor(srcRoot, actor, dlc, dstRoot)
+        if overlay:
+            setDataRoots([dstRoot, srcRoot])
+        return dstRoot
+
     srcTextureDir = getTextureDirectory(srcRoot, actor, dlc)
     srcCacheFile = getCacheFile(srcRoot, actor)
     srcBoundAnimFile = getBoundAnimFile(srcRoot, actor)
 
-    def makeDir(path):
-        if not os.path.exists(path):
-            os.makedirs(path)
-        return path
-
-    def copyDir(src, dst):
-        for item in os.listdir(src):
-            s = os.path.join(src, item)
-            d = os.path.join(dst, item)
-            if os.path.isdir(s):
-                shutil.copytree(s, d, symlinks=False, ignore=None)
-            else:
-                shutil.copy2(s, d)
-
-    # Make core directories
-    meshDir = makeDir(os.path.join(dstRoot, 'meshes'))
-    actorsDir = makeDir(os.path.join(meshDir, 'actors'))
-    actorDir = makeDir(os.path.join(actorsDir, actor))
-    textureDir = makeDir(os.path.join(dstRoot, 'textures'))
-    texturesDir = makeDir(os.path.join(textureDir, 'actors'))
-    textureDir = makeDir(os.path.join(texturesDir, actor))
-    animDataDir = makeDir(os.path.join(meshDir, 'animationdata'))
-    boundAnimDir = makeDir(os.path.join(animDataDir, 'boundanims'))
-
-    # Copy actor directories
-    copyDir(srcActorDir, actorDir)
-    copyDir(srcTextureDir, textureDir)
+    if overlay:
+        setDataRoots([dstRoot, srcRoot])
+        getWriteDirectory(srcActorDir)
+        return dstRoot
+
+    # Link from the store only where hard links work, copying otherwise
+    if store:
+        if not os.path.isdir(dstRoot):
+            os.makedirs(dstRoot)
+        store = sync.Store(store)
+        if not store.supports(dstRoot):
+            pmc.warning('Cannot hard link files from "%s" to "%s", copying them instead.' % (store.directory, dstRoot))
+            store = None
+
+    # Copy actor directories, skipping files that are already up-to-date
+    meshDir = os.path.join(dstRoot, 'meshes')
+    animDataDir = os.path.join(meshDir, 'animationdata')
+    sync.sync_directory(srcActorDir, os.path.join(meshDir, 'actors', actor), mode=mode, checksum=checksum,
+                        workers=workers, store=store)
+    sync.sync_directory(srcTextureDir, os.path.join(dstRoot, 'textures', 'actors', actor), mode=mode,
+                        checksum=checksum, workers=workers, store=store)
     if srcCacheFile is not None:
-        shutil.copyfile(srcCacheFile, os.path.join(animDataDir, os.path.basename(srcCacheFile)))
+        sync.sync_file(srcCacheFile, os.path.join(animDataDir, os.path.basename(srcCacheFile)), mode=mode,
+                       checksum=checksum, store=store)
     if srcBoundAnimFile is not None:
-        shutil.copyfile(srcBoundAnimFile, os.path.join(boundAnimDir, os.path.basename(srcBoundAnimFile)))
+        sync.sync_file(srcBoundAnimFile, os.path.join(animDataDir, 'boundanims', os.path.basename(srcBoundAnimFile)),
+                       mode=mode, checksum=checksum, store=store)
 
     # Copy Data Set Files
     srcMeshDir = os.path.join(srcRoot, 'meshes')
-    for filename in os.listdir(meshDir):
+    for filename in os.listdir(srcMeshDir):
         if filename.endswith('.txt'):
-            shutil.copyfile(os.path.join(srcMeshDir, filename), os.path.join(meshDir, filename))
+            sync.sync_file(os.path.join(srcMeshDir, filename), os.path.join(meshDir, filename), mode=mode,
+                           checksum=checksum, store=store)
+    if store is not None:
+        store.save()
+    return dstRoot
 
 
-def convertDataDirectory(path=None):
+def extractArchivedActor(root, actor, dlc=None, destination=None):
+    """
+    Extracts an actor's meshes, textures, animation cache and bound anim files from a data directory's BSA archives,
+    along with the meshes data set files. Only these files are read from the archives, nothing else is unpacked.
+    Files in archives the game loads later, such as Update.bsa, replace those in earlier archives.
+
+    Args:
+        root(str): A data directory containing BSA archives.
+        actor(str): An actor name.
+        dlc(int): An optional dlc number, default will search for a vanilla project.
+        destination(str): An output data directory, defaults to the data directory itself.
+
+    Returns:
+        list: The extracted file paths.
+    """
+    destination = destination or root
+    actorPath = bsa.normalize('meshes/actors/%s%s/' % ('dlc0%s/' % dlc if dlc else '', actor)) + '\\'
+    texturePath = bsa.normalize('textures/%sactors/%s/' % ('dlc0%s/' % dlc if dlc else '', actor)) + '\\'
+    animationDataPath = bsa.normalize('meshes/animationdata') + '\\'
+
+    def match(path):
+        if path.startswith(actorPath) or path.startswith(texturePath):
+            return True
+        if path.startswith('meshes\\') and path.count('\\') == 1 and path.endswith('.txt'):
+            return True  # Data set files
+        return path.startswith(animationDataPath) and actor.lower() in path.split('\\')[-1]
+
+    archives = [bsa.Archive(path) for path in bsa.find_archives(root)]
+    try:
+        if not any(path.startswith(actorPath) for archive in archives for path in archive.entries):
+            raise DirectoryException('Could not find actor "%s" in the archives of "%s"' % (actor, root))
+        return bsa.extract_files(archives, match, destination)
+    finally:
+        for archive in archives:
+            archive.close()
+
+
+def packActor(root=None, actor=None, dlc=None, path=None, version=bsa.SKYRIM, compress=True, processes=None):
+    """
+    Packs an actor's game files into a BSA archive, leaving out maya and fbx source files.
+    The actor's meshes and textures directories, animation data cache and bound anim file are included. Repacking only
+    compresses files that changed since the archive was last packed.
+
+    Args:
+        root(str): A root data directory, defaults to the scene's.
+        actor(str): An actor name, defaults to the scene's.
+        dlc(int): An optional dlc number, defaults to the scene's.
+        path(str): The archive path, defaults to the actor name in the data directory.
+        version(int): Either bsa.SKYRIM or bsa.SKYRIM_SE.
+        compress(bool): Whether to compress files.
+        processes(int): The number of compression processes, defaults to the cpu count.
+
+    Returns:
+        str: The archive path.
+    """
+    if root is None:
+        root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    path = path or os.path.join(getWritePath(root), '%s.bsa' % actor)
+
+    def getRelativePath(filepath):
+        layer, relpath = getDataRoot(filepath)
+        return relpath if layer is not None else os.path.relpath(filepath, root)
+
+    # Files in earlier stacked data roots replace those in later roots
+    files = {}
+    directories = [getActorDirectory(root, actor, dlc)]
+    try:
+        directories.append(getTextureDirectory(root, actor, dlc))
+    except DirectoryException:
+        pass
+    for directory in directories:
+        for layer in reversed(getLayerPaths(directory)):
+            for dirpath, dirnames, filenames in os.walk(layer):
+                for filename in filenames:
+                    if os.path.splitext(filename)[1].lower() not in ('.fbx', '.ma', '.mb'):
+                        filepath = os.path.join(dirpath, filename)
+                        files[bsa.normalize(getRelativePath(filepath))] = filepath
+    for getFile in [getCacheFile, getBoundAnimFile]:
+        try:
+            filepath = getFile(root, actor)
+        except DirectoryException:
+            continue
+        if filepath is not None:
+            files[bsa.normalize(getRelativePath(filepath))] = filepath
+
+    reused = bsa.pack(files, path, version=version, compress=compress, processes=processes)
+    print 'Packed %s files into %s, %s were unchanged.' % (len(files), path, reused)
+    return path
+
+
+def convertActor(root, actor, dlc=None, shards=1, timeout=None, cancel=None, journal=None, incremental=False):
+    """
+    Converts an actor's rig and animations from skyrim formats to fbx.
+
+    Args:
+        root(str): A root data directory.
+        actor(str): An actor name.
+        dlc(int): An optional dlc number, default will search for a vanilla project.
+        shards(int): The number of ck-cmd processes to split the actor's animations across.
+        timeout(float): An optional number of seconds to wait for each ck-cmd process.
+        cancel(Cancellation): An optional ckcmd cancellation shared by a batch of conversions.
+        journal(Journal): An optional journal to record each step in. Steps it has completed are skipped.
+        incremental(bool): Whether to only convert the rig and animations whose fbx outputs are out of date.
+    """
+    skeletonHkx = getSkeletonHkx(root, actor, dlc)
+    skeletonNif = getSkeletonNif(root, actor, dlc)
+    characterAssetsDir = getCharacterAssetDirectory(root, actor, dlc)
+    animationDir = getAnimationDirectory(root, actor, dlc)
+    cacheFile = getCacheFile(root, actor)
+    behaviorDir = getBehaviorDirectory(root, actor, dlc)
+
+    def step(stage, directory, function):
+        if journal is None:
+            function()
+        else:
+            journal.run(dlc, actor, stage, directory, function)
+
+    # Export rig and animations
+    rigDir = getWriteDirectory(characterAssetsDir)
+
+    def exportRig():
+        inputs = [skeletonHkx, skeletonNif, animationDir, behaviorDir, cacheFile]
+        if incremental and pipeline.up_to_date([os.path.join(rigDir, 'skeleton.fbx')], inputs):
+            return
+        ckcmd.exportrig(skeletonHkx, skeletonNif, rigDir,
+                        animation_hkx=animationDir, cache_txt=cacheFile, behavior_directory=behaviorDir,
+                        timeout=timeout, cancel=cancel)
+
+    step('rig', rigDir, exportRig)
+
+    # Export tags
+    try:
+        tagDir = getWriteDirectory(getTagDirectory(root, actor, dlc))
+    except DirectoryException:
+        tagDir = getWriteDirectory(os.path.join(getActorDirectory(root, actor, dlc), 'tags'))
+
+    def exportAnimations():
+        if incremental:
+            stale, count = ckcmd.stale_files(animationDir, '.hkx', tagDir, '.fbx', dependencies=[skeletonHkx])
+            if len(stale) == 0:
+                return
+            if len(stale) < count:
+                # Link only the stale animations into a directory so they still convert in one ck-cmd call
+                stagingDir = ckcmd.get_staging_directory(animationDir, 'exportanimation')
+                try:
+                    ckcmd.stage_files(animationDir, stale, stagingDir)
+                    ckcmd.exportanimation(skeletonHkx, stagingDir, tagDir, shards=shards, timeout=timeout,
+                                          cancel=cancel)
+                finally:
+                    ckcmd.remove_staging_directory(stagingDir)
+                return
+        ckcmd.exportanimation(skeletonHkx, animationDir, tagDir, shards=shards, timeout=timeout, cancel=cancel)
+
+    step('animations', tagDir, exportAnimations)
+
+
+def convertDataDirectory(path=None, workers=1, shards=1, timeout=None, batchTimeout=None, resume=False,
+                         incremental=False):
     """
     Converts an entire data directory from skyrim formats to fbx. 
+    Actors are converted independently, failed actors are reported once every other actor has been converted.
+    Each completed step is recorded in a journal in the data directory, so an interrupted conversion can be resumed.
     
     Args:
         path(str): A path to convert. 
+        workers(int): The number of actors to convert at once. None will use every available core.
+        shards(int): The number of ck-cmd processes to split each actor's animations across.
+        timeout(float): An optional number of seconds to wait for each ck-cmd process before moving on.
+        batchTimeout(float): An optional number of seconds after which every remaining conversion is cancelled.
+        resume(bool): Whether to skip steps completed by a previous conversion and retry only failed or missing ones.
+        incremental(bool): Whether to only convert rigs and animations older than their skyrim files.
+
+    Returns:
+        dict: A dictionary of exceptions keyed by each failed (dlc, actor) pair.
     """
     path = path or getDirectoryDialog('Get Data Directory')
     root = getDataDirectory(path)
+    INDEX.load(root)
 
+    actors = []
     for dlc in [None, 1, 2]:
         try:
-            actors = listActors(root, dlc)
+            actors.extend([(dlc, actor) for actor in listActors(root, dlc) if dlc or not actor.startswith('dlc')])
         except DirectoryException:
             continue
 
-        with ProgressContext(count=len(actors) * 2) as progress:
-            for actor in actors:
-                skeletonHkx = getSkeletonHkx(root, actor, dlc)
-                skeletonNif = getSkeletonNif(root, actor, dlc)
-                characterAssetsDir = getCharacterAssetDirectory(root, actor, dlc)
-                animationDir = getAnimationDirectory(root, actor, dlc)
-                cacheFile = getCacheFile(root, actor)
-                behaviorDir = getBehaviorDirectory(root, actor, dlc)
-
-                # Export rig and animations
-                progress.setStatus('Exporting %s rig' % actor)
-                ckcmd.exportrig(skeletonHkx, skeletonNif, characterAssetsDir,
-                                animation_hkx=animationDir, cache_txt=cacheFile, behavior_directory=behaviorDir)
-                progress.step()
-
-                # Export tags
-                try:
-                    tagDir = getTagDirectory(root, actor, dlc)
-                except DirectoryException:
-                    tagDir = os.path.join(getActorDirectory(root, actor, dlc), 'tags')
-                    os.makedirs(tagDir)
-                progress.setStatus('Exporting %s animations' % actor)
-                ckcmd.exportanimation(skeletonHkx, animationDir, tagDir)
-                progress.step()
+    journal = pipeline.Journal(getWriteDirectory(root))
+    if not resume:
+        journal.clear()
+
+    failures = {}
+    converted = []
+    cancel = ckcmd.Cancellation(batchTimeout)
+    with ProgressContext(count=len(actors), title='Convert Data Directory') as progress:
+        def onConverted(index, result, exception):
+            dlc, actor = actors[index]
+            if exception is not None:
+                failures[(dlc, actor)] = exception
+            converted.append(actor)
+            progress.setStatus('Converted %s (%s/%s)' % (actor, len(converted), len(actors)))
+            progress.step()
+
+        functions = [functools.partial(convertActor, root, actor, dlc, shards=shards, timeout=timeout, cancel=cancel,
+                                       journal=journal, incremental=incremental) for dlc, actor in actors]
+        ckcmd.run_parallel(functions, workers=workers, callback=onConverted)
+
+    # Summarize failed actors
+    for (dlc, actor), exception in sorted(failures.items(), key=lambda item: (item[0][0] or 0, item[0][1])):
+        print 'Failed to convert %s%s: %s' % (actor, ' (dlc0%s)' % dlc if dlc else '', exception)
+    if len(failures) > 0:
+        pmc.warning('Failed to convert %s of %s actors, see the script editor for details.' % (
+            len(failures), len(actors)))
+    saveIndex(root)
+    return failures
 
 
 def getRootJoint(namespace=None):
@@ -795,32 +1197,6 @@ def importFbx(path=None, update=False, dir=None):
     return list(nodes)
 
 
-def _checkMaxInfluences(mesh, max=4):
-    """
-    Checks if the given mesh has more influences per-vertex than a given maximum.
-    
-    Args:
-        mesh(PyNode): A mesh node.
-        max(int): The max influences to check for.
-
-    Returns:
-        bool: Whether the mesh has more influences than the maximum.
-    """
-    mesh = pmc.PyNode(mesh)
-    vertices = mesh.getVertices()[1]
-    clusters = pmc.ls(pmc.listHistory(mesh), type='skinCluster') or []
-    if len(clusters) == 0:
-        return True
-    cluster = clusters[0]
-
-    for vert in vertices:
-        joints = pmc.skinPercent(cluster, '%s.vtx[%s]' % (mesh, vert),
-                                 query=True, ignoreBelow=0.000001, transform=None) or []
-        if len(joints) > max:
-            return False
-    return True
-
-
 def exportFbx(nodes=None, path=None, animation=False):
     """
     Exports the given nodes as an fbx file.
@@ -834,6 +1210,7 @@ def exportFbx(nodes=None, path=None, animation=False):
         str: The fbx file path.
     """
     path = path or saveFbxDialog()
+    ckcmd.detach(path)
 
     # Determine what nodes we're exporting
     nodes = [pmc.PyNode(node) for node in nodes] if nodes is not None else pmc.selected()
@@ -883,19 +1260,20 @@ def importRig(path=None):
     return nodes
 
 
-def exportRig(path=None):
+def exportRig(path=None, wait=True):
     """
     Exports a rig from the current scene.
     This command relies on our static root joint existing in the scene.
     
     Args:
         path(str): A destination fbx file path.
+        wait(bool): Whether to block until the hkx conversion finishes.
     
     Returns:
-        str: The exported file path.
+        str: The exported file path, or a Future of the hkx conversion when not waiting.
     """
     # path = path or saveFbxDialog('Export Rig Dialog')
-    path = path or os.path.join(getSceneCharacterAssetDirectory(), 'skeleton.fbx')
+    path = path or os.path.join(getWriteDirectory(getSceneCharacterAssetDirectory()), 'skeleton.fbx')
 
     # Find the root and bounding box
     root = getRootJoint()
@@ -924,7 +1302,8 @@ def exportRig(path=None):
             pmc.undo()
 
     # Convert to hkx
-    ckcmd.importrig(path, os.path.dirname(path))
+    future = convert(ckcmd.importrig, [path, os.path.dirname(path)], title='Converting Rig', wait=wait)
+    return path if wait else future
 
 
 def textureSkin(meshes=None, albedo=None, normal=None, name='skywind'):
@@ -970,7 +1349,7 @@ def textureSkin(meshes=None, albedo=None, normal=None, name='skywind'):
         pmc.sets(shadingGroup, e=True, forceElement=mesh)
 
 
-def exportSkin(meshes=None, path=None):
+def exportSkin(meshes=None, path=None, wait=True, prune=False):
     """
     Exports the given mesh nodes as a skyrim skin fbx.
     If no meshes are given the current selected meshes will be used. If no meshes are selected all meshes skinned
@@ -979,11 +1358,15 @@ def exportSkin(meshes=None, path=None):
     Args:
         meshes(list): A list of meshes to export. 
         path(str): The destination fbx path. 
+        wait(bool): Whether to block until the nif conversion finishes.
+        prune(bool): Whether to export with excess influences pruned, see skin.pruneSkin(). The scene's weights are
+            restored after exporting.
 
     Returns:
-        str: The exported file path.
+        str: The exported file path, or a Future of the nif conversion when not waiting.
     """
     path = path or saveFbxDialog('Save Skin Dialog', dir=getSceneCharacterAssetDirectory())
+    path = getWritePath(os.path.join(getWriteDirectory(os.path.dirname(path)), os.path.basename(path)))
 
     # Get the root skeleton
     root = getRootJoint()
@@ -1004,49 +1387,63 @@ def exportSkin(meshes=None, path=None):
     if len(meshes) > 1:
         raise NotImplementedError('Multiple meshes selected for export. Currently we only support one mesh per skin.')
 
-    # Check max influences
-    for mesh in meshes:
-        if not _checkMaxInfluences(mesh):
-            raise MaxInfluenceException('Failed to export "%s". Skinning contains more than 4 influences.' % mesh)
-
+    # Prune excess influences for the export only, restoring the scene's weights however the export ends
+    originalWeights = []
     try:
-        pmc.undoInfo(openChunk=True)
+        if prune:
+            for mesh in meshes:
+                originalWeights.append((mesh, skin.getWeights(mesh)[0]))
+                skin.pruneSkin(mesh)
 
-        # Set vertex colors to white
+        # Check max influences
         for mesh in meshes:
-            pmc.polyColorPerVertex(mesh, colorRGB=[1, 1, 1], a=1)
+            vertices, count = skin.checkMaxInfluences(mesh)
+            if len(vertices) > 0:
+                raise MaxInfluenceException('Failed to export "%s". %s vertices have more than 4 influences, up to '
+                                            '%s, starting with vtx[%s].' % (mesh, len(vertices), count, vertices[0]))
 
-        # To fix certain issues with skinning we need to mess with the normals
-        for mesh in meshes:
-            pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
-            pmc.polyNormalPerVertex(mesh, unFreezeNormal=True)  # Unlock the normals
-            pmc.polySoftEdge(mesh, a=180)  # Soften the normals
-            pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
-            pmc.polyNormalPerVertex(mesh, freezeNormal=True)  # Lock the normals
-            pmc.polySoftEdge(mesh, a=0)  # Harden the normals
-            pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
-
-        # Remove all joint constraints
-        constraints = root.listRelatives(ad=True, type='constraint')
-        if len(constraints) > 0:
-            pmc.delete(constraints)
-
-        # Disconnect message connections
-        for joint in rootSkeleton:
-            joint.message.disconnect()
-            if not joint.hasAttr(MATCH_ATTR_NAME):
-                continue
-            for input in joint.attr(MATCH_ATTR_NAME).inputs(plugs=True):
-                input.disconnect(joint.attr(MATCH_ATTR_NAME))
+        try:
+            pmc.undoInfo(openChunk=True)
+
+            # Set vertex colors to white
+            for mesh in meshes:
+                pmc.polyColorPerVertex(mesh, colorRGB=[1, 1, 1], a=1)
+
+            # To fix certain issues with skinning we need to mess with the normals
+            for mesh in meshes:
+                pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
+                pmc.polyNormalPerVertex(mesh, unFreezeNormal=True)  # Unlock the normals
+                pmc.polySoftEdge(mesh, a=180)  # Soften the normals
+                pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
+                pmc.polyNormalPerVertex(mesh, freezeNormal=True)  # Lock the normals
+                pmc.polySoftEdge(mesh, a=0)  # Harden the normals
+                pmc.bakePartialHistory(mesh, prePostDeformers=True)  # Delete Non-deformer history
+
+            # Remove all joint constraints
+            constraints = root.listRelatives(ad=True, type='constraint')
+            if len(constraints) > 0:
+                pmc.delete(constraints)
+
+            # Disconnect message connections
+            for joint in rootSkeleton:
+                joint.message.disconnect()
+                if not joint.hasAttr(MATCH_ATTR_NAME):
+                    continue
+                for input in joint.attr(MATCH_ATTR_NAME).inputs(plugs=True):
+                    input.disconnect(joint.attr(MATCH_ATTR_NAME))
 
-        exportFbx(rootSkeleton + [mesh.getParent() for mesh in meshes], path=path)
+            exportFbx(rootSkeleton + [mesh.getParent() for mesh in meshes], path=path)
 
+        finally:
+            pmc.undoInfo(closeChunk=True)
+            pmc.undo()
     finally:
-        pmc.undoInfo(closeChunk=True)
-        pmc.undo()
+        for mesh, weights in originalWeights:
+            skin.setWeights(mesh, weights)
 
     # Export nif
-    ckcmd.importskin(path, os.path.dirname(path))
+    future = convert(ckcmd.importskin, [path, os.path.dirname(path)], title='Converting Skin', wait=wait)
+    return path if wait else future
 
 
 def isExportJoint(joint):
@@ -1163,6 +1560,55 @@ def bindRootSkeleton():
             pmc.parentConstraint(match, joint, mo=True)
 
 
+def getRetargetJoint(influence, joints):
+    """
+    Finds the joint a skin influence is retargeted to through its retarget match connection.
+    Influences without a match use the match of their closest matched parent, or else the closest joint.
+
+    Args:
+        influence(PyNode): A skin influence joint.
+        joints(list): A list of joints to retarget to, such as getBindSkeleton().
+
+    Returns:
+        PyNode: The matching joint.
+    """
+    names = set(joint.longName() for joint in joints)
+    node = influence
+    while node is not None:
+        if node.longName() in names:
+            return node
+        if node.hasAttr(MATCH_ATTR_NAME):
+            for match in node.attr(MATCH_ATTR_NAME).inputs():
+                if match.longName() in names:
+                    return match
+        node = node.getParent()
+
+    position = influence.getTranslation(space='world')
+    return min(joints, key=lambda joint: (joint.getTranslation(space='world') - position).length())
+
+
+def transferSkin(source=None, meshes=None, neighbors=4):
+    """
+    Transfers the skinning of a source mesh to other meshes by vertex position, binding them to the root skeleton.
+    Source influences are mapped to the root skeleton through their retarget matches, see getRetargetJoint().
+    The source's point index is cached, so transferring to several meshes from one source is cheap.
+
+    Args:
+        source(PyNode): A skinned source mesh, defaults to the first selected mesh.
+        meshes(list): A list of destination meshes, defaults to the rest of the selection.
+        neighbors(int): The number of nearest source vertices to interpolate for each destination vertex.
+    """
+    selection = getMeshes(pmc.selected())
+    source = source or (selection[0] if len(selection) > 0 else None)
+    if source is None:
+        raise skin.SkinClusterException('No mesh selected to transfer skinning from.')
+    meshes = getMeshes(meshes) if meshes is not None else selection[1:]
+    bindSkeleton = getBindSkeleton()
+    for mesh in meshes:
+        skin.transferSkin(source, mesh, bindSkeleton, match=functools.partial(getRetargetJoint, joints=bindSkeleton),
+                          neighbors=neighbors)
+
+
 def retargetSkin(meshes=None):
     """
     Creates new meshes retargeted to the root skeleton.
@@ -1173,16 +1619,16 @@ def retargetSkin(meshes=None):
     meshes = meshes or pmc.selected()
     meshes = getMeshes(meshes)
 
+    bindSkeleton = getBindSkeleton()
     newMeshes = []
     for srcMesh in meshes:
         # Create a duplicate mesh
         dstParent = pmc.duplicate(srcMesh.getParent())
         pmc.parent(dstParent, world=True)
 
-        # Copy the skinning
-        srcCluster = pmc.ls(srcMesh.listHistory(), type='skinCluster')[0]
-        dstCluster = pmc.skinCluster(dstParent, getBindSkeleton(), mi=4, tsb=True)
-        pmc.copySkinWeights(ss=srcCluster, ds=dstCluster, noMirror=True)
+        # Transfer the skinning through the retarget matches
+        skin.transferSkin(srcMesh, getMeshes(dstParent)[0], bindSkeleton,
+                          match=functools.partial(getRetargetJoint, joints=bindSkeleton))
         newMeshes.append(dstParent)
 
     # If more than one mesh selected, combine meshes
@@ -1194,6 +1640,51 @@ def retargetSkin(meshes=None):
     bindRootSkeleton()
 
 
+def saveSkinWeights(mesh=None, path=None):
+    """
+    Saves the skin weights of a mesh to an npz file, see skin.saveWeights().
+
+    Args:
+        mesh(PyNode): A skinned mesh, defaults to the selected mesh.
+        path(str): An npz file path, defaults to prompting the user.
+
+    Returns:
+        str: The saved file path.
+    """
+    meshes = getMeshes([mesh] if mesh is not None else None)
+    if len(meshes) == 0:
+        raise skin.SkinClusterException('No mesh selected to save weights from.')
+    path = path or _weightsDialog('Save Weights Dialog', fileMode=0)
+    path = getWritePath(os.path.join(getWriteDirectory(os.path.dirname(path)), os.path.basename(path)))
+    return skin.saveWeights(meshes[0], path)
+
+
+def loadSkinWeights(mesh=None, path=None):
+    """
+    Loads skin weights saved with saveSkinWeights() onto a mesh, binding it to the root skeleton by joint name.
+
+    Args:
+        mesh(PyNode): A mesh with the saved vertex count, defaults to the selected mesh.
+        path(str): An npz file path, defaults to prompting the user.
+
+    Returns:
+        PyNode: The mesh's skinCluster.
+    """
+    meshes = getMeshes([mesh] if mesh is not None else None)
+    if len(meshes) == 0:
+        raise skin.SkinClusterException('No mesh selected to load weights onto.')
+    path = path or _weightsDialog('Load Weights Dialog', fileMode=1)
+    return skin.loadWeights(meshes[0], path, getBindSkeleton())
+
+
+def _weightsDialog(title, fileMode):
+    filepaths = pmc.fileDialog2(fileFilter='*.npz', dialogStyle=1, caption=title, dir=getSceneDirectory(),
+                                fileMode=fileMode) or []
+    if len(filepaths) == 0:
+        raise FilePathException('No file path selected.')
+    return filepaths[0]
+
+
 def copyTagAttribiutes(srcRoot, dstRoot):
     """
     Copies animation tag attributes from the source root to the destination root.
@@ -1415,12 +1906,19 @@ def batchRetargetAnimations(animations=None, skeleton=None):
         retargetAnimation(animation, skeleton, force=True)
 
 
-def exportAnimation(path=None):
+def exportAnimation(path=None, wait=True, timeout=None, cancel=None, copyCache=True):
     """
     Bakes and exports animation on a rig in the scene.
     
     Args:
         path(str): An destination fbx path to export. 
+        wait(bool): Whether to block until the hkx conversion finishes.
+        timeout(float): An optional number of seconds to wait for ck-cmd.
+        cancel(Cancellation): An optional ckcmd cancellation shared by a batch of exports.
+        copyCache(bool): Whether to copy the updated cache file once converted, see copyCacheFile().
+
+    Returns:
+        Future: A handle to the hkx conversion when not waiting, otherwise None.
     """
     if path is None:
         path = pmc.sceneName()
@@ -1460,24 +1958,42 @@ def exportAnimation(path=None):
 
         # Export animation and convert to hkx
         exportFbx([dupRoot] + getBindSkeleton(), path=path, animation=True)
-        ckcmd.importanimation(
-            getSceneSkeletonHkx(legacy=True), path,
-            getSceneAnimationDirectory(), cache_txt=getSceneCacheFile(),
-            behavior_directory=getSceneBehaviorDirectory()
+        future = convert(
+            ckcmd.importanimation, [getSceneSkeletonHkx(legacy=True), path,
+                                    getWriteDirectory(getSceneAnimationDirectory())],
+            {'cache_txt': getSceneCacheFile(), 'behavior_directory': getSceneBehaviorDirectory(),
+             'timeout': timeout, 'cancel': cancel},
+            title='Converting %s' % os.path.basename(path), wait=wait
         )
 
-        # TODO copy cache file to correct directory
+        # Copy the updated cache file from the animation directory
+        cacheFile, animationDir = getSceneCacheFile(), getSceneAnimationDirectory()
+        if copyCache and future is None:
+            copyCacheFile(getWritePath(animationDir), cacheFile)
+        elif copyCache:
+            future.add_done_callback(
+                lambda future: future.exception() is None and copyCacheFile(getWritePath(animationDir), cacheFile))
     finally:
         pmc.undoInfo(closeChunk=True)
         # pmc.undo()
+    return future
 
 
-def batchExportAnimations(animations=None):
+def batchExportAnimations(animations=None, wait=True, timeout=None, batchTimeout=None):
     """
     Batch exports each animation file to the destination folder.
+    Animations that fail to convert are reported once the batch has finished, including background conversions.
+    Each background conversion can be cancelled on its own with Future.cancel(). Conversions sharing a cache file run
+    one at a time and the updated cache file is copied once the last conversion has finished.
     
     Args:
         animations(list): A list of maya filenames.
+        wait(bool): Whether to wait for each hkx conversion before opening the next animation.
+        timeout(float): An optional number of seconds to wait for each conversion before moving on.
+        batchTimeout(float): An optional number of seconds after which the remaining animations are skipped.
+
+    Returns:
+        list: A list of Futures for each hkx conversion when not waiting.
     """
     animations = animations or loadScenesDialog('Select Animations', dir=getSceneAnimationDirectory())
 
@@ -1486,9 +2002,208 @@ def batchExportAnimations(animations=None):
     if result:
         pmc.saveFile()
 
+    futures = []
+    failures = {}
+    cacheFiles = set()
+    cancel = ckcmd.Cancellation(batchTimeout)
     for animation in animations:
+        if cancel.cancelled():
+            failures[animation] = cancel.exception()
+            continue
         pmc.openFile(animation, force=True)
-        exportAnimation(animation)
+        cacheFiles.add((getWritePath(getSceneAnimationDirectory()), getSceneCacheFile()))
+        try:
+            future = exportAnimation(animation, wait=wait, timeout=timeout,
+                                     cancel=ckcmd.Cancellation(parent=cancel), copyCache=False)
+            if future is not None:
+                futures.append((animation, future))
+        except ckcmd.CkCmdException as e:
+            failures[animation] = e
+
+    # Copy the updated cache files and summarize failed animations
+    def report():
+        if len(failures) < len(animations):
+            for animationDir, cacheFile in sorted(cacheFiles):
+                copyCacheFile(animationDir, cacheFile)
+        for animation, exception in sorted(failures.items()):
+            print 'Failed to export %s: %s' % (animation, exception)
+        if len(failures) > 0:
+            pmc.warning('Failed to export %s of %s animations, see the script editor for details.' % (
+                len(failures), len(animations)))
+
+    # Background conversions are summarized once the last one finishes
+    remaining = [len(futures)]
+
+    def onExported(animation, future):
+        if future.exception() is not None:
+            failures[animation] = future.exception()
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            report()
+
+    if len(futures) == 0:
+        report()
+    for animation, future in futures:
+        future.add_done_callback(functools.partial(onExported, animation))
+    return [future for animation, future in futures] if not wait else None
+
+
+def copyCacheFile(animationDir, cacheFile):
+    """
+    Copies the cache file ck-cmd writes next to imported animations over the animation data cache file.
+    In stacked data roots the cache file is written to the first root.
+
+    Args:
+        animationDir(str): The animation directory ck-cmd imported animations into.
+        cacheFile(str): The animation data cache file path.
+    """
+    if cacheFile is None:
+        return
+    path = os.path.join(animationDir, os.path.basename(cacheFile))
+    cacheFile = getWritePath(cacheFile)
+    if os.path.exists(path) and os.path.abspath(path) != os.path.abspath(cacheFile):
+        if not os.path.exists(os.path.dirname(cacheFile)):
+            os.makedirs(os.path.dirname(cacheFile))
+        shutil.copyfile(path, cacheFile)
+
+
+def exportActor(root=None, actor=None, dlc=None, workers=None, force=False, timeout=None):
+    """
+    Converts an actor's exported rig, skin and animation fbx files with a single job graph.
+    The rig is converted first, then skins and animations in parallel, then the cache file is copied. Conversions
+    whose outputs are newer than their inputs are skipped. Animations are converted together in a single ck-cmd call,
+    since ck-cmd rewrites the cache file next to the animations it imports.
+
+    Args:
+        root(str): A root data directory, defaults to the scene's.
+        actor(str): An actor name, defaults to the scene's.
+        dlc(int): An optional dlc number, defaults to the scene's.
+        workers(int): The number of conversions to run at once. None will use every available core.
+        force(bool): Whether to convert files that are already up-to-date.
+        timeout(float): An optional number of seconds to wait for each ck-cmd process.
+
+    Returns:
+        Pipeline: The finished pipeline, see Pipeline.report() for timings.
+    """
+    if root is None:
+        root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    characterAssetsDir = getWriteDirectory(getCharacterAssetDirectory(root, actor, dlc))
+    animationDir = getWriteDirectory(getAnimationDirectory(root, actor, dlc))
+    behaviorDir = getBehaviorDirectory(root, actor, dlc)
+    cacheFile = getCacheFile(root, actor)
+
+    def listFbxs(directory):
+        return sorted(os.path.join(directory, filename) for filename in os.listdir(directory)
+                      if filename.lower().endswith('.fbx'))
+
+    def replaceExtension(path, extension):
+        return os.path.splitext(path)[0] + extension
+
+    graph = pipeline.Pipeline('Export %s' % actor)
+
+    # Rig
+    rigNodes = []
+    skeletonFbx = os.path.join(characterAssetsDir, 'skeleton.fbx')
+    if os.path.exists(skeletonFbx):
+        graph.add('rig', functools.partial(ckcmd.importrig, skeletonFbx, characterAssetsDir, timeout=timeout),
+                  inputs=[skeletonFbx], outputs=[replaceExtension(skeletonFbx, '.hkx')])
+        rigNodes.append('rig')
+
+    # Skins
+    for path in listFbxs(characterAssetsDir):
+        if path == skeletonFbx:
+            continue
+        graph.add('skin %s' % os.path.basename(path),
+                  functools.partial(ckcmd.importskin, path, characterAssetsDir, timeout=timeout),
+                  inputs=[path], outputs=[replaceExtension(path, '.nif')], dependencies=rigNodes)
+
+    # Animations, the legacy skeleton is found once the rig has been converted
+    animations = listFbxs(animationDir)
+    legacySkeletonHkx = os.path.join(characterAssetsDir, 'skeleton_le.hkx')
+
+    def importAnimations():
+        stale = [path for path in animations
+                 if force or not pipeline.up_to_date([replaceExtension(path, '.hkx')], [path, legacySkeletonHkx])]
+        if len(stale) == 0:
+            return
+
+        # Link the stale animations into a directory so they convert in one ck-cmd call
+        stagingDir = ckcmd.get_staging_directory(animationDir, 'importanimation')
+        try:
+            ckcmd.stage_files(animationDir, [os.path.basename(path) for path in stale], stagingDir)
+            ckcmd.importanimation(getSkeletonHkx(root, actor, dlc, legacy=True), stagingDir, animationDir,
+                                  cache_txt=cacheFile, behavior_directory=behaviorDir, timeout=timeout)
+        finally:
+            ckcmd.remove_staging_directory(stagingDir)
+
+    if len(animations) > 0:
+        graph.add('animations', importAnimations, inputs=animations + [legacySkeletonHkx],
+                  outputs=[replaceExtension(path, '.hkx') for path in animations], dependencies=rigNodes)
+
+        # Cache file
+        if cacheFile is not None:
+            graph.add('cache %s' % os.path.basename(cacheFile),
+                      functools.partial(copyCacheFile, animationDir, cacheFile),
+                      inputs=[os.path.join(animationDir, os.path.basename(cacheFile))],
+                      outputs=[getWritePath(cacheFile)], dependencies=['animations'])
+
+    finished = []
+    with ProgressContext(count=len(graph.nodes), title=graph.name) as progress:
+        def onFinished(node):
+            finished.append(node)
+            progress.setStatus('%s %s (%s/%s)' % (node.name, node.status, len(finished), len(graph.nodes)))
+            progress.step()
+
+        failures = graph.run(workers=workers, force=force, callback=onFinished)
+
+    print graph.report()
+    if len(failures) > 0:
+        pmc.warning('Failed to convert %s of %s files for %s, see the script editor for details.' % (
+            len(failures), len(graph.nodes), actor))
+    return graph
+
+
+def watchActor(root=None, actor=None, dlc=None, interval=1.0, debounce=2.0, timeout=None):
+    """
+    Starts converting an actor's exported fbx files to hkx and nif in the background whenever they change.
+    Only one actor is watched at a time, watching another actor stops the previous watcher.
+
+    Args:
+        root(str): A root data directory, defaults to the scene's.
+        actor(str): An actor name, defaults to the scene's.
+        dlc(int): An optional dlc number, defaults to the scene's.
+        interval(float): Seconds between checks for changes.
+        debounce(float): Seconds a file must go unchanged before it is converted.
+        timeout(float): An optional number of seconds to wait for each ck-cmd process.
+
+    Returns:
+        Watcher: The running watcher.
+    """
+    global WATCHER
+    if root is None:
+        root, actor, dlc = getSceneDataDirectory(), getSceneActor(), getSceneDlc()
+    characterAssetsDir = getWriteDirectory(getCharacterAssetDirectory(root, actor, dlc))
+    skeletonHkx = getSkeletonHkx(root, actor, dlc, legacy=True) or os.path.join(characterAssetsDir, 'skeleton_le.hkx')
+
+    cacheFile = getCacheFile(root, actor)
+
+    stopWatchingActor()
+    WATCHER = watcher.watch_actor(
+        getWriteDirectory(getAnimationDirectory(root, actor, dlc)), characterAssetsDir, skeletonHkx,
+        cache_txt=cacheFile, behavior_directory=getBehaviorDirectory(root, actor, dlc),
+        interval=interval, debounce=debounce, timeout=timeout,
+        cache_output=getWritePath(cacheFile) if cacheFile is not None else ''
+    )
+    pmc.displayInfo('Watching %s for exported fbx files.' % actor)
+    return WATCHER
+
+
+def stopWatchingActor():
+    """ Stops the actor watcher started by watchActor(), converting any pending files first. """
+    global WATCHER
+    if WATCHER is not None:
+        WATCHER.stop()
+        WATCHER = None
 
 
 class FilePathException(BaseException):
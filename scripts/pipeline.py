@@ -0,0 +1,329 @@
+"""
+A dependency-aware scheduler for running ck-cmd conversions as a job graph.
+
+Nodes run as soon as every node they depend on has finished, up to a number of workers at once. Nodes whose outputs
+are newer than all of their inputs are skipped as up-to-date. A Journal records completed steps of a batch so an
+interrupted batch can be resumed.
+"""
+
+
+import os
+import json
+import time
+import threading
+import collections
+import multiprocessing
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from skymaya import ckcmd
+
+
+def newest_mtime(path):
+    """
+    Gets the newest modification time of a file or any file in a directory.
+
+    Args:
+        path(str): A file or directory path.
+
+    Returns:
+        float: A modification time, or None if the path does not exist.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    mtimes = [os.path.getmtime(path)]
+    for root, dirs, filenames in os.walk(path):
+        mtimes.extend(os.path.getmtime(os.path.join(root, filename)) for filename in filenames)
+    return max(mtimes)
+
+
+def up_to_date(outputs, inputs):
+    """
+    Checks whether outputs are newer than the inputs they were converted from.
+
+    Args:
+        outputs(list): A list of output file or directory paths.
+        inputs(list): A list of input file or directory paths, missing inputs are ignored.
+
+    Returns:
+        bool: True if every output exists and is newer than every input.
+    """
+    if len(outputs) == 0:
+        return False
+    outputs = [newest_mtime(path) for path in outputs]
+    if None in outputs:
+        return False
+    inputs = [mtime for mtime in [newest_mtime(path) for path in inputs] if mtime is not None]
+    return len(inputs) == 0 or min(outputs) >= max(inputs)
+
+
+class Node(object):
+    """ A step of a pipeline that runs once its dependencies have finished. """
+
+    def __init__(self, name, function, inputs=(), outputs=(), dependencies=()):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.dependencies = list(dependencies)
+        self.status = 'pending'
+        self.start = None
+        self.end = None
+        self.exception = None
+
+    @property
+    def duration(self):
+        """ The number of seconds the node ran for, zero if it did not run. """
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def up_to_date(self):
+        """ Returns True if every output exists and is newer than every input. """
+        return up_to_date(self.outputs, self.inputs)
+
+
+class Pipeline(object):
+    """ A graph of nodes run concurrently in dependency order. """
+
+    def __init__(self, name='Pipeline'):
+        self.name = name
+        self.nodes = collections.OrderedDict()
+        self.start = None
+        self.end = None
+
+    def add(self, name, function, inputs=(), outputs=(), dependencies=()):
+        """
+        Adds a node to the pipeline.
+
+        Args:
+            name(str): A unique node name.
+            function(function): A function taking no arguments.
+            inputs(list): A list of file or directory paths the node reads.
+            outputs(list): A list of file or directory paths the node writes.
+            dependencies(list): A list of node names that must finish first.
+
+        Returns:
+            Node: The added node.
+        """
+        if name in self.nodes:
+            raise PipelineException('Duplicate pipeline node "%s".' % name)
+        for dependency in dependencies:
+            if dependency not in self.nodes:
+                raise PipelineException('Node "%s" depends on unknown node "%s".' % (name, dependency))
+        node = Node(name, function, inputs=inputs, outputs=outputs, dependencies=dependencies)
+        self.nodes[name] = node
+        return node
+
+    def run(self, workers=None, force=False, callback=None):
+        """
+        Runs every node, starting each as soon as its dependencies are done.
+        Nodes with a failed dependency are blocked rather than run.
+
+        Args:
+            workers(int): The maximum number of nodes to run at once, defaults to the cpu count.
+            force(bool): Whether to run nodes even if they are up-to-date.
+            callback(function): An optional function called on the calling thread with each node once it finishes.
+
+        Returns:
+            list: A list of failed nodes.
+        """
+        workers = max(1, workers or multiprocessing.cpu_count())
+        finished = queue.Queue()
+        remaining = list(self.nodes.values())
+        running = [0]
+        self.start = time.time()
+
+        def work(node):
+            node.start = time.time()
+            try:
+                node.function()
+                node.status = 'done'
+            except BaseException as e:
+                node.exception = e
+                node.status = 'failed'
+            node.end = time.time()
+            finished.put(node)
+
+        def finish(node):
+            if callback is not None:
+                callback(node)
+
+        while remaining or running[0] > 0:
+            # Start every ready node until the workers are busy
+            for node in list(remaining):
+                statuses = [self.nodes[dependency].status for dependency in node.dependencies]
+                if any(status in ('failed', 'blocked') for status in statuses):
+                    node.status = 'blocked'
+                    remaining.remove(node)
+                    finish(node)
+                elif all(status in ('done', 'skipped') for status in statuses):
+                    if not force and node.up_to_date():
+                        node.status = 'skipped'
+                        remaining.remove(node)
+                        finish(node)
+                    elif running[0] < workers:
+                        node.status = 'running'
+                        remaining.remove(node)
+                        running[0] += 1
+                        thread = threading.Thread(target=work, args=(node,))
+                        thread.daemon = True
+                        thread.start()
+
+            # Nodes are added after their dependencies, so an idle pass always settles every remaining node
+            if running[0] > 0:
+                finish(finished.get())
+                running[0] -= 1
+
+        self.end = time.time()
+        return [node for node in self.nodes.values() if node.status == 'failed']
+
+    def critical_path(self):
+        """
+        Finds the chain of dependent nodes that took the longest to run.
+
+        Returns:
+            list: A list of nodes from the first to run to the last.
+        """
+        paths = {}
+        for node in self.nodes.values():
+            longest = []
+            for dependency in node.dependencies:
+                path = paths[dependency]
+                if sum(n.duration for n in path) > sum(n.duration for n in longest):
+                    longest = path
+            paths[node.name] = longest + [node]
+        return max(paths.values(), key=lambda path: sum(node.duration for node in path)) if paths else []
+
+    def report(self):
+        """
+        Summarizes each node's status and duration along with the critical path.
+
+        Returns:
+            str: A printable report.
+        """
+        lines = ['%s finished in %.2fs' % (self.name, (self.end or time.time()) - (self.start or time.time()))]
+        for node in self.nodes.values():
+            lines.append('    %-8s %8.2fs  %s' % (node.status, node.duration, node.name))
+            if node.exception is not None:
+                lines.append('             %s' % str(node.exception).strip().replace('\n', '\n             '))
+
+        path = self.critical_path()
+        lines.append('Critical path %.2fs, %.2fs of work in total' % (
+            sum(node.duration for node in path), sum(node.duration for node in self.nodes.values())))
+        for node in path:
+            lines.append('    %8.2fs  %s' % (node.duration, node.name))
+        return '\n'.join(lines)
+
+
+class Journal(object):
+    """
+    An append-only record of completed conversion steps kept in a data directory.
+    Each step is keyed on (dlc, actor, stage) and records a fingerprint of the files it wrote, so a step is only
+    considered complete while its outputs are unchanged.
+    """
+
+    FILENAME = 'skymaya_journal.jsonl'
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, self.FILENAME)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """ Reads the journal, keeping the latest entry for each step. """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A partially written line from an interrupted batch
+                self.entries[(entry['dlc'], entry['actor'], entry['stage'])] = entry
+
+    def clear(self):
+        """ Forgets every step, so the next batch starts over. """
+        with self.lock:
+            self.entries = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def completed(self, dlc, actor, stage):
+        """ Returns True if the step finished and none of its outputs have changed since. """
+        entry = self.entries.get((dlc, actor, stage))
+        if entry is None or entry['status'] != 'done':
+            return False
+        for path, fingerprint in entry['outputs'].items():
+            if not os.path.exists(path):
+                return False
+            stat = os.stat(path)
+            if [stat.st_size, stat.st_mtime] != fingerprint:
+                return False
+        return True
+
+    def record(self, dlc, actor, stage, status, outputs=None, error=None):
+        """
+        Appends a step to the journal.
+
+        Args:
+            dlc(int): The actor's dlc number or None.
+            actor(str): The actor name.
+            stage(str): The step name.
+            status(str): Either done or failed.
+            outputs(dict): A dictionary of [size, mtime] fingerprints keyed by output file path.
+            error(str): An optional failure message.
+        """
+        entry = {
+            'time': time.time(),
+            'dlc': dlc,
+            'actor': actor,
+            'stage': stage,
+            'status': status,
+            'outputs': outputs or {},
+            'error': error,
+        }
+        with self.lock:
+            self.entries[(dlc, actor, stage)] = entry
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run(self, dlc, actor, stage, directory, function):
+        """
+        Runs a step unless it has already completed, recording the files it writes to a directory.
+
+        Args:
+            dlc(int): The actor's dlc number or None.
+            actor(str): The actor name.
+            stage(str): The step name.
+            directory(str): The output directory of the step.
+            function(function): A function taking no arguments that runs the step.
+
+        Returns:
+            bool: True if the step ran, False if it was skipped.
+        """
+        if self.completed(dlc, actor, stage):
+            return False
+        before = ckcmd.snapshot(directory)
+        try:
+            function()
+        except BaseException as e:
+            self.record(dlc, actor, stage, 'failed', error=str(e))
+            raise
+        outputs = dict((os.path.join(directory, relpath), list(stat))
+                       for relpath, stat in ckcmd.snapshot(directory).items() if before.get(relpath) != stat)
+        self.record(dlc, actor, stage, 'done', outputs=outputs)
+        return True
+
+
+class PipelineException(BaseException):
+    """ Raised for invalid pipelines. """
@@ -0,0 +1,513 @@
+"""
+Bulk skin weight functions for Maya.
+
+Weights are read from and written to a skinCluster in a single API call as a vertex by influence matrix, so checking
+or editing a dense mesh does not query each vertex separately. Matrices are numpy arrays when numpy is installed and
+lists of rows otherwise. Pruning and the other matrix operations require numpy.
+
+Weights are transferred between meshes by interpolating the weights of each target vertex's nearest source vertices,
+found with a scipy cKDTree when scipy is installed and a brute force numpy search otherwise.
+"""
+
+
+import os
+
+import pymel.core as pmc
+
+from pywind_old import maya as om2
+from maya.api import OpenMayaAnim as oma2
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+MIN_WEIGHT = 0.000001
+POINT_INDEXES = {}
+
+
+def getSkinCluster(mesh):
+    """
+    Gets the skinCluster deforming a mesh.
+
+    Args:
+        mesh(PyNode): A mesh node.
+
+    Returns:
+        PyNode: The skinCluster node, or None if the mesh is not skinned.
+    """
+    clusters = pmc.ls(pmc.listHistory(mesh), type='skinCluster') or []
+    return clusters[0] if len(clusters) > 0 else None
+
+
+def _getDagPath(node):
+    selection = om2.MSelectionList()
+    selection.add(pmc.PyNode(node).longName())
+    return selection.getDagPath(0)
+
+
+def _getSkinFunctions(mesh, cluster=None):
+    """
+    Gets the API objects needed to read and write every weight of a skinned mesh.
+
+    Returns:
+        tuple: An MFnSkinCluster, the mesh MDagPath, a component of every vertex and the vertex count.
+    """
+    mesh = pmc.PyNode(mesh)
+    cluster = cluster or getSkinCluster(mesh)
+    if cluster is None:
+        raise SkinClusterException('"%s" has no skinCluster.' % mesh)
+
+    selection = om2.MSelectionList()
+    selection.add(pmc.PyNode(cluster).name())
+    dagPath = _getDagPath(mesh)
+    skinFn = oma2.MFnSkinCluster(selection.getDependNode(0))
+
+    vertexCount = om2.MFnMesh(dagPath).numVertices
+    componentFn = om2.MFnSingleIndexedComponent()
+    component = componentFn.create(om2.MFn.kMeshVertComponent)
+    componentFn.setCompleteData(vertexCount)
+    return skinFn, dagPath, component, vertexCount
+
+
+def _getInfluences(skinFn):
+    return [pmc.PyNode(path.fullPathName()) for path in skinFn.influenceObjects()]
+
+
+def getWeights(mesh, cluster=None):
+    """
+    Gets every skin weight of a mesh in one call.
+
+    Args:
+        mesh(PyNode): A skinned mesh node.
+        cluster(PyNode): The mesh's skinCluster, defaults to the first skinCluster in its history.
+
+    Returns:
+        tuple: A vertex by influence weight matrix and a list of influence joints in matrix column order.
+    """
+    skinFn, dagPath, component, vertexCount = _getSkinFunctions(mesh, cluster)
+    weights, influenceCount = skinFn.getWeights(dagPath, component)
+    influences = _getInfluences(skinFn)
+    if np is not None:
+        return np.array(weights, dtype=np.float64).reshape(vertexCount, influenceCount), influences
+    weights = list(weights)
+    return [weights[i:i + influenceCount] for i in range(0, len(weights), influenceCount)], influences
+
+
+def setWeights(mesh, weights, cluster=None):
+    """
+    Sets every skin weight of a mesh in one call. Weights are set as given, without normalizing.
+
+    Args:
+        mesh(PyNode): A skinned mesh node.
+        weights(array): A vertex by influence weight matrix in the column order of getWeights().
+        cluster(PyNode): The mesh's skinCluster, defaults to the first skinCluster in its history.
+    """
+    skinFn, dagPath, component, vertexCount = _getSkinFunctions(mesh, cluster)
+    influenceCount = len(skinFn.influenceObjects())
+    if np is not None:
+        values = np.asarray(weights, dtype=np.float64)
+        shape = values.shape
+        values = values.ravel().tolist()
+    else:
+        shape = (len(weights), len(weights[0]) if len(weights) > 0 else influenceCount)
+        values = [weight for row in weights for weight in row]
+    if tuple(shape) != (vertexCount, influenceCount):
+        raise WeightsException('Expected %s by %s weights for "%s", got %s by %s.' % (
+            vertexCount, influenceCount, mesh, shape[0], shape[1]))
+    skinFn.setWeights(dagPath, component, om2.MIntArray(range(influenceCount)), om2.MDoubleArray(values), False)
+
+
+def getInfluenceCounts(weights, minWeight=MIN_WEIGHT):
+    """
+    Counts the influences of each vertex.
+
+    Args:
+        weights(array): A vertex by influence weight matrix.
+        minWeight(float): Weights at or below this value are not counted.
+
+    Returns:
+        list: The number of influences of each vertex.
+    """
+    if np is not None:
+        return np.count_nonzero(np.asarray(weights) > minWeight, axis=1)
+    return [len([weight for weight in row if weight > minWeight]) for row in weights]
+
+
+def checkMaxInfluences(mesh, maxInfluences=4, minWeight=MIN_WEIGHT):
+    """
+    Finds the vertices of a skinned mesh with more influences than a given maximum.
+
+    Args:
+        mesh(PyNode): A skinned mesh node.
+        maxInfluences(int): The maximum influences per vertex.
+        minWeight(float): Weights at or below this value are not counted.
+
+    Returns:
+        tuple: A list of offending vertex indices and the highest influence count of any vertex.
+    """
+    counts = getInfluenceCounts(getWeights(mesh)[0], minWeight=minWeight)
+    if len(counts) == 0:
+        return [], 0
+    if np is not None:
+        return np.flatnonzero(counts > maxInfluences).tolist(), int(counts.max())
+    return [index for index, count in enumerate(counts) if count > maxInfluences], max(counts)
+
+
+def _shortName(node):
+    """ Returns a node name without its path or namespace, so weights match joints across files. """
+    return str(node).split('|')[-1].split(':')[-1]
+
+
+def _bind(mesh, joints, influences):
+    """ Gets a mesh's skinCluster, binding the mesh to joints if it is not skinned and adding missing influences. """
+    cluster = getSkinCluster(mesh)
+    if cluster is None:
+        cluster = pmc.skinCluster(mesh, joints, mi=4, tsb=True)
+    names = set(_shortName(influence) for influence in pmc.skinCluster(cluster, q=True, influence=True))
+    for influence in influences:
+        if _shortName(influence) not in names:
+            pmc.skinCluster(cluster, e=True, addInfluence=influence, weight=0.0)
+            names.add(_shortName(influence))
+    return cluster
+
+
+def saveWeights(mesh, path):
+    """
+    Saves the skin weights of a mesh to a compressed npz file.
+    Only non-zero weights are stored, along with the influence names and the vertex count.
+
+    Args:
+        mesh(PyNode): A skinned mesh node.
+        path(str): An npz file path.
+
+    Returns:
+        str: The saved file path.
+    """
+    _requireNumpy()
+    weights, influences = getWeights(mesh)
+    vertices, columns = np.nonzero(weights > MIN_WEIGHT)
+    if not path.lower().endswith('.npz'):
+        path += '.npz'
+    np.savez_compressed(path, version=np.int32(1), vertexCount=np.int32(len(weights)),
+                        influences=np.array([_shortName(influence) for influence in influences]),
+                        vertices=vertices.astype(np.int32), columns=columns.astype(np.uint16),
+                        weights=weights[vertices, columns].astype(np.float32))
+    return path
+
+
+def loadWeights(mesh, path, joints):
+    """
+    Loads skin weights saved with saveWeights() onto a mesh with the same vertex count, matching influences to
+    joints by name. The mesh is bound to the joints if it is not skinned, and matching joints are added to an
+    existing skinCluster as needed.
+
+    Args:
+        mesh(PyNode): A mesh node.
+        path(str): An npz file path.
+        joints(list): A list of joints to match influences to, such as main.getBindSkeleton().
+
+    Returns:
+        PyNode: The mesh's skinCluster.
+    """
+    _requireNumpy()
+    mesh = pmc.PyNode(mesh)
+    if not os.path.exists(path):
+        raise WeightsException('Weights file "%s" does not exist.' % path)
+    with np.load(path) as data:
+        vertexCount = int(data['vertexCount'])
+        names = [str(name) for name in data['influences']]
+        vertices, columns, values = data['vertices'], data['columns'], data['weights']
+    if vertexCount != mesh.numVertices():
+        raise WeightsException('"%s" has %s vertices but "%s" has weights for %s.' % (
+            mesh, mesh.numVertices(), path, vertexCount))
+
+    # Match saved influences to joints by name
+    jointsByName = dict((_shortName(joint), joint) for joint in joints)
+    used = sorted(set(int(column) for column in np.unique(columns)))
+    missing = [names[column] for column in used if names[column] not in jointsByName]
+    if len(missing) > 0:
+        raise WeightsException('Could not find joints for the weighted influences %s.' % ', '.join(missing))
+
+    cluster = _bind(mesh, joints, [jointsByName[names[column]] for column in used])
+
+    # Scatter the saved weights into the skinCluster's influence order and renormalize the rounded weights
+    influences = _getInfluences(_getSkinFunctions(mesh, cluster)[0])
+    order = dict((_shortName(influence), index) for index, influence in enumerate(influences))
+    remap = np.array([order.get(name, -1) for name in names], dtype=np.int64)
+    weights = np.zeros((vertexCount, len(influences)), dtype=np.float64)
+    weights[vertices, remap[columns]] = values
+    totals = weights.sum(axis=1)
+    weights[totals > 0.0] /= totals[totals > 0.0, np.newaxis]
+    setWeights(mesh, weights, cluster)
+    return cluster
+
+
+def getPoints(mesh):
+    """ Gets the world space vertex positions of a mesh as a vertex by xyz matrix, in one query. """
+    _requireNumpy()
+    points = pmc.xform('%s.vtx[*]' % pmc.PyNode(mesh).longName(), q=True, ws=True, t=True) or []
+    return np.array(points, dtype=np.float64).reshape(-1, 3)
+
+
+class PointIndex(object):
+    """ A nearest neighbor index over a set of points. """
+
+    def __init__(self, points):
+        _requireNumpy()
+        self.points = np.asarray(points, dtype=np.float64)
+        self.tree = cKDTree(self.points) if cKDTree is not None and len(self.points) > 0 else None
+
+    def query(self, points, neighbors=1):
+        """
+        Finds the nearest indexed points to each given point.
+
+        Args:
+            points(array): A point by xyz matrix.
+            neighbors(int): The number of nearest points to find for each point.
+
+        Returns:
+            tuple: Point by neighbor matrices of distances and indices, nearest first.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        neighbors = min(neighbors, len(self.points))
+        if self.tree is not None:
+            distances, indices = self.tree.query(points, k=neighbors)
+            return distances.reshape(len(points), neighbors), indices.reshape(len(points), neighbors)
+
+        # Compare against every point, a chunk of query points at a time to bound memory
+        distances = np.empty((len(points), neighbors), dtype=np.float64)
+        indices = np.empty((len(points), neighbors), dtype=np.intp)
+        squaredNorms = (self.points ** 2).sum(axis=1)
+        chunk = max(1, 2 ** 22 // max(1, len(self.points)))
+        for start in range(0, len(points), chunk):
+            block = points[start:start + chunk]
+            squared = (block ** 2).sum(axis=1)[:, np.newaxis] - 2.0 * block.dot(self.points.T) + squaredNorms
+            nearest = np.argpartition(squared, neighbors - 1, axis=1)[:, :neighbors]
+            rows = np.arange(len(block))[:, np.newaxis]
+            order = np.argsort(squared[rows, nearest], axis=1)
+            indices[start:start + chunk] = nearest[rows, order]
+            distances[start:start + chunk] = np.sqrt(np.clip(squared[rows, nearest[rows, order]], 0.0, None))
+        return distances, indices
+
+
+class _CachedPointIndex(object):
+    """ Holds a mesh's point index until the mesh is dirtied or moved, tracked with Maya callbacks. """
+
+    def __init__(self, mesh):
+        transformPath = _getDagPath(mesh)
+        shapePath = om2.MDagPath(transformPath).extendToShape()
+        self.index = None
+        self.callbacks = [om2.MNodeMessage.addNodeDirtyCallback(shapePath.node(), self.invalidate),
+                          om2.MDagMessage.addWorldMatrixModifiedCallback(shapePath, self.invalidate)]
+
+    def invalidate(self, *args):
+        self.index = None
+
+    def remove(self):
+        om2.MMessage.removeCallbacks(self.callbacks)
+
+
+def getPointIndex(mesh):
+    """
+    Gets a nearest neighbor index over a mesh's world space vertex positions.
+    Indexes are cached per mesh and rebuilt only after the mesh is edited, deformed or moved.
+
+    Args:
+        mesh(PyNode): A mesh node.
+
+    Returns:
+        PointIndex: The mesh's point index.
+    """
+    name = pmc.PyNode(mesh).longName()
+    cached = POINT_INDEXES.get(name)
+    if cached is None:
+        cached = POINT_INDEXES[name] = _CachedPointIndex(mesh)
+    if cached.index is None:
+        cached.index = PointIndex(getPoints(mesh))
+    return cached.index
+
+
+def clearPointIndexes():
+    """ Forgets every cached point index and removes their callbacks. """
+    for cached in POINT_INDEXES.values():
+        cached.remove()
+    POINT_INDEXES.clear()
+
+
+def interpolateWeights(weights, index, points, neighbors=4):
+    """
+    Interpolates weights at new points from the weights of their nearest indexed points, by inverse distance.
+    Points matching an indexed point take its weights exactly.
+
+    Args:
+        weights(array): An indexed point by influence weight matrix.
+        index(PointIndex): An index of the points the weights belong to.
+        points(array): A point by xyz matrix to interpolate weights at.
+        neighbors(int): The number of nearest points to interpolate, 1 copies the closest point's weights.
+
+    Returns:
+        array: A point by influence weight matrix.
+    """
+    _requireNumpy()
+    weights = np.asarray(weights, dtype=np.float64)
+    distances, indices = index.query(points, neighbors)
+    factors = 1.0 / np.maximum(distances, 1e-12)
+    exact = distances[:, 0] < 1e-6
+    factors[exact] = 0.0
+    factors[exact, 0] = 1.0
+    factors /= factors.sum(axis=1)[:, np.newaxis]
+
+    # Accumulate one neighbor at a time rather than gathering every neighbor's weights at once
+    interpolated = np.zeros((len(indices), weights.shape[1]), dtype=np.float64)
+    for neighbor in range(indices.shape[1]):
+        interpolated += factors[:, neighbor, np.newaxis] * weights[indices[:, neighbor]]
+    return interpolated
+
+
+def transferSkin(source, destination, joints, match=None, neighbors=4, maxInfluences=4):
+    """
+    Transfers the skin weights of a source mesh to a destination mesh by vertex position, see interpolateWeights().
+    The destination is bound to the joints if it is not skinned.
+
+    Args:
+        source(PyNode): A skinned source mesh node.
+        destination(PyNode): A destination mesh node.
+        joints(list): A list of joints to bind the destination to.
+        match(function): An optional function returning the destination joint of a source influence, defaults to
+            the influence itself.
+        neighbors(int): The number of nearest source vertices to interpolate for each destination vertex.
+        maxInfluences(int): The influences per vertex to prune the transferred weights to, None to keep every weight.
+
+    Returns:
+        PyNode: The destination skinCluster.
+    """
+    _requireNumpy()
+    weights, influences = getWeights(source)
+    transferred = interpolateWeights(weights, getPointIndex(source), getPoints(destination), neighbors=neighbors)
+
+    # Map each source influence onto a destination joint, summing the weights of influences sharing a joint
+    targets = [match(influence) if match is not None else influence for influence in influences]
+    weighted = transferred.max(axis=0) > MIN_WEIGHT if len(transferred) > 0 else np.zeros(len(targets), dtype=bool)
+    missing = [str(influence) for influence, target, used in zip(influences, targets, weighted)
+               if target is None and used]
+    if len(missing) > 0:
+        raise WeightsException('Could not find joints for the weighted influences %s.' % ', '.join(missing))
+
+    cluster = _bind(destination, joints, [target for target in targets if target is not None])
+    order = dict((_shortName(influence), index)
+                 for index, influence in enumerate(_getInfluences(_getSkinFunctions(destination, cluster)[0])))
+    mapping = np.zeros((len(influences), len(order)), dtype=np.float64)
+    for column, target in enumerate(targets):
+        if target is not None:
+            mapping[column, order[_shortName(target)]] = 1.0
+    transferred = transferred.dot(mapping)
+
+    if maxInfluences is not None:
+        transferred = pruneWeights(transferred, maxInfluences=maxInfluences)
+    setWeights(destination, transferred, cluster)
+    return cluster
+
+
+def _requireNumpy():
+    if np is None:
+        raise NumpyException('numpy is required, install it to Maya\'s python to use this function.')
+
+
+def pruneWeights(weights, maxInfluences=4, minWeight=0.001, locked=None):
+    """
+    Removes small and excess influences from a weight matrix and renormalizes each vertex.
+    Each vertex keeps at least its largest influence. Locked influences are never changed, so the remaining weights
+    are scaled to fill whatever the locked weights leave. Vertices left with only locked weights are normalized
+    across their locked influences instead.
+
+    Args:
+        weights(array): A vertex by influence weight matrix.
+        maxInfluences(int): The number of largest influences each vertex keeps, locked influences are kept first.
+        minWeight(float): Weights below this value are removed.
+        locked(list): An optional list of whether each influence is locked.
+
+    Returns:
+        array: A new weight matrix.
+    """
+    _requireNumpy()
+    weights = np.array(weights, dtype=np.float64)
+    if weights.size == 0:
+        return weights
+    locked = np.zeros(weights.shape[1], dtype=bool) if locked is None else np.asarray(locked, dtype=bool)
+    unlocked = ~locked
+    rows = np.arange(len(weights))[:, np.newaxis]
+
+    # Remove small weights, keeping each vertex's largest
+    small = (weights < minWeight) & unlocked
+    small[rows[:, 0], weights.argmax(axis=1)] = False
+    weights[small] = 0.0
+
+    # Keep the largest influences, ranking locked influences first since their weights cannot change
+    if weights.shape[1] > maxInfluences:
+        rank = weights + 2.0 * (locked & (weights > 0.0))
+        keep = np.zeros(weights.shape, dtype=bool)
+        keep[rows, np.argsort(-rank, axis=1, kind='mergesort')[:, :maxInfluences]] = True
+        weights[~keep & unlocked] = 0.0
+
+    # Scale unlocked weights to fill what the locked weights leave
+    lockedSum = weights[:, locked].sum(axis=1)
+    unlockedSum = weights[:, unlocked].sum(axis=1)
+    target = np.clip(1.0 - lockedSum, 0.0, None)
+    scale = np.ones_like(unlockedSum)
+    np.divide(target, unlockedSum, out=scale, where=unlockedSum > 0.0)
+    weights[:, unlocked] *= scale[:, np.newaxis]
+
+    # Vertices without unlocked weights left can only be normalized across their locked weights
+    lockedOnly = (unlockedSum <= 0.0) & (lockedSum > 0.0)
+    weights[lockedOnly] /= lockedSum[lockedOnly, np.newaxis]
+    return weights
+
+
+def pruneSkin(mesh, maxInfluences=4, minWeight=0.001, respectLocked=True, dryRun=False):
+    """
+    Prunes and renormalizes every weight of a skinned mesh, see pruneWeights(), and prints a summary.
+
+    Args:
+        mesh(PyNode): A skinned mesh node.
+        maxInfluences(int): The number of largest influences each vertex keeps.
+        minWeight(float): Weights below this value are removed.
+        respectLocked(bool): Whether to leave the weights of joints with locked influence weights unchanged.
+        dryRun(bool): Whether to only report the changes without setting any weights.
+
+    Returns:
+        tuple: A list of changed vertex indices and the number of removed weights.
+    """
+    weights, influences = getWeights(mesh)
+    locked = None
+    if respectLocked:
+        locked = [influence.hasAttr('lockInfluenceWeights') and influence.lockInfluenceWeights.get()
+                  for influence in influences]
+    pruned = pruneWeights(weights, maxInfluences=maxInfluences, minWeight=minWeight, locked=locked)
+    if pruned.size == 0:
+        return [], 0
+
+    changed = np.flatnonzero(np.abs(pruned - weights).max(axis=1) > MIN_WEIGHT).tolist()
+    removed = int(np.count_nonzero((weights > MIN_WEIGHT) & (pruned <= MIN_WEIGHT)))
+    print '%s %s weights from %s vertices of %s, leaving at most %s influences per vertex.' % (
+        'Would remove' if dryRun else 'Removed', removed, len(changed), mesh, getInfluenceCounts(pruned).max())
+    if not dryRun and len(changed) > 0:
+        setWeights(mesh, pruned)
+    return changed, removed
+
+
+class SkinClusterException(BaseException):
+    """ Raised when a mesh has no skinCluster. """
+
+
+class WeightsException(BaseException):
+    """ Raised when a weight matrix does not match a skinCluster. """
+
+
+class NumpyException(BaseException):
+    """ Raised when a function requiring numpy is used without it. """
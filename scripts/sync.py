@@ -0,0 +1,408 @@
+"""
+Incremental directory syncing for extracting actors.
+
+Files whose size and mtime already match the destination are skipped and the rest are copied on a thread pool.
+Files can also be hard linked, which shares their data with the source, or reflinked, a copy-on-write clone
+supported on Linux by file systems such as btrfs and xfs. Links fall back to copies where they are unsupported.
+
+A Store deduplicates workspaces by content, keeping one copy of each distinct file that workspaces hard link to.
+Run `python -m skymaya.sync gc <store>` to remove files no workspace links to anymore. It waits for extractions
+linking from the store to finish, so a file that was just stored is never removed before it is linked.
+"""
+
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+import functools
+import threading
+import contextlib
+
+from skymaya import ckcmd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+COPY = 'copy'
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+
+# The Linux ioctl that clones a file's extents
+FICLONE = 0x40049409
+
+
+def file_hash(path):
+    """ Returns the sha1 of a file's contents. """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(functools.partial(f.read, 1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def same_file(src, dst, checksum=False):
+    """
+    Checks whether a destination file is already up-to-date with a source file.
+
+    Args:
+        src(str): A source file path.
+        dst(str): A destination file path.
+        checksum(bool): Whether to compare the contents of files with the same size but a different mtime.
+
+    Returns:
+        bool: True if the destination does not need to be copied.
+    """
+    try:
+        src_stat, dst_stat = os.stat(src), os.stat(dst)
+    except OSError:
+        return False
+    if _same_inode(src_stat, dst_stat):
+        return True  # A hard link to the source
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if abs(src_stat.st_mtime - dst_stat.st_mtime) < 1:
+        return True
+    return checksum and file_hash(src) == file_hash(dst)
+
+
+def _same_inode(a, b):
+    """ Compares two stat results by inode, which Python 2 does not report on Windows. """
+    return bool(a.st_ino) and (a.st_ino, a.st_dev) == (b.st_ino, b.st_dev)
+
+
+def linked(a, b):
+    """ Returns True if two paths are hard links to the same file. """
+    return _same_inode(os.stat(a), os.stat(b))
+
+
+def can_link(src_directory, dst_directory):
+    """
+    Checks whether files can be hard linked from one directory to another and their links counted.
+    Python 2 on Windows can do neither, and links cannot cross file systems.
+
+    Args:
+        src_directory(str): An existing directory to link from.
+        dst_directory(str): An existing directory to link to.
+
+    Returns:
+        bool: True if hard links are supported.
+    """
+    if not hasattr(os, 'link'):
+        return False
+    try:
+        handle, src = tempfile.mkstemp(prefix='.link', dir=src_directory)
+    except OSError:
+        return False
+    os.close(handle)
+    dst = os.path.join(dst_directory, os.path.basename(src) + '.probe')
+    try:
+        os.link(src, dst)
+        return os.stat(src).st_nlink == 2 and linked(src, dst)
+    except OSError:
+        return False
+    finally:
+        for path in (src, dst):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _reflink(src, dst):
+    """ Clones a file's data copy-on-write, raising OSError where the platform or file system does not support it. """
+    if fcntl is not None and sys.platform.startswith('linux'):
+        with open(src, 'rb') as s:
+            with open(dst, 'wb') as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return
+    raise OSError('Reflinks are not supported on %s' % sys.platform)
+
+
+class StoreLock(object):
+    """
+    A readers-writer lock on a store, shared by links and held exclusively by gc.
+    Where fcntl is available it also locks a file, so it excludes other processes using the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextlib.contextmanager
+    def shared(self):
+        """ Holds the lock alongside other shared holders. """
+        with self._condition:
+            while self._writer:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            with self._file(fcntl.LOCK_SH if fcntl is not None else None):
+                yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """ Holds the lock once every other holder has released it. """
+        with self._condition:
+            while self._writer or self._readers > 0:
+                self._condition.wait()
+            self._writer = True
+        try:
+            with self._file(fcntl.LOCK_EX if fcntl is not None else None):
+                yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def _file(self, operation):
+        if operation is None:
+            yield
+            return
+        with open(self.path, 'a') as f:
+            fcntl.flock(f.fileno(), operation)
+            yield  # Closing the file releases the lock
+
+
+class Store(object):
+    """
+    A content addressed store of files that workspaces are hard linked into, so identical files are only kept once.
+    Hard linked files share their data with the store, see ckcmd.detach() before writing to them in place.
+    Workspaces must be able to hard link to the store, check with supports() first.
+    """
+
+    SOURCES = 'sources.json'
+    LOCK = 'lock'
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.objects = os.path.join(self.directory, 'objects')
+        self._sources = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(self.objects):
+            os.makedirs(self.objects)
+        self.lock = StoreLock(os.path.join(self.directory, self.LOCK))
+        try:
+            with open(os.path.join(self.directory, self.SOURCES)) as f:
+                self._sources = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def save(self):
+        """ Saves the digests of source files, so unchanged sources are not hashed again by the next session. """
+        with self._lock:
+            sources = dict(self._sources)
+        try:
+            with open(os.path.join(self.directory, self.SOURCES), 'w') as f:
+                json.dump(sources, f)
+        except (IOError, OSError):
+            pass  # Digests are only an optimization
+
+    def digest(self, path):
+        """
+        Hashes the contents of a file, remembering the digest by the file's size and modification time.
+
+        Args:
+            path(str): A file path.
+
+        Returns:
+            str: A hex digest.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            source = self._sources.get(path)
+        if source is not None and source[:2] == [stat.st_size, stat.st_mtime]:
+            return str(source[2])
+        digest = file_hash(path)
+        with self._lock:
+            self._sources[path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def supports(self, directory):
+        """ Returns True if files can be hard linked from the store into an existing directory. """
+        return can_link(self.objects, directory)
+
+    def path(self, digest):
+        """ Returns the path of the stored file with a digest. """
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def add(self, path):
+        """
+        Copies a file into the store unless a file with the same contents is already stored.
+        Nothing links to the stored file yet, so hold the store's shared lock until it is linked, see link().
+
+        Args:
+            path(str): A file path.
+
+        Returns:
+            str: The stored file path.
+        """
+        blob = self.path(self.digest(path))
+        if os.path.exists(blob):
+            return blob
+        try:
+            os.makedirs(os.path.dirname(blob))
+        except OSError:
+            pass  # Created by another thread
+        handle, staging = tempfile.mkstemp(dir=os.path.dirname(blob))
+        os.close(handle)
+        shutil.copy2(path, staging)
+        try:
+            os.rename(staging, blob)
+        except OSError:
+            # Another extraction stored the same contents first
+            os.remove(staging)
+        return blob
+
+    def link(self, src, dst):
+        """
+        Stores a source file and hard links it to the destination, replacing a destination with different contents.
+        The store's lock is shared while linking, so gc() cannot remove the stored file before it is linked.
+
+        Args:
+            src(str): A source file path.
+            dst(str): A destination file path.
+
+        Returns:
+            bool: True if the destination was linked, False if it was already linked.
+        """
+        with self.lock.shared():
+            blob = self.add(src)
+            if os.path.exists(dst) and linked(blob, dst):
+                return False
+            if not os.path.exists(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            if os.path.lexists(dst):
+                os.remove(dst)
+            os.link(blob, dst)
+            return True
+
+    def gc(self):
+        """
+        Removes stored files that no workspace links to anymore, waiting for links in progress to finish first.
+
+        Returns:
+            tuple: The number of removed files and their size in bytes.
+        """
+        if not self.supports(self.objects):
+            raise StoreException('Cannot count links to files in "%s" on this platform.' % self.directory)
+        count, size = 0, 0
+        with self.lock.exclusive():
+            for root, dirs, filenames in os.walk(self.objects):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    stat = os.stat(path)
+                    if stat.st_nlink == 1:
+                        os.remove(path)
+                        count += 1
+                        size += stat.st_size
+        with self._lock:
+            self._sources = dict((path, source) for path, source in self._sources.items()
+                                 if os.path.exists(self.path(source[2])))
+        self.save()
+        return count, size
+
+
+def sync_file(src, dst, mode=COPY, checksum=False, store=None):
+    """
+    Copies a file unless the destination is already up-to-date.
+    Links fall back to a copy when the source and destination are on different file systems.
+
+    Args:
+        src(str): A source file path.
+        dst(str): A destination file path.
+        mode(str): Either COPY, HARDLINK or REFLINK.
+        checksum(bool): Whether to compare the contents of files with the same size but a different mtime.
+        store(Store): An optional store to link the file from instead, the mode is then ignored.
+
+    Returns:
+        bool: True if the file was copied, False if it was skipped.
+    """
+    if store is not None:
+        return store.link(src, dst)
+    if same_file(src, dst, checksum=checksum):
+        return False
+    if not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if mode == HARDLINK:
+        ckcmd._link(src, dst)
+        return True
+    if mode == REFLINK:
+        try:
+            _reflink(src, dst)
+            return True
+        except (OSError, IOError, AttributeError):
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return True
+
+
+def sync_directory(src, dst, mode=COPY, checksum=False, workers=None, store=None):
+    """
+    Copies every file of a directory that is missing or out of date in the destination, several at a time.
+    Files in the destination that are not in the source are left alone.
+
+    Args:
+        src(str): A source directory.
+        dst(str): A destination directory, created if missing.
+        mode(str): Either COPY, HARDLINK or REFLINK.
+        checksum(bool): Whether to compare the contents of files with the same size but a different mtime.
+        workers(int): The number of files to copy at once, defaults to the cpu count.
+        store(Store): An optional store to link files from instead, the mode is then ignored.
+
+    Returns:
+        tuple: The number of copied and skipped files.
+    """
+    functions = []
+    for root, dirs, filenames in os.walk(src):
+        directory = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for filename in filenames:
+            functions.append(functools.partial(sync_file, os.path.join(root, filename),
+                                               os.path.join(directory, filename), mode=mode, checksum=checksum,
+                                               store=store))
+
+    results = ckcmd.run_parallel(functions, workers=workers)
+    for result, exception in results:
+        if exception is not None:
+            raise exception
+    copied = len([result for result, exception in results if result])
+    return copied, len(results) - copied
+
+
+def main(argv=None):
+    """ Runs store maintenance from the command line. """
+    parser = argparse.ArgumentParser(description='Maintains a store of deduplicated workspace files.')
+    subparsers = parser.add_subparsers(dest='command')
+    gc = subparsers.add_parser('gc', help='Removes stored files no workspace links to anymore.')
+    gc.add_argument('store', help='The store directory.')
+    args = parser.parse_args(argv)
+
+    if args.command == 'gc':
+        count, size = Store(args.store).gc()
+        print 'Removed %s files, %.1f MB' % (count, size / 1024.0 ** 2)
+
+
+class StoreException(BaseException):
+    """ Raised when a store cannot be used on the current platform. """
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+Watches an actor's animation and character assets directories and converts exported fbx files as they change.
+
+Changes are picked up with watchdog when it is installed and by polling otherwise. Bursts of writes are debounced,
+then changed animations are converted together in a single ck-cmd call on a background thread, so Maya never waits
+on a conversion. Run it from Maya with `main.watchActor()` or standalone with `python -m skymaya.watcher`.
+"""
+
+
+import os
+import time
+import shutil
+import argparse
+import threading
+import traceback
+
+from skymaya import ckcmd
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+
+def scan(directory, extension):
+    """
+    Records the size and modification time of every file with an extension in a directory.
+
+    Args:
+        directory(str): A directory path.
+        extension(str): The file extension of files to include.
+
+    Returns:
+        dict: A dictionary of (size, mtime) tuples keyed by file path.
+    """
+    files = {}
+    for relpath, stat in ckcmd.snapshot(directory).items():
+        if relpath.lower().endswith(extension):
+            files[os.path.join(directory, relpath)] = stat
+    return files
+
+
+class _EventHandler(FileSystemEventHandler):
+    """ Forwards watchdog file events to a watcher. """
+
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            self.watcher.touch(getattr(event, 'dest_path', None) or event.src_path)
+
+
+class Watcher(object):
+    """
+    Calls a handler with batches of changed files once the watched directories have been quiet for a debounce
+    period. Batches are handled one at a time on the watcher's thread.
+    """
+
+    def __init__(self, directories, handler, extension='.fbx', interval=1.0, debounce=2.0, polling=False):
+        """
+        Args:
+            directories(list): A list of directories to watch, including sub directories.
+            handler(function): A function called with a list of changed file paths.
+            extension(str): The file extension of files to watch.
+            interval(float): Seconds between checks for changes.
+            debounce(float): Seconds without changes before changed files are handled.
+            polling(bool): Whether to poll even if watchdog is installed.
+        """
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.handler = handler
+        self.extension = extension.lower()
+        self.interval = interval
+        self.debounce = debounce
+        self.polling = polling or Observer is None
+        self._files = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._observer = None
+
+    def touch(self, path):
+        """ Marks a file as changed, restarting its debounce period. """
+        if not path.lower().endswith(self.extension):
+            return
+        with self._lock:
+            self._pending[os.path.abspath(path)] = time.time()
+
+    def poll(self):
+        """ Compares every watched file against the previous scan and marks changed files. """
+        files = {}
+        for directory in self.directories:
+            files.update(scan(directory, self.extension))
+        for path, stat in files.items():
+            if self._files.get(path) != stat:
+                self.touch(path)
+        self._files = files
+
+    def flush(self, force=False):
+        """
+        Handles every pending file once none of them have changed for the debounce period, so a burst of writes is
+        handled as a single batch.
+
+        Args:
+            force(bool): Whether to handle pending files regardless of the debounce period.
+
+        Returns:
+            list: The handled file paths.
+        """
+        with self._lock:
+            if not self._pending or (not force and time.time() - max(self._pending.values()) < self.debounce):
+                return []
+            paths = sorted(self._pending)
+            self._pending = {}
+        paths = [path for path in paths if os.path.exists(path)]
+        if len(paths) > 0:
+            try:
+                self.handler(paths)
+            except BaseException as e:
+                ckcmd.display('Failed to convert %s files: %s' % (len(paths), e))
+        return paths
+
+    def start(self):
+        """ Starts watching in the background. Files that already exist are not handled until they change. """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        for directory in self.directories:
+            self._files.update(scan(directory, self.extension))
+        if not self.polling:
+            self._observer = Observer()
+            for directory in self.directories:
+                self._observer.schedule(_EventHandler(self), directory, recursive=True)
+            self._observer.start()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops watching, handling any pending files first. """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    def running(self):
+        return self._thread is not None
+
+    def _run(self):
+        # Keep watching through unexpected errors, such as a directory removed while it is scanned
+        while not self._stopped.wait(self.interval):
+            try:
+                if self.polling:
+                    self.poll()
+                self.flush()
+            except Exception:
+                ckcmd.display('Watcher failed, retrying:\n%s' % traceback.format_exc())
+        try:
+            self.flush(force=True)
+        except Exception:
+            ckcmd.display('Watcher failed to convert pending files:\n%s' % traceback.format_exc())
+
+
+class ActorConverter(object):
+    """ Converts batches of an actor's changed fbx files to hkx and nif with as few ck-cmd calls as possible. """
+
+    def __init__(self, animation_directory, character_asset_directory, skeleton_hkx, cache_txt='',
+                 behavior_directory='', timeout=None, cache_output=''):
+        """
+        Args:
+            animation_directory(str): The actor's animation directory.
+            character_asset_directory(str): The actor's character assets directory.
+            skeleton_hkx(str): The legacy skeleton hkx animations are converted with.
+            cache_txt(str): An optional cache file to contain root motion data.
+            behavior_directory(str): An optional behavior directory.
+            timeout(float): An optional number of seconds to wait for each ck-cmd process.
+            cache_output(str): Where to copy the updated cache file after each batch, defaults to the cache file.
+        """
+        self.animation_directory = os.path.abspath(animation_directory)
+        self.character_asset_directory = os.path.abspath(character_asset_directory)
+        self.skeleton_hkx = skeleton_hkx
+        self.cache_txt = cache_txt or ''
+        self.cache_output = cache_output or self.cache_txt
+        self.behavior_directory = behavior_directory or ''
+        self.timeout = timeout
+
+    def __call__(self, paths):
+        """ Converts changed fbx files, the rig first so animations and skins use the updated skeleton. """
+        assets = [path for path in paths if path.startswith(self.character_asset_directory + os.sep)]
+        animations = [path for path in paths if path.startswith(self.animation_directory + os.sep)]
+
+        for path in assets:
+            if os.path.basename(path).lower() == 'skeleton.fbx':
+                ckcmd.importrig(path, self.character_asset_directory, timeout=self.timeout)
+        for path in assets:
+            if os.path.basename(path).lower() != 'skeleton.fbx':
+                ckcmd.importskin(path, self.character_asset_directory, timeout=self.timeout)
+
+        if len(animations) == 1:
+            self.import_animations(animations[0])
+        elif len(animations) > 1:
+            # Link the batch into a directory so it converts in one ck-cmd call
+            staging_directory = ckcmd.get_staging_directory(self.animation_directory, 'importanimation')
+            try:
+                ckcmd.stage_files(self.animation_directory,
+                                  [os.path.relpath(path, self.animation_directory) for path in animations],
+                                  staging_directory)
+                self.import_animations(staging_directory)
+            finally:
+                ckcmd.remove_staging_directory(staging_directory)
+        if len(animations) > 0:
+            self.copy_cache()
+
+    def import_animations(self, path):
+        ckcmd.importanimation(self.skeleton_hkx, path, self.animation_directory, cache_txt=self.cache_txt,
+                              behavior_directory=self.behavior_directory, timeout=self.timeout)
+
+    def copy_cache(self):
+        """ Copies the cache file ck-cmd updates next to imported animations over the actor's cache file. """
+        if not self.cache_txt:
+            return
+        path = os.path.join(self.animation_directory, os.path.basename(self.cache_txt))
+        if not os.path.exists(path) or os.path.abspath(path) == os.path.abspath(self.cache_output):
+            return
+        if not os.path.exists(os.path.dirname(self.cache_output)):
+            os.makedirs(os.path.dirname(self.cache_output))
+        ckcmd.detach(self.cache_output)
+        shutil.copyfile(path, self.cache_output)
+
+
+def watch_actor(animation_directory, character_asset_directory, skeleton_hkx, cache_txt='', behavior_directory='',
+                interval=1.0, debounce=2.0, timeout=None, polling=False, cache_output=''):
+    """
+    Starts converting an actor's fbx files whenever they change, see ActorConverter.
+
+    Returns:
+        Watcher: The running watcher, stop it with Watcher.stop().
+    """
+    converter = ActorConverter(animation_directory, character_asset_directory, skeleton_hkx, cache_txt=cache_txt,
+                               behavior_directory=behavior_directory, timeout=timeout, cache_output=cache_output)
+    watcher = Watcher([animation_directory, character_asset_directory], converter, interval=interval,
+                      debounce=debounce, polling=polling)
+    watcher.start()
+    return watcher
+
+
+def main(argv=None):
+    """ Runs a watcher from the command line until interrupted. """
+    parser = argparse.ArgumentParser(description='Converts an actor\'s fbx files to hkx and nif as they change.')
+    parser.add_argument('animations', help='The actor\'s animation directory.')
+    parser.add_argument('assets', help='The actor\'s character assets directory.')
+    parser.add_argument('--skeleton', required=True, help='The legacy skeleton hkx to convert animations with.')
+    parser.add_argument('--cache', default='', help='The actor\'s animation data cache file.')
+    parser.add_argument('--behaviors', default='', help='The actor\'s behavior directory.')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between checks for changes.')
+    parser.add_argument('--debounce', type=float, default=2.0, help='Seconds a file must be unchanged for.')
+    parser.add_argument('--polling', action='store_true', help='Poll even if watchdog is installed.')
+    args = parser.parse_args(argv)
+
+    watcher = watch_actor(args.animations, args.assets, args.skeleton, cache_txt=args.cache,
+                          behavior_directory=args.behaviors, interval=args.interval, debounce=args.debounce,
+                          polling=args.polling)
+    print 'Watching %s and %s' % (args.animations, args.assets)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == '__main__':
+    main()
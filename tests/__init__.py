@@ -0,0 +1,31 @@
+"""
+Tests for the Maya-free skymaya modules.
+
+The scripts directory is installed into Maya as the skymaya package, so it is registered under that name here.
+Run from the repository root with `python -m unittest discover -s tests -t .` on Python 2.7.
+"""
+
+
+import os
+import sys
+import types
+
+if 'skymaya' not in sys.modules:
+    package = types.ModuleType('skymaya')
+    package.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts')]
+    sys.modules['skymaya'] = package
+
+
+def write(path, data=b''):
+    """ Writes a file, creating its directory if needed. """
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def read(path):
+    """ Reads a file's contents. """
+    with open(path, 'rb') as f:
+        return f.read()
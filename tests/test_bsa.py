@@ -0,0 +1,195 @@
+import os
+import zlib
+import shutil
+import struct
+import tempfile
+import unittest
+
+from skymaya import bsa
+
+
+def write_archive(path, files, compress=True, embed=False):
+    """ Writes a Skyrim archive independently of bsa.pack, with records in sorted rather than hash order. """
+    folders = {}
+    for name, data in sorted(files.items()):
+        folder, filename = name.rsplit('\\', 1)
+        folders.setdefault(folder, []).append((filename, data))
+    flags = bsa.INCLUDE_DIRECTORY_NAMES | bsa.INCLUDE_FILE_NAMES | (bsa.COMPRESSED if compress else 0) | \
+        (bsa.EMBED_FILE_NAMES if embed else 0)
+    file_names = b''.join(filename.encode('cp1252') + b'\x00'
+                          for folder in sorted(folders) for filename, data in folders[folder])
+    records_offset = bsa.HEADER.size + len(folders) * bsa.FOLDER_RECORD[bsa.SKYRIM].size
+    data_offset = records_offset + len(file_names) + sum(
+        2 + len(folder) + len(entries) * bsa.FILE_RECORD.size for folder, entries in folders.items())
+
+    folder_records, blocks, datas = b'', b'', b''
+    for folder in sorted(folders):
+        folder_records += bsa.FOLDER_RECORD[bsa.SKYRIM].pack(
+            bsa.hash_name(folder), len(folders[folder]), records_offset + len(blocks) + len(file_names))
+        blocks += struct.pack('<B', len(folder) + 1) + folder.encode('cp1252') + b'\x00'
+        for filename, data in folders[folder]:
+            payload = b''
+            if embed:
+                full = ('%s\\%s' % (folder, filename)).encode('cp1252')
+                payload += struct.pack('<B', len(full)) + full
+            payload += struct.pack('<I', len(data)) + zlib.compress(data) if compress else data
+            blocks += bsa.FILE_RECORD.pack(bsa.hash_file(filename), len(payload), data_offset + len(datas))
+            datas += payload
+    header = bsa.HEADER.pack(b'BSA\x00', bsa.SKYRIM, bsa.HEADER.size, flags, len(folders), len(files),
+                             sum(len(folder) + 1 for folder in folders), len(file_names), 0)
+    with open(path, 'wb') as f:
+        f.write(header + folder_records + blocks + file_names + datas)
+    return path
+
+
+FILES = {
+    'meshes\\actors\\wolf\\character assets\\skeleton.hkx': b'skeleton' * 64,
+    'meshes\\actors\\wolf\\animations\\run.hkx': b'run' * 100,
+    'meshes\\actors\\wolf\\animations\\walk.hkx': b'',
+    'textures\\actors\\wolf\\wolf.dds': os.urandom(512),
+}
+
+
+class HashTests(unittest.TestCase):
+
+    def test_short_names(self):
+        self.assertEqual(bsa.hash_name(''), 0)
+        self.assertEqual(bsa.hash_name('a'), ord('a') | 1 << 16 | ord('a') << 24)
+        self.assertEqual(bsa.hash_name('ab'), ord('b') | 2 << 16 | ord('a') << 24)
+        self.assertEqual(bsa.hash_name('abc'), ord('c') | ord('b') << 8 | 3 << 16 | ord('a') << 24)
+
+    def test_long_names_hash_their_middle(self):
+        self.assertNotEqual(bsa.hash_name('axxxyz'), bsa.hash_name('axyxyz'))
+        self.assertEqual(bsa.hash_name('axxxyz') & 0xFFFFFFFF, bsa.hash_name('axyxyz') & 0xFFFFFFFF)
+
+    def test_extensions(self):
+        self.assertEqual(bsa.hash_file('skeleton.nif') & 0x8000, 0x8000)
+        self.assertNotEqual(bsa.hash_file('skeleton.nif'), bsa.hash_file('skeleton.hkx'))
+        self.assertEqual(bsa.hash_file('skeleton.hkx'), bsa.hash_name('skeleton', '.hkx'))
+        self.assertLess(bsa.hash_file('skeleton.hkx'), 2 ** 64)
+
+    def test_normalize(self):
+        self.assertEqual(bsa.normalize('/Meshes/Actors/Wolf/'), 'meshes\\actors\\wolf')
+
+
+class ArchiveTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def assertArchive(self, path, files):
+        with bsa.Archive(path) as archive:
+            self.assertEqual(archive.files(), sorted(files))
+            for name, data in files.items():
+                self.assertEqual(archive.read(name), data)
+
+    def test_read(self):
+        for compress in (True, False):
+            for embed in (True, False):
+                path = write_archive(os.path.join(self.directory, 'test.bsa'), FILES, compress=compress, embed=embed)
+                self.assertArchive(path, FILES)
+
+    def test_files_and_lookup(self):
+        path = write_archive(os.path.join(self.directory, 'test.bsa'), FILES)
+        with bsa.Archive(path) as archive:
+            self.assertEqual(archive.files('Meshes/Actors/Wolf/Animations'), [
+                'meshes\\actors\\wolf\\animations\\run.hkx', 'meshes\\actors\\wolf\\animations\\walk.hkx'])
+            self.assertTrue('MESHES/actors/wolf/animations/run.hkx' in archive)
+            self.assertRaises(bsa.BsaException, archive.read, 'meshes\\missing.hkx')
+
+    def test_not_an_archive(self):
+        path = os.path.join(self.directory, 'test.bsa')
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * 64)
+        self.assertRaises(bsa.BsaException, bsa.Archive, path)
+
+    def test_pack_round_trip(self):
+        sources = {}
+        for name, data in FILES.items():
+            sources[name] = os.path.join(self.directory, 'data', *name.split('\\'))
+            if not os.path.isdir(os.path.dirname(sources[name])):
+                os.makedirs(os.path.dirname(sources[name]))
+            with open(sources[name], 'wb') as f:
+                f.write(data)
+        for compress in (True, False):
+            path = os.path.join(self.directory, 'packed%s.bsa' % compress)
+            self.assertEqual(bsa.pack(sources, path, compress=compress, processes=1), 0)
+            self.assertArchive(path, FILES)
+
+    def test_pack_reuses_unchanged_files(self):
+        sources = {}
+        for name in ('meshes\\a\\one.hkx', 'meshes\\a\\two.hkx'):
+            sources[name] = os.path.join(self.directory, name.replace('\\', '_'))
+            with open(sources[name], 'wb') as f:
+                f.write(name.encode('utf-8'))
+        path = os.path.join(self.directory, 'packed.bsa')
+        bsa.pack(sources, path, processes=1)
+
+        with open(sources['meshes\\a\\two.hkx'], 'wb') as f:
+            f.write(b'changed')
+        os.utime(sources['meshes\\a\\two.hkx'], (0, 0))
+        self.assertEqual(bsa.pack(sources, path, processes=1), 1)
+        self.assertArchive(path, {'meshes\\a\\one.hkx': b'meshes\\a\\one.hkx', 'meshes\\a\\two.hkx': b'changed'})
+
+    def test_pack_replaces_corrupt_archive(self):
+        sources = {'meshes\\a\\one.hkx': os.path.join(self.directory, 'one.hkx')}
+        with open(sources['meshes\\a\\one.hkx'], 'wb') as f:
+            f.write(b'one')
+        path = os.path.join(self.directory, 'packed.bsa')
+        bsa.pack(sources, path, processes=1)
+        with open(path, 'r+b') as f:
+            f.truncate(16)
+        self.assertEqual(bsa.pack(sources, path, processes=1), 0)
+        self.assertArchive(path, {'meshes\\a\\one.hkx': b'one'})
+
+    def test_pack_failure_removes_temporary_archive(self):
+        path = os.path.join(self.directory, 'packed.bsa')
+        self.assertRaises(EnvironmentError, bsa.pack, {'meshes\\a\\one.hkx': self.directory}, path, processes=1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_extract(self):
+        first = write_archive(os.path.join(self.directory, 'a.bsa'), FILES)
+        second = write_archive(os.path.join(self.directory, 'b.bsa'), {
+            'meshes\\actors\\wolf\\animations\\run.hkx': b'overridden',
+            'meshes\\actors\\wolf\\animations\\idle.hkx': b'idle'})
+        output = os.path.join(self.directory, 'output')
+        with bsa.Archive(first) as a:
+            with bsa.Archive(second) as b:
+                paths = bsa.extract_files([a, b], lambda path: path.startswith('meshes\\actors\\wolf\\animations'),
+                                          output)
+        animations = os.path.join(output, 'meshes', 'actors', 'wolf', 'animations')
+        self.assertEqual(sorted(paths), [os.path.join(animations, name)
+                                         for name in ('idle.hkx', 'run.hkx', 'walk.hkx')])
+        with open(os.path.join(animations, 'run.hkx'), 'rb') as f:
+            self.assertEqual(f.read(), b'overridden')
+
+    def test_load_order(self):
+        names = ['Update.bsa', 'Skyrim - Meshes.bsa', 'Plugin.bsa', 'Skyrim - Animations.bsa', 'Dawnguard.bsa',
+                 'Skyrim - Meshes0.bsa', 'Skyrim - Textures.bsa', 'readme.txt']
+        for name in names:
+            open(os.path.join(self.directory, name), 'wb').close()
+        self.assertEqual([os.path.basename(path) for path in bsa.find_archives(self.directory)], [
+            'Skyrim - Textures.bsa', 'Skyrim - Animations.bsa', 'Skyrim - Meshes.bsa', 'Skyrim - Meshes0.bsa',
+            'Update.bsa', 'Dawnguard.bsa', 'Plugin.bsa'])
+
+    @unittest.skipUnless(hasattr(os, 'link'), 'Requires hard links')
+    def test_extract_replaces_linked_files(self):
+        path = write_archive(os.path.join(self.directory, 'a.bsa'), FILES)
+        output = os.path.join(self.directory, 'output')
+        name = 'meshes\\actors\\wolf\\animations\\run.hkx'
+        shared = os.path.join(self.directory, 'shared.hkx')
+        with open(shared, 'wb') as f:
+            f.write(b'shared')
+        os.makedirs(os.path.join(output, 'meshes', 'actors', 'wolf', 'animations'))
+        os.link(shared, os.path.join(output, *name.split('\\')))
+        with bsa.Archive(path) as archive:
+            archive.extract(name, output)
+        with open(shared, 'rb') as f:
+            self.assertEqual(f.read(), b'shared')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+import os
+import functools
+import shutil
+import tempfile
+import threading
+import unittest
+
+from skymaya import ckcmd
+from skymaya import fakeckcmd
+from tests import read, write
+
+
+class CacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER
+        ckcmd.set_executable(os.path.splitext(fakeckcmd.__file__)[0] + '.py')
+        ckcmd.LEDGER = None
+        ckcmd.SERVER = None
+        self.cache = ckcmd.enable_cache(os.path.join(self.directory, 'cache'))
+        self.skeleton = write(os.path.join(self.directory, 'skeleton.hkx'), b'skeleton')
+        self.animation = write(os.path.join(self.directory, 'animations', 'run.fbx'), b'run')
+        self.cache_txt = write(os.path.join(self.directory, 'animationdata', 'wolf.txt'), b'cache')
+
+    def tearDown(self):
+        ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER = self.settings
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store_and_restore(self):
+        output = os.path.join(self.directory, 'output')
+        written = [write(os.path.join(output, 'run.hkx'), b'run'), write(os.path.join(output, 'wolf.txt'), b'cache')]
+        write(os.path.join(output, 'walk.hkx'), b'walk')
+        self.cache.store('key', output, written)
+
+        restored = os.path.join(self.directory, 'restored')
+        self.assertFalse(self.cache.restore('missing', restored))
+        self.assertTrue(self.cache.restore('key', restored))
+        self.assertEqual(sorted(os.listdir(restored)), ['run.hkx', 'wolf.txt'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_hit_restores_only_own_outputs(self):
+        # Another conversion writes to the same directory while this one runs
+        output = os.path.join(self.directory, 'output')
+        os.makedirs(output)
+        other = os.path.join(output, 'walk.hkx')
+        ckcmd.importanimation(self.skeleton, self.animation, output, cache_txt=self.cache_txt,
+                              callback=lambda line: write(other, b'walk'))
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(self.cache.misses, 1)
+
+        restored = os.path.join(self.directory, 'restored')
+        os.makedirs(restored)
+        ckcmd.importanimation(self.skeleton, self.animation, restored, cache_txt=self.cache_txt)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(sorted(os.listdir(restored)), ['run.hkx', 'wolf.txt'])
+        self.assertEqual(read(os.path.join(restored, 'run.hkx')), read(os.path.join(output, 'run.hkx')))
+
+    def test_rig_restores_legacy_skeleton(self):
+        skeleton_fbx = write(os.path.join(self.directory, 'rig', 'skeleton.fbx'), b'rig')
+        outputs = [os.path.join(self.directory, name) for name in ('output', 'restored')]
+        for output in outputs:
+            os.makedirs(output)
+            ckcmd.importrig(skeleton_fbx, output)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(sorted(os.listdir(outputs[1])), ['skeleton.hkx', 'skeleton.nif', 'skeleton_le.hkx'])
+
+    def test_incomplete_conversions_are_not_stored(self):
+        output = os.path.join(self.directory, 'output')
+        os.makedirs(output)
+        empty = os.path.join(self.directory, 'empty')
+        os.makedirs(empty)
+        for _ in range(2):
+            ckcmd.importanimation(self.skeleton, empty, output)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+        # Entries without files are discarded rather than restored
+        self.cache.store('key', output, [])
+        self.assertFalse(self.cache.restore('key', output))
+        self.assertFalse(os.path.exists(os.path.join(self.cache.directory, 'key')))
+
+    def test_changed_input_misses(self):
+        output = os.path.join(self.directory, 'output')
+        os.makedirs(output)
+        ckcmd.importanimation(self.skeleton, self.animation, output)
+        write(self.animation, b'sprint')
+        ckcmd.importanimation(self.skeleton, self.animation, output)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+
+class LedgerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER
+        ckcmd.set_executable(os.path.splitext(fakeckcmd.__file__)[0] + '.py')
+        ckcmd.CACHE = None
+        ckcmd.SERVER = None
+        self.ledger = os.path.join(self.directory, 'ledger.jsonl')
+        ckcmd.enable_ledger(self.ledger)
+        self.skeleton = write(os.path.join(self.directory, 'skeleton.hkx'), b'skeleton')
+        self.animations = os.path.join(self.directory, 'animations')
+        for name in ('run', 'walk'):
+            write(os.path.join(self.animations, '%s.hkx' % name), name.encode('utf-8'))
+        self.tags = os.path.join(self.directory, 'tags')
+        os.makedirs(self.tags)
+
+    def tearDown(self):
+        ckcmd.CKCMD, ckcmd.CACHE, ckcmd.LEDGER, ckcmd.SERVER = self.settings
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_staged_conversions_record_sources(self):
+        staging_directory = ckcmd.get_staging_directory(self.animations, 'exportanimation')
+        try:
+            ckcmd.stage_files(self.animations, ['run.hkx', 'walk.hkx'], staging_directory)
+            ckcmd.exportanimation(self.skeleton, staging_directory, self.tags)
+        finally:
+            ckcmd.remove_staging_directory(staging_directory)
+        entry, = ckcmd.read_ledger()
+        self.assertEqual(entry['subject'], self.animations)
+        self.assertEqual(sorted(filename for filename, seconds in entry['files']), ['run.hkx', 'walk.hkx'])
+        self.assertIn(os.path.join(self.animations, 'walk.hkx'), ckcmd.report())
+        self.assertEqual(ckcmd.STAGED, {})
+
+    def test_report_includes_rotated_ledger(self):
+        ckcmd.exportanimation(self.skeleton, self.animations, self.tags)
+        os.rename(self.ledger, self.ledger + '.1')
+        ckcmd.exportanimation(self.skeleton, self.animations, self.tags)
+        self.assertEqual(len(ckcmd.read_ledger()), 2)
+
+
+class DisplayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = ckcmd.maya_utils, ckcmd._print
+        self.deferred = []
+        self.printed = []
+        ckcmd.maya_utils = type('utils', (object,), {'executeDeferred': staticmethod(self.deferred.append)})
+        ckcmd._print = self.printed.append
+
+    def tearDown(self):
+        ckcmd.maya_utils, ckcmd._print = self.settings
+        del ckcmd.DISPLAY_BUFFER[:]
+
+    def test_background_lines_are_batched(self):
+        thread = threading.Thread(target=lambda: [ckcmd.display('Converting %s.hkx' % i) for i in range(100)])
+        thread.start()
+        thread.join()
+        self.assertEqual(len(self.deferred), 1)
+        self.deferred[0]()
+        self.assertEqual(self.printed, ['\n'.join('Converting %s.hkx' % i for i in range(100))])
+
+
+class ParallelTests(unittest.TestCase):
+
+    def test_failures_are_collected(self):
+        def fail():
+            raise ckcmd.CkCmdException('failed')
+
+        results = ckcmd.run_parallel([lambda: 1, fail, lambda: 3], workers=2)
+        self.assertEqual([result for result, exception in results], [1, None, 3])
+        self.assertIsInstance(results[1][1], ckcmd.CkCmdException)
+
+    def test_interrupts_stop_the_batch(self):
+        calls = []
+
+        def interrupt():
+            raise KeyboardInterrupt()
+
+        functions = [interrupt] + [functools.partial(calls.append, index) for index in range(10)]
+        self.assertRaises(KeyboardInterrupt, ckcmd.run_parallel, functions, workers=1)
+        self.assertEqual(calls, [])
+
+
+class IncrementalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.animations = os.path.join(self.directory, 'animations')
+        self.tags = os.path.join(self.directory, 'tags')
+        self.skeleton = write(os.path.join(self.directory, 'skeleton.hkx'), b'skeleton')
+        for name in ('run', 'walk'):
+            write(os.path.join(self.animations, '%s.hkx' % name), name.encode('utf-8'))
+            os.utime(os.path.join(self.animations, '%s.hkx' % name), (1000, 1000))
+        os.utime(self.skeleton, (1000, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_stale_files(self):
+        self.assertEqual(ckcmd.stale_files(self.animations, '.hkx', self.tags, '.fbx'), (['run.hkx', 'walk.hkx'], 2))
+        write(os.path.join(self.tags, 'run.fbx'), b'run')
+        self.assertEqual(ckcmd.stale_files(self.animations, '.hkx', self.tags, '.fbx'), (['walk.hkx'], 2))
+
+        # A newer dependency makes every output stale
+        os.utime(self.skeleton, None)
+        os.utime(os.path.join(self.tags, 'run.fbx'), (2000, 2000))
+        self.assertEqual(ckcmd.stale_files(self.animations, '.hkx', self.tags, '.fbx', dependencies=[self.skeleton]),
+                         (['run.hkx', 'walk.hkx'], 2))
+
+    def test_staging_directories_are_private(self):
+        first = ckcmd.get_staging_directory(self.animations, 'exportanimation')
+        second = ckcmd.get_staging_directory(self.animations, 'exportanimation')
+        try:
+            self.assertNotEqual(first, second)
+            self.assertEqual(os.path.basename(first), 'animations')
+            ckcmd.stage_files(self.animations, ['run.hkx'], first)
+            ckcmd.stage_files(self.animations, ['walk.hkx'], second)
+            self.assertEqual(os.listdir(first), ['run.hkx'])
+            self.assertEqual(read(os.path.join(second, 'walk.hkx')), b'walk')
+        finally:
+            ckcmd.remove_staging_directory(first)
+            ckcmd.remove_staging_directory(second)
+        self.assertFalse(os.path.exists(os.path.dirname(first)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from skymaya import dataindex
+from tests import write
+
+
+class DataIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.animations = os.path.join(self.root, 'meshes', 'actors', 'wolf', 'animations')
+        write(os.path.join(self.animations, 'run.hkx'))
+        write(os.path.join(self.root, 'meshes', 'actors', 'wolf', 'character assets', 'skeleton.hkx'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_find(self):
+        index = dataindex.DataIndex()
+        self.assertEqual(index.find_directory(self.root, ['meshes', 'actors', None, 'animations']), self.animations)
+        self.assertEqual(index.find_directory(self.root, ['meshes', ['dlc01', 'actors']]),
+                         os.path.join(self.root, 'meshes', 'actors'))
+        self.assertIsNone(index.find_directory(self.root, ['textures']))
+        self.assertEqual(index.find_file(self.root, 'skeleton'),
+                         os.path.join(self.root, 'meshes', 'actors', 'wolf', 'character assets', 'skeleton.hkx'))
+        self.assertEqual(index.listdir(os.path.join(self.root, 'missing')), [])
+
+    def test_relists_changed_directories(self):
+        index = dataindex.DataIndex()
+        self.assertEqual(index.listdir(self.animations), ['run.hkx'])
+        write(os.path.join(self.animations, 'walk.hkx'))
+        os.utime(self.animations, (1000000010, 1000000010))
+        self.assertEqual(sorted(index.listdir(self.animations)), ['run.hkx', 'walk.hkx'])
+
+    def test_manifest_round_trip(self):
+        # Whole second mtimes survive being set again with utime
+        os.utime(self.animations, (1000000000, 1000000000))
+        index = dataindex.DataIndex()
+        index.load(self.root)
+        self.assertEqual(index.listdir(self.animations), ['run.hkx'])
+        index.save()
+        self.assertTrue(os.path.exists(os.path.join(self.root, dataindex.DataIndex.MANIFEST)))
+
+        # A new session uses the saved listing while the directory's mtime is unchanged
+        write(os.path.join(self.animations, 'walk.hkx'))
+        os.utime(self.animations, (1000000000, 1000000000))
+        index = dataindex.DataIndex()
+        index.load(self.root)
+        self.assertEqual(index.roots(), [self.root])
+        self.assertEqual(index.listdir(self.animations), ['run.hkx'])
+
+        # Once the mtime changes the directory is listed again
+        os.utime(self.animations, (1000000010, 1000000010))
+        self.assertEqual(sorted(index.listdir(self.animations)), ['run.hkx', 'walk.hkx'])
+
+    def test_invalid_manifest(self):
+        write(os.path.join(self.root, dataindex.DataIndex.MANIFEST), b'{')
+        index = dataindex.DataIndex()
+        index.load(self.root)
+        self.assertEqual(index.listdir(self.animations), ['run.hkx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
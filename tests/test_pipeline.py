@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from skymaya import pipeline
+from tests import write
+
+
+class PipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_dependency_order(self):
+        calls = []
+        graph = pipeline.Pipeline()
+        graph.add('rig', lambda: calls.append('rig'))
+        graph.add('skin', lambda: calls.append('skin'), dependencies=['rig'])
+        graph.add('animation', lambda: calls.append('animation'), dependencies=['rig'])
+        self.assertEqual(graph.run(workers=2), [])
+        self.assertEqual(calls[0], 'rig')
+        self.assertEqual(sorted(calls[1:]), ['animation', 'skin'])
+        self.assertRaises(pipeline.PipelineException, graph.add, 'cache', lambda: None, dependencies=['missing'])
+
+    def test_failures_block_dependents(self):
+        def fail():
+            raise ValueError('failed')
+
+        graph = pipeline.Pipeline()
+        graph.add('rig', fail)
+        graph.add('animation', lambda: None, dependencies=['rig'])
+        graph.add('skin', lambda: None)
+        self.assertEqual(graph.run(), [graph.nodes['rig']])
+        self.assertEqual([node.status for node in graph.nodes.values()], ['failed', 'blocked', 'done'])
+
+    def test_skips_up_to_date(self):
+        source = write(os.path.join(self.directory, 'skeleton.fbx'), b'fbx')
+        output = write(os.path.join(self.directory, 'skeleton.hkx'), b'hkx')
+        os.utime(source, (0, 0))
+        graph = pipeline.Pipeline()
+        graph.add('rig', lambda: None, inputs=[source], outputs=[output])
+        graph.run()
+        self.assertEqual(graph.nodes['rig'].status, 'skipped')
+        graph.run(force=True)
+        self.assertEqual(graph.nodes['rig'].status, 'done')
+
+
+class JournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, 'tags')
+        os.makedirs(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_resume_skips_completed(self):
+        calls = []
+
+        def convert(name):
+            calls.append(name)
+            write(os.path.join(self.output, '%s.fbx' % name), name.encode('utf-8'))
+
+        def fail():
+            raise ValueError('failed')
+
+        journal = pipeline.Journal(self.directory)
+        self.assertTrue(journal.run(None, 'wolf', 'animations', self.output, lambda: convert('wolf')))
+        self.assertRaises(ValueError, journal.run, None, 'bear', 'animations', self.output, fail)
+
+        # A resumed journal only runs failed and missing steps
+        journal = pipeline.Journal(self.directory)
+        self.assertFalse(journal.run(None, 'wolf', 'animations', self.output, lambda: convert('wolf')))
+        self.assertTrue(journal.run(None, 'bear', 'animations', self.output, lambda: convert('bear')))
+        self.assertEqual(calls, ['wolf', 'bear'])
+
+        # Steps whose outputs changed since are run again
+        write(os.path.join(self.output, 'wolf.fbx'), b'edited')
+        self.assertFalse(journal.completed(None, 'wolf', 'animations'))
+
+        journal.clear()
+        self.assertFalse(pipeline.Journal(self.directory).completed(None, 'bear', 'animations'))
+
+    def test_partial_lines_are_ignored(self):
+        journal = pipeline.Journal(self.directory)
+        journal.record(None, 'wolf', 'rig', 'done')
+        with open(journal.path, 'a') as f:
+            f.write('{"dlc": null, "actor": "bear"')
+        self.assertTrue(pipeline.Journal(self.directory).completed(None, 'wolf', 'rig'))
+
+
+if __name__ == '__main__':
+    unittest.main()
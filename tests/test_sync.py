@@ -0,0 +1,143 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from skymaya import ckcmd
+from skymaya import sync
+from tests import read, write
+
+
+class SyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.src = os.path.join(self.directory, 'src')
+        self.dst = os.path.join(self.directory, 'dst')
+        write(os.path.join(self.src, 'skeleton.hkx'), b'skeleton')
+        write(os.path.join(self.src, 'animations', 'run.hkx'), b'run')
+        write(os.path.join(self.src, 'animations', 'walk.hkx'), b'walk')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_same_file(self):
+        src = os.path.join(self.src, 'skeleton.hkx')
+        dst = os.path.join(self.directory, 'copy.hkx')
+        self.assertFalse(sync.same_file(src, dst))
+        shutil.copy2(src, dst)
+        self.assertTrue(sync.same_file(src, dst))
+
+        # Same size but a different mtime is only up-to-date if the contents match
+        os.utime(dst, (0, 0))
+        self.assertFalse(sync.same_file(src, dst))
+        self.assertTrue(sync.same_file(src, dst, checksum=True))
+        write(dst, b'SKELETON')
+        os.utime(dst, (0, 0))
+        self.assertFalse(sync.same_file(src, dst, checksum=True))
+
+    def test_sync_directory(self):
+        self.assertEqual(sync.sync_directory(self.src, self.dst, workers=2), (3, 0))
+        self.assertEqual(read(os.path.join(self.dst, 'animations', 'run.hkx')), b'run')
+
+        # Only changed files are copied again, and extra destination files are left alone
+        write(os.path.join(self.dst, 'extra.hkx'), b'extra')
+        write(os.path.join(self.src, 'animations', 'run.hkx'), b'sprint')
+        self.assertEqual(sync.sync_directory(self.src, self.dst, workers=2), (1, 2))
+        self.assertEqual(read(os.path.join(self.dst, 'animations', 'run.hkx')), b'sprint')
+        self.assertTrue(os.path.exists(os.path.join(self.dst, 'extra.hkx')))
+
+    def test_sync_modes(self):
+        for mode in (sync.COPY, sync.HARDLINK, sync.REFLINK):
+            dst = os.path.join(self.dst, mode)
+            self.assertEqual(sync.sync_directory(self.src, dst, mode=mode), (3, 0))
+            self.assertEqual(read(os.path.join(dst, 'skeleton.hkx')), b'skeleton')
+            self.assertEqual(sync.sync_directory(self.src, dst, mode=mode), (0, 3))
+
+    @unittest.skipUnless(hasattr(os, 'link'), 'Requires hard links')
+    def test_detach(self):
+        src = os.path.join(self.src, 'skeleton.hkx')
+        dst = os.path.join(self.directory, 'linked.hkx')
+        os.link(src, dst)
+        self.assertTrue(ckcmd.detach(dst))
+        self.assertFalse(ckcmd.detach(dst))
+        write(dst, b'edited')
+        self.assertEqual(read(src), b'skeleton')
+
+
+class StoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = sync.Store(os.path.join(self.directory, 'store'))
+        self.src = os.path.join(self.directory, 'src')
+        write(os.path.join(self.src, 'a.hkx'), b'shared')
+        write(os.path.join(self.src, 'b.hkx'), b'shared')
+        write(os.path.join(self.src, 'c.hkx'), b'unique')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def count(self):
+        return sum(len(filenames) for root, dirs, filenames in os.walk(self.store.objects))
+
+    def test_add(self):
+        a = self.store.add(os.path.join(self.src, 'a.hkx'))
+        b = self.store.add(os.path.join(self.src, 'b.hkx'))
+        self.assertEqual(a, b)
+        self.assertEqual(read(a), b'shared')
+        self.assertEqual(self.count(), 1)
+
+        # Digests are remembered across sessions
+        self.store.save()
+        self.assertEqual(sync.Store(self.store.directory)._sources, self.store._sources)
+
+    @unittest.skipUnless(sync.can_link(tempfile.gettempdir(), tempfile.gettempdir()), 'Requires hard links')
+    def test_link_and_gc(self):
+        workspaces = [os.path.join(self.directory, name) for name in ('one', 'two')]
+        for workspace in workspaces:
+            os.makedirs(workspace)
+            self.assertTrue(self.store.supports(workspace))
+            self.assertEqual(sync.sync_directory(self.src, workspace, store=self.store), (3, 0))
+            self.assertEqual(sync.sync_directory(self.src, workspace, store=self.store), (0, 3))
+        self.assertEqual(self.count(), 2)
+        self.assertTrue(sync.linked(os.path.join(workspaces[0], 'a.hkx'), os.path.join(workspaces[1], 'b.hkx')))
+
+        # Stored files are only removed once no workspace links to them
+        self.assertEqual(self.store.gc(), (0, 0))
+        for workspace in workspaces:
+            os.remove(os.path.join(workspace, 'c.hkx'))
+        self.assertEqual(self.store.gc(), (1, len(b'unique')))
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(read(os.path.join(workspaces[1], 'a.hkx')), b'shared')
+
+    @unittest.skipUnless(sync.can_link(tempfile.gettempdir(), tempfile.gettempdir()), 'Requires hard links')
+    def test_gc_waits_for_links(self):
+        # A stored file is not linked to anything until link() finishes
+        collected = []
+        with self.store.lock.shared():
+            self.store.add(os.path.join(self.src, 'c.hkx'))
+            thread = threading.Thread(target=lambda: collected.append(sync.Store(self.store.directory).gc()))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(self.count(), 1)
+        thread.join()
+        self.assertEqual(collected, [(1, len(b'unique'))])
+
+    def test_without_hard_links(self):
+        link = getattr(os, 'link', None)
+        if link is not None:
+            del os.link
+        try:
+            self.assertFalse(self.store.supports(self.directory))
+            self.assertRaises(sync.StoreException, self.store.gc)
+        finally:
+            if link is not None:
+                os.link = link
+        self.assertEqual(sorted(os.listdir(self.directory)), ['src', 'store'])  # Probe files are cleaned up
+
+
+if __name__ == '__main__':
+    unittest.main()